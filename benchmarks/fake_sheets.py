@@ -0,0 +1,245 @@
+"""
+Stand-in local de l'API Google Sheets (values get/update/append/batchGet/batchUpdate/
+batchClear, spreadsheets get/batchUpdate appendDimension) pour les benchmarks et tests de
+charge, sans dépendance Google.
+
+FakeSheetsBackend garde les onglets en mémoire ; FakeSheetsService expose l'API chaînée
+de googleapiclient (service.spreadsheets().values().get(...).execute()) au-dessus d'un
+backend local ou d'un proxy multiprocessing (voir shared_backend).
+"""
+import json
+import re
+import threading
+from multiprocessing.managers import BaseManager
+
+
+def _col_to_index(col):
+    index = 0
+    for char in col:
+        index = index * 26 + (ord(char) - ord("A") + 1)
+    return index - 1
+
+
+def parse_range(range_name):
+    sheet_name, _, cells = range_name.rpartition("!")
+    sheet_name = sheet_name.strip("'").replace("''", "'")
+    start, _, end = cells.partition(":")
+    start_match = re.match(r"^([A-Za-z]+)(\d*)$", start)
+    first_col = _col_to_index(start_match.group(1).upper())
+    first_row = int(start_match.group(2) or 1)
+    if end:
+        end_match = re.match(r"^([A-Za-z]+)(\d*)$", end)
+        last_col = _col_to_index(end_match.group(1).upper())
+        last_row = int(end_match.group(2)) if end_match.group(2) else None
+    else:
+        last_col, last_row = first_col, first_row
+    return sheet_name, first_col, first_row, last_col, last_row
+
+
+def seed_rows(row_count, used_fraction=0.0, with_order_id=True, prefix="KEY"):
+    header = ["key", "used", "mail", "date"] + (["order_id"] if with_order_id else [])
+    used_rows = int(row_count * used_fraction)
+    rows = [header]
+    for i in range(row_count):
+        used = i < used_rows
+        row = [f"{prefix}-{i:08d}", "true" if used else "false", "seed@example.com" if used else "", "", ""]
+        rows.append(row if with_order_id else row[:4])
+    return rows
+
+
+class FakeSheetsError(Exception):
+    pass
+
+
+class FakeSheetsBackend:
+    # Comme un onglet Google : une grille de taille fixe (1000 lignes par défaut), que values().update
+    # ne peut pas dépasser ; append (INSERT_ROWS) et appendDimension l'agrandissent
+    def __init__(self, tabs=None, count_bytes=True, grid_rows=1000):
+        self.tabs = {name: [list(row) for row in rows] for name, rows in (tabs or {}).items()}
+        self.default_grid_rows = grid_rows
+        self.grid_rows = {name: max(grid_rows, len(rows)) for name, rows in self.tabs.items()}
+        self.lock = threading.Lock()
+        # count_bytes=False évite la sérialisation JSON de chaque réponse (mesures mémoire)
+        self.count_bytes = count_bytes
+        self.calls = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _count(self, method, request_body, response):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.count_bytes:
+            self.bytes_out += len(json.dumps(request_body, ensure_ascii=False))
+            self.bytes_in += len(json.dumps(response, ensure_ascii=False))
+        return response
+
+    def _read(self, range_name):
+        sheet_name, first_col, first_row, last_col, last_row = parse_range(range_name)
+        if sheet_name not in self.tabs:
+            # Comme l'API (400) : un onglet absent fait échouer toute la lecture, batchGet compris
+            raise FakeSheetsError(f"Unable to parse range: {range_name}")
+        rows = self.tabs[sheet_name]
+        stop = len(rows) if last_row is None else min(last_row, len(rows))
+        values = [list(row[first_col:last_col + 1]) for row in rows[first_row - 1:stop]]
+        # Comme l'API : lignes vides finales omises, cellules vides finales tronquées
+        values = [row[:max((i + 1 for i, v in enumerate(row) if v != ""), default=0)] for row in values]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def _write(self, range_name, values):
+        sheet_name, first_col, first_row, _, _ = parse_range(range_name)
+        rows = self.tabs.setdefault(sheet_name, [])
+        grid_rows = self.grid_rows.setdefault(sheet_name, self.default_grid_rows)
+        if first_row - 1 + len(values) > grid_rows:
+            raise FakeSheetsError(f"Range ('{sheet_name}'!{range_name.rpartition('!')[2]}) exceeds grid limits. "
+                                  f"Max rows: {grid_rows}")
+        for offset, new_values in enumerate(values):
+            index = first_row - 1 + offset
+            while len(rows) <= index:
+                rows.append([])
+            row = rows[index]
+            while len(row) < first_col + len(new_values):
+                row.append("")
+            row[first_col:first_col + len(new_values)] = [str(v) for v in new_values]
+
+    def values_get(self, range_name):
+        with self.lock:
+            return self._count("get", {"range": range_name}, {"range": range_name, "values": self._read(range_name)})
+
+    def values_batch_get(self, ranges):
+        with self.lock:
+            value_ranges = [{"range": r, "values": self._read(r)} for r in ranges]
+            return self._count("batchGet", {"ranges": ranges}, {"valueRanges": value_ranges})
+
+    def values_update(self, range_name, body):
+        with self.lock:
+            self._write(range_name, body.get("values", []))
+            return self._count("update", body, {"updatedRange": range_name})
+
+    def values_batch_update(self, body):
+        with self.lock:
+            for data in body.get("data", []):
+                self._write(data["range"], data.get("values", []))
+            return self._count("batchUpdate", body, {"totalUpdatedRanges": len(body.get("data", []))})
+
+    def values_batch_clear(self, body):
+        with self.lock:
+            for range_name in body.get("ranges", []):
+                sheet_name, first_col, first_row, last_col, last_row = parse_range(range_name)
+                rows = self.tabs.get(sheet_name, [])
+                stop = len(rows) if last_row is None else min(last_row, len(rows))
+                for row in rows[first_row - 1:stop]:
+                    for index in range(first_col, min(last_col + 1, len(row))):
+                        row[index] = ""
+            return self._count("batchClear", body, {"clearedRanges": body.get("ranges", [])})
+
+    def values_append(self, range_name, body):
+        with self.lock:
+            sheet_name = parse_range(range_name)[0]
+            rows = self.tabs.setdefault(sheet_name, [])
+            rows.extend([str(v) for v in row] for row in body.get("values", []))
+            self.grid_rows[sheet_name] = max(self.grid_rows.get(sheet_name, self.default_grid_rows), len(rows))
+            return self._count("append", body, {"updates": {"updatedRows": len(body.get("values", []))}})
+
+    def spreadsheet_get(self):
+        with self.lock:
+            sheets = [
+                {"properties": {"sheetId": sheet_id, "title": name,
+                                "gridProperties": {"rowCount": self.grid_rows.setdefault(name, self.default_grid_rows)}}}
+                for sheet_id, name in enumerate(self.tabs)
+            ]
+            return self._count("spreadsheets.get", {}, {"sheets": sheets})
+
+    def spreadsheet_batch_update(self, body):
+        with self.lock:
+            names = list(self.tabs)
+            for request in body.get("requests", []):
+                append = request.get("appendDimension")
+                if not append or append.get("dimension") != "ROWS":
+                    raise FakeSheetsError(f"Requête non supportée par le stand-in: {request}")
+                name = names[append["sheetId"]]
+                self.grid_rows[name] = self.grid_rows.get(name, self.default_grid_rows) + append["length"]
+            return self._count("spreadsheets.batchUpdate", body, {"replies": [{} for _ in body.get("requests", [])]})
+
+    def snapshot(self, sheet_name):
+        with self.lock:
+            return [list(row) for row in self.tabs.get(sheet_name, [])]
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = {}
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+
+class _Request:
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def execute(self, num_retries=0):
+        return self.fn(*self.args)
+
+
+class _Values:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return _Request(self.backend.values_get, range)
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        return _Request(self.backend.values_batch_get, list(ranges))
+
+    def update(self, spreadsheetId, range, body, **kwargs):
+        return _Request(self.backend.values_update, range, body)
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        return _Request(self.backend.values_batch_update, body)
+
+    def batchClear(self, spreadsheetId, body, **kwargs):
+        return _Request(self.backend.values_batch_clear, body)
+
+    def append(self, spreadsheetId, range, body, **kwargs):
+        return _Request(self.backend.values_append, range, body)
+
+
+class _Spreadsheets:
+    def __init__(self, backend):
+        self.backend = backend
+        self._values = _Values(backend)
+
+    def values(self):
+        return self._values
+
+    def get(self, spreadsheetId, **kwargs):
+        return _Request(self.backend.spreadsheet_get)
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        return _Request(self.backend.spreadsheet_batch_update, body)
+
+
+class FakeSheetsService:
+    def __init__(self, backend):
+        self._spreadsheets = _Spreadsheets(backend)
+
+    def spreadsheets(self):
+        return self._spreadsheets
+
+
+class _SheetsManager(BaseManager):
+    pass
+
+
+_SheetsManager.register("FakeSheetsBackend", FakeSheetsBackend)
+
+
+def shared_backend(tabs):
+    """Démarre un backend partagé entre process ; retourne (manager, proxy). Penser à manager.shutdown()."""
+    manager = _SheetsManager()
+    manager.start()
+    return manager, manager.FakeSheetsBackend(tabs)
@@ -0,0 +1,74 @@
+"""
+Benchmark de construction des clients Google (Sheets v4, Drive v3) : build() avec le document de
+découverte complet embarqué par google-api-python-client, contre build_service() avec les documents
+figés et réduits de discovery_docs/. Chaque mesure à froid tourne dans un process neuf (démarrage
+d'un worker) ; les constructions suivantes sont mesurées dans le même process. Résultat en JSON.
+
+    python benchmarks/google_client_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+import google_discovery
+imported = time.perf_counter()
+creds = Credentials(token="benchmark")
+mode = {mode!r}
+timings = {{"import_ms": (imported - started) * 1000}}
+for api, version in (("sheets", "v4"), ("drive", "v3")):
+    samples = []
+    for _ in range({builds}):
+        t = time.perf_counter()
+        if mode == "library":
+            build(api, version, credentials=creds, cache_discovery=False)
+        else:
+            google_discovery.build_service(api, version, creds)
+        samples.append((time.perf_counter() - t) * 1000)
+    timings[api + "_first_ms"] = samples[0]
+    timings[api + "_next_ms"] = sorted(samples[1:])[len(samples[1:]) // 2] if len(samples) > 1 else None
+print(json.dumps(timings))
+"""
+
+
+def run_probe(mode, builds):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(root=ROOT, mode=mode, builds=builds)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="process neufs par mode")
+    parser.add_argument("--builds", type=int, default=20, help="constructions par API dans chaque process")
+    args = parser.parse_args()
+
+    report = {"benchmark": "google_client_startup", "python": sys.version.split()[0], "runs": args.runs, "modes": {}}
+    for mode in ("library", "pinned"):
+        runs = [run_probe(mode, args.builds) for _ in range(args.runs)]
+        report["modes"][mode] = {
+            name: round(statistics.median(run[name] for run in runs), 3)
+            for name in runs[0] if runs[0][name] is not None
+        }
+    library, pinned = report["modes"]["library"], report["modes"]["pinned"]
+    report["speedup"] = {
+        name: round(library[name] / pinned[name], 1)
+        for name in pinned if name != "import_ms" and pinned[name]
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Benchmark du transport HTTP des clients Google contre un serveur HTTPS local (certificat auto-signé,
+réponses JSON façon values.batchGet), appels séquentiels puis concurrents :
+
+- fresh    : un transport httplib2 neuf par appel (service reconstruit à chaque appel, ancien comportement)
+- httplib2 : un transport httplib2 conservé par thread (keep-alive, une connexion par thread)
+- pooled   : PooledHttp partagé (pool requests/urllib3 keep-alive, partagé entre threads)
+
+Chaque appel passe par googleapiclient (spreadsheets.values.batchGet). Résultat en JSON.
+
+    python benchmarks/google_http_pool.py --calls 200 --threads 8
+"""
+import argparse
+import datetime
+import http.server
+import json
+import os
+import ssl
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httplib2  # noqa: E402
+from google.oauth2.credentials import Credentials  # noqa: E402
+from google_auth_httplib2 import AuthorizedHttp  # noqa: E402
+
+from google_discovery import build_service  # noqa: E402
+from google_http import PooledHttp  # noqa: E402
+
+RESPONSE = json.dumps({
+    "spreadsheetId": "benchmark",
+    "valueRanges": [{"range": "Keys!A2:F101", "values": [["KEY-%04d" % i, "false", "", "", "", ""] for i in range(100)]}],
+}).encode()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # En-têtes et corps écrits séparément : sans TCP_NODELAY, Nagle + ACK retardé ajoutent ~40 ms par réponse
+    disable_nagle_algorithm = True
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    do_GET = do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+def self_signed_cert(directory):
+    import ipaddress
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([
+            x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+def start_server(cert_path, key_path):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_clients(mode, creds, cert_path, endpoint):
+    options = {"api_endpoint": endpoint}
+    local = threading.local()
+
+    def httplib2_transport():
+        return AuthorizedHttp(creds, http=httplib2.Http(ca_certs=cert_path, timeout=60))
+
+    if mode == "fresh":
+        return lambda: build_service("sheets", "v4", http=httplib2_transport(), client_options=options)
+    if mode == "httplib2":
+        def per_thread():
+            if getattr(local, "service", None) is None:
+                local.service = build_service("sheets", "v4", http=httplib2_transport(), client_options=options)
+            return local.service
+        return per_thread
+
+    pooled = PooledHttp(creds)
+    pooled.session.verify = cert_path
+    pooled.session.trust_env = False  # REQUESTS_CA_BUNDLE éventuel prioritaire sur session.verify
+
+    def shared_pool():
+        if getattr(local, "service", None) is None:
+            local.service = build_service("sheets", "v4", http=pooled, client_options=options)
+        return local.service
+    return shared_pool
+
+
+def call(get_service):
+    started = time.perf_counter()
+    get_service().spreadsheets().values().batchGet(
+        spreadsheetId="benchmark", ranges=["Keys!A2:F101"]).execute()
+    return (time.perf_counter() - started) * 1000
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)  # noqa: E731
+    return {"p50_ms": pick(0.5), "p90_ms": pick(0.9), "p99_ms": pick(0.99), "mean_ms": round(statistics.mean(ordered), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200, help="appels par mode et par phase")
+    parser.add_argument("--threads", type=int, default=8, help="threads de la phase concurrente")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="google-http-bench-")
+    cert_path, key_path = self_signed_cert(directory)
+    server = start_server(cert_path, key_path)
+    endpoint = f"https://127.0.0.1:{server.server_address[1]}/"
+    creds = Credentials(token="benchmark", expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+
+    report = {"benchmark": "google_http_pool", "python": sys.version.split()[0], "calls": args.calls,
+              "threads": args.threads, "modes": {}}
+    for mode in ("fresh", "httplib2", "pooled"):
+        get_service = make_clients(mode, creds, cert_path, endpoint)
+        call(get_service)  # connexion / construction initiale hors mesure (sauf pour fresh)
+        sequential = [call(get_service) for _ in range(args.calls)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            concurrent = list(pool.map(lambda _: call(get_service), range(args.calls)))
+        elapsed = time.perf_counter() - started
+        report["modes"][mode] = {
+            "sequential": percentiles(sequential),
+            "concurrent": dict(percentiles(concurrent), calls_per_second=round(args.calls / elapsed, 1)),
+        }
+    fresh, pooled = report["modes"]["fresh"], report["modes"]["pooled"]
+    report["speedup_p50"] = {
+        phase: round(fresh[phase]["p50_ms"] / pooled[phase]["p50_ms"], 1) for phase in ("sequential", "concurrent")
+    }
+    server.shutdown()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Temps d'import de l'app (démarrage à froid d'un worker gunicorn `main:app`), mesuré dans des process
+neufs : durée murale de `import main`, détail `-X importtime` (modules les plus coûteux en cumulé) et
+vérification que les dépendances lourdes restent chargées à la demande.
+
+Échoue (code de sortie 1) si la médiane dépasse le budget ou si un module paresseux est importé au démarrage.
+
+    python benchmarks/import_time.py --runs 5 --budget-ms 500
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Chargés au premier appel Google / App Store / Google Play, jamais par `import main`
+LAZY_MODULES = (
+    "googleapiclient", "google_auth_oauthlib", "google.oauth2", "google.auth", "httplib2", "pyparsing",
+    "jwt", "pycountry",
+)
+
+PROBE = r"""
+import json, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import main
+elapsed = (time.perf_counter() - started) * 1000
+lazy = {lazy!r}
+print(json.dumps({{
+    "import_ms": elapsed,
+    "lazy_loaded": sorted(m for m in lazy if m in sys.modules),
+    "modules": len(sys.modules),
+}}))
+"""
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def run_probe(env):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(root=ROOT, lazy=LAZY_MODULES)],
+        check=True, capture_output=True, text=True, cwd=ROOT, env=env,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def importtime_breakdown(env, top):
+    """Modules importés par `import main`, triés par temps cumulé (µs -> ms), profondeur d'arbre incluse."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        check=True, capture_output=True, text=True, cwd=ROOT, env=env,
+    ).stderr
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append({
+                "module": name,
+                "depth": len(indent) // 2,
+                "self_ms": round(int(self_us) / 1000, 1),
+                "cumulative_ms": round(int(cumulative_us) / 1000, 1),
+            })
+    total = next((e["cumulative_ms"] for e in entries if e["module"] == "main"), None)
+    # Enfants directs de main : ce que chaque import de haut niveau coûte au démarrage
+    direct = [e for e in entries if e["depth"] == 1]
+    return {
+        "main_cumulative_ms": total,
+        "main_self_ms": next((e["self_ms"] for e in entries if e["module"] == "main"), None),
+        "top_level_imports": sorted(direct, key=lambda e: e["cumulative_ms"], reverse=True)[:top],
+        "slowest_modules": sorted(
+            (e for e in entries if e["module"] != "main"), key=lambda e: e["cumulative_ms"], reverse=True)[:top],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="process neufs mesurés")
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("IMPORT_BUDGET_MS", "500")),
+                        help="budget de la médiane de `import main` (ms)")
+    parser.add_argument("--top", type=int, default=15, help="modules listés dans le détail")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    # Un premier process compile/écrit les .pyc éventuels : mesuré à part
+    warmup = run_probe(env)
+    runs = [run_probe(env) for _ in range(args.runs)]
+    samples = [run["import_ms"] for run in runs]
+    lazy_loaded = sorted({m for run in [warmup] + runs for m in run["lazy_loaded"]})
+
+    report = {
+        "benchmark": "import_time",
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "budget_ms": args.budget_ms,
+        "first_import_ms": round(warmup["import_ms"], 1),
+        "import_ms": {
+            "median": round(statistics.median(samples), 1),
+            "min": round(min(samples), 1),
+            "max": round(max(samples), 1),
+        },
+        "modules_loaded": runs[-1]["modules"],
+        "lazy_loaded": lazy_loaded,
+        "importtime": importtime_breakdown(env, args.top),
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    failures = []
+    if lazy_loaded:
+        failures.append(f"modules chargés au démarrage alors qu'ils doivent rester paresseux: {', '.join(lazy_loaded)}")
+    if report["import_ms"]["median"] > args.budget_ms:
+        failures.append(f"import main: {report['import_ms']['median']} ms > budget {args.budget_ms} ms")
+    if failures:
+        for failure in failures:
+            print(f"ÉCHEC: {failure}", file=sys.stderr)
+        sys.exit(1)
+    print(f"OK: import main en {report['import_ms']['median']} ms (budget {args.budget_ms} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Benchmark de montée en charge de l'allocation de clés (get_and_use_license_key_gsheet) contre le
+stand-in Sheets local, pour des onglets de 10k à 1M lignes et plusieurs proportions de clés utilisées.
+
+Pour chaque scénario : première réservation à froid (sans curseur), puis N réservations à chaud ;
+percentiles de latence, appels/octets Sheets par réservation et pic mémoire (tracemalloc, passe séparée
+pour ne pas fausser les latences). Résultat en JSON pour comparer deux runs avant/après un changement.
+
+    python benchmarks/key_allocation.py --output before.json
+    python benchmarks/key_allocation.py --sizes 10000,100000 --used-fractions 0.5 --claims 500
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_sheets import FakeSheetsBackend, FakeSheetsService, seed_rows  # noqa: E402
+
+SPREADSHEET_ID = "bench-spreadsheet"
+SHEET_NAME = "Bundle à vie"
+RANGE_NAME = f"{SHEET_NAME}!A1:E"
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _latency_summary(samples):
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        "count": len(ms),
+        "p50_ms": round(_percentile(ms, 0.50), 3) if ms else None,
+        "p90_ms": round(_percentile(ms, 0.90), 3) if ms else None,
+        "p99_ms": round(_percentile(ms, 0.99), 3) if ms else None,
+        "max_ms": round(ms[-1], 3) if ms else None,
+        "mean_ms": round(sum(ms) / len(ms), 3) if ms else None,
+    }
+
+
+def _reset_cursor(main):
+    with main._key_cursor_lock:
+        main._key_cursor_state.clear()
+        if os.path.exists(main.KEY_CURSOR_STATE_FILE):
+            os.remove(main.KEY_CURSOR_STATE_FILE)
+
+
+def _per_claim(stats, claims):
+    claims = max(claims, 1)
+    return {
+        "calls": {method: round(count / claims, 3) for method, count in stats["calls"].items()},
+        "bytes_in": round(stats["bytes_in"] / claims),
+        "bytes_out": round(stats["bytes_out"] / claims),
+    }
+
+
+def run_scenario(main, rows, used_fraction, claims):
+    backend = FakeSheetsBackend({SHEET_NAME: seed_rows(rows, used_fraction)})
+    service = FakeSheetsService(backend)
+    main.get_sheets_service = lambda: service
+    free = rows - int(rows * used_fraction)
+    claims = min(claims, max(free - 1, 0))
+
+    # Passe 1 : latences (sans tracemalloc)
+    _reset_cursor(main)
+    backend.reset_stats()
+    started = time.perf_counter()
+    cold_key = main.get_and_use_license_key_gsheet("bench@example.com", SPREADSHEET_ID, RANGE_NAME, order_id="cold")
+    cold_latency = time.perf_counter() - started
+    cold_stats = backend.stats()
+
+    backend.reset_stats()
+    samples = []
+    for i in range(claims):
+        started = time.perf_counter()
+        key = main.get_and_use_license_key_gsheet("bench@example.com", SPREADSHEET_ID, RANGE_NAME, order_id=f"warm-{i}")
+        samples.append(time.perf_counter() - started)
+        if key is None:
+            break
+    warm_stats = backend.stats()
+
+    # Passe 2 : pic mémoire d'une réservation à froid puis d'une rafale à chaud
+    _reset_cursor(main)
+    backend.count_bytes = False
+    tracemalloc.start()
+    main.get_and_use_license_key_gsheet("bench@example.com", SPREADSHEET_ID, RANGE_NAME, order_id="mem-cold")
+    cold_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    for i in range(min(claims, 50)):
+        main.get_and_use_license_key_gsheet("bench@example.com", SPREADSHEET_ID, RANGE_NAME, order_id=f"mem-{i}")
+    warm_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "rows": rows,
+        "used_fraction": used_fraction,
+        "cold": {
+            "ok": cold_key is not None,
+            "latency_ms": round(cold_latency * 1000, 3),
+            **_per_claim(cold_stats, 1),
+            "memory_peak_bytes": cold_peak,
+        },
+        "warm": {
+            "latency": _latency_summary(samples),
+            **_per_claim(warm_stats, len(samples)),
+            "memory_peak_bytes": warm_peak,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="nombres de lignes, séparés par des virgules")
+    parser.add_argument("--used-fractions", default="0,0.5,0.9,0.99")
+    parser.add_argument("--claims", type=int, default=200, help="réservations à chaud par scénario")
+    parser.add_argument("--output", help="fichier JSON de sortie (stdout sinon)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="footbar-bench-")
+    os.environ["KEY_LOCK_DIR"] = work_dir
+    os.environ["KEY_CURSOR_STATE_FILE"] = os.path.join(work_dir, "key_cursor_state.json")
+    os.environ["KEY_INVENTORY_DB"] = ""
+    os.environ["KEY_PREFETCH_LOW_WATERMARK"] = "0"
+
+    import main as app
+    from key_levels import KeyLevels
+
+    # Compteurs de stock hors mesure : pas de recalage Sheets en arrière-plan pendant le benchmark
+    app._key_levels = KeyLevels(lambda ranges: {}, [])
+
+    scenarios = []
+    for rows in (int(size) for size in args.sizes.split(",")):
+        for used_fraction in (float(fraction) for fraction in args.used_fractions.split(",")):
+            result = run_scenario(app, rows, used_fraction, args.claims)
+            scenarios.append(result)
+            print(
+                f"{rows:>9} lignes, {used_fraction:.0%} utilisées : froid {result['cold']['latency_ms']} ms, "
+                f"p50 chaud {result['warm']['latency']['p50_ms']} ms",
+                file=sys.stderr,
+            )
+
+    report = {
+        "benchmark": "key_allocation",
+        "python": platform.python_version(),
+        "claims_per_scenario": args.claims,
+        "key_cursor_window_rows": app.KEY_CURSOR_WINDOW_ROWS,
+        "scenarios": scenarios,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Réservation des clés d'un cycle de poll Mirakl/Amazon : commande par commande (process_order pour
+chaque commande, comme avant le pipeline) contre un lot (run_order_pipeline sur toutes les nouvelles
+commandes). Stand-in Sheets local avec une latence simulée par appel (--sheets-latency-ms), emails
+CR7M simulés. Appels Sheets et durée du cycle en JSON.
+
+    python benchmarks/order_batch.py --orders 20 --skus 2 --quantity 2 --sheets-latency-ms 150
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_sheets import FakeSheetsBackend, FakeSheetsService, seed_rows  # noqa: E402
+
+SKUS = ["B2C001_BUNDLE_LIFE", "FOOTBAR_TEAM_1_AN", "FOOTBAR_GOLD_1_AN"]
+
+
+class SlowSheetsBackend(FakeSheetsBackend):
+    def __init__(self, tabs, latency_seconds):
+        super().__init__(tabs)
+        self.latency_seconds = latency_seconds
+
+    def _count(self, method, request_body, response):
+        time.sleep(self.latency_seconds)
+        return super()._count(method, request_body, response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=20, help="nouvelles commandes par cycle")
+    parser.add_argument("--skus", type=int, default=2, choices=range(1, len(SKUS) + 1), help="SKU par commande")
+    parser.add_argument("--quantity", type=int, default=2, help="unités par ligne")
+    parser.add_argument("--sheets-latency-ms", type=float, default=150)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="order-batch-")
+    os.environ.update(
+        KEY_CURSOR_STATE_FILE=os.path.join(directory, "cursor.json"),
+        KEY_LOCK_DIR=directory,
+        KEY_HOLDS_DB=os.path.join(directory, "key_holds.db"),
+        ORDER_JOURNAL_DB=os.path.join(directory, "order_journal.db"),
+    )
+    import main as app
+
+    app.log = lambda msg: None
+    app.send_email_with_template = lambda *a, **k: True
+    app._key_levels = app.KeyLevels(lambda ranges: {}, [])
+    configs = [app.find_product_config_for_sku(sku) for sku in SKUS[:args.skus]]
+    rows = args.orders * args.quantity * 4
+    tabs = {app._parse_a1_range(config["range_name"])[0]: seed_rows(rows, prefix=sku[:8])
+            for sku, config in zip(SKUS, configs)}
+
+    report = {"benchmark": "order_batch", "orders": args.orders, "skus": args.skus, "quantity": args.quantity,
+              "sheets_latency_ms": args.sheets_latency_ms, "modes": {}}
+    for mode in ("per_order", "batched"):
+        with app._key_cursor_lock:
+            app._key_cursor_state.clear()
+            if os.path.exists(app.KEY_CURSOR_STATE_FILE):
+                os.remove(app.KEY_CURSOR_STATE_FILE)
+        backend = SlowSheetsBackend(tabs, args.sheets_latency_ms / 1000)
+        service = FakeSheetsService(backend)
+        app.get_sheets_service = lambda: service
+        orders = [
+            app._pipeline_order("cr7m", f"{mode}-{i}", f"bench{i}@order.local", "fr",
+                                [{"sku": sku, "quantity": args.quantity} for sku in SKUS[:args.skus]])
+            for i in range(args.orders)
+        ]
+        started = time.perf_counter()
+        if mode == "per_order":
+            results = [app.process_order(o["email"], o["language"], o["line_items"], order_id=o["order_id"])
+                       for o in orders]
+        else:
+            results = app.run_order_pipeline(orders)
+        elapsed = time.perf_counter() - started
+        calls = backend.stats()["calls"]
+        report["modes"][mode] = {
+            "cycle_s": round(elapsed, 3),
+            "sheets_calls": calls,
+            "sheets_round_trips": sum(calls.values()),
+            "statuses": sorted({status for _, status in results}),
+            "keys_sent": sum(payload.get("total_keys", 0) for payload, _ in results),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Durée de livraison d'une commande multi-clés (ex. 12 sièges coach) une fois les clés réservées :
+emails CR7M simulés par une attente de --cr7m-ms, envoyés par _send_order_keys avec différentes
+valeurs de ORDER_DELIVERY_WORKERS (1 = un par un, comportement d'origine). Résultat en JSON.
+
+    python benchmarks/order_delivery.py --keys 12 --cr7m-ms 800 --workers 1,4,8
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=12, help="clés (emails) dans la commande")
+    parser.add_argument("--cr7m-ms", type=float, default=800, help="durée simulée d'un envoi CR7M")
+    parser.add_argument("--workers", default="1,4,8", help="valeurs de ORDER_DELIVERY_WORKERS à comparer")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="order-delivery-")
+    os.environ.update(ORDER_JOURNAL_DB=os.path.join(directory, "order_journal.db"))
+    import main as app
+
+    app.log = lambda msg: None
+
+    def slow_send(*a, **k):
+        time.sleep(args.cr7m_ms / 1000)
+        return True
+
+    app.send_email_with_template = slow_send
+    config = {"email_id_fr": "1", "email_id_en": "2"}
+    claimed = [("FOOTBAR_TEAM_1_AN", config, [f"KEY-{i:04d}" for i in range(args.keys)])]
+
+    report = {"benchmark": "order_delivery", "keys": args.keys, "cr7m_ms": args.cr7m_ms, "modes": {}}
+    for workers in [int(w) for w in args.workers.split(",")]:
+        app.ORDER_DELIVERY_WORKERS = workers
+        journal_key = f"bench:{workers}"
+        app.get_order_journal().open(journal_key, "bench@order.local", "fr")
+        app.get_order_journal().record_claims(journal_key, claimed[0][0], claimed[0][2])
+        started = time.perf_counter()
+        payload, status = app._send_order_keys("bench@order.local", "fr", "bench", claimed, [], journal_key=journal_key)
+        report["modes"][f"workers_{workers}"] = {
+            "delivery_s": round(time.perf_counter() - started, 3),
+            "status": status,
+            "keys_sent": payload.get("total_keys"),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
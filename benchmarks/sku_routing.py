@@ -0,0 +1,80 @@
+"""
+Micro-benchmark du routage SKU -> config produit : boucle d'origine (dict puis regex une à une)
+contre le routeur compilé (regex combinées + mémoïsation), sur quelques milliers de SKU.
+
+    python benchmarks/sku_routing.py --skus 5000 --patterns 200 --rounds 20
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sku_router import SkuRouter  # noqa: E402
+
+
+def build_tables(sku_count, pattern_count):
+    cfg = {"spreadsheet_id": "bench", "range_name": "Feuille 1!A1:E"}
+    exact = {f"B2C{i:05d}_BUNDLE": dict(cfg) for i in range(sku_count // 2)}
+    patterns = [
+        (re.compile(rf"^B2B{i:03d}_(1_MOIS|1_AN|2_ANS)$"), dict(cfg, range_name=f"Coach {i}!A1:E"))
+        for i in range(pattern_count)
+    ]
+    skus = list(exact)
+    skus += [f"B2B{random.randrange(pattern_count):03d}_{random.choice(['1_MOIS', '1_AN', '2_ANS'])}"
+             for _ in range(sku_count // 2 - sku_count // 10)]
+    skus += [f"UNKNOWN_{i}" for i in range(sku_count // 10)]
+    random.shuffle(skus)
+    return exact, patterns, skus
+
+
+def legacy_lookup(exact, patterns, sku):
+    if sku in exact:
+        return exact[sku]
+    for pattern, cfg in patterns:
+        if pattern.match(sku):
+            return cfg
+    return None
+
+
+def timed(fn, skus, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for sku in skus:
+            fn(sku)
+    elapsed = time.perf_counter() - started
+    return {"lookups_per_s": round(len(skus) * rounds / elapsed), "us_per_lookup": round(elapsed / (len(skus) * rounds) * 1e6, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--skus", type=int, default=5000)
+    parser.add_argument("--patterns", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    exact, patterns, skus = build_tables(args.skus, args.patterns)
+    router = SkuRouter(exact, patterns)
+    for sku in skus:
+        assert router.lookup(sku) is legacy_lookup(exact, patterns, sku), sku
+    router = SkuRouter(exact, patterns)
+
+    report = {
+        "skus": len(skus),
+        "exact_entries": len(exact),
+        "patterns": len(patterns),
+        "legacy": timed(lambda sku: legacy_lookup(exact, patterns, sku), skus, args.rounds),
+        "compiled_cold": timed(SkuRouter(exact, patterns).lookup, skus, 1),
+        "compiled_memoized": timed(router.lookup, skus, args.rounds),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Test de charge des réservations de clés concurrentes (plusieurs process x plusieurs threads,
+comme des workers gunicorn + polls Mirakl/Amazon) contre le stand-in Sheets local.
+
+Vérifie qu'aucune clé n'est distribuée deux fois et que la sheet reflète exactement les clés émises.
+
+    python benchmarks/stress_key_claims.py --processes 4 --threads 4 --claims 25
+    python benchmarks/stress_key_claims.py --mixed-orders   # commandes sur deux ranges à la fois
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_sheets import FakeSheetsService, seed_rows, shared_backend  # noqa: E402
+
+SPREADSHEET_ID = "stress-spreadsheet"
+SHEET_NAME = "Bundle à vie"
+RANGE_NAME = f"{SHEET_NAME}!A1:E"
+SECOND_SHEET_NAME = "Plateforme Coach 1 an"
+SECOND_RANGE_NAME = f"{SECOND_SHEET_NAME}!A1:E"
+
+
+def _worker(backend, worker_id, threads, claims_per_thread, max_per_claim, mixed_orders, results):
+    import main
+
+    service = FakeSheetsService(backend)
+    main.get_sheets_service = lambda: service
+
+    def run(thread_id):
+        issued = []
+        for i in range(claims_per_thread):
+            count = 1 + (worker_id + thread_id + i) % max_per_claim
+            to_email = f"w{worker_id}t{thread_id}@stress.local"
+            order_id = f"{worker_id}-{thread_id}-{i}"
+            if mixed_orders:
+                claimed = main.claim_license_keys_for_order([
+                    ({"spreadsheet_id": SPREADSHEET_ID, "range_name": RANGE_NAME}, count),
+                    ({"spreadsheet_id": SPREADSHEET_ID, "range_name": SECOND_RANGE_NAME}, 1),
+                ], to_email, order_id=order_id)
+                if any(keys is None for keys in claimed):
+                    break
+                keys = [key for keys in claimed for key in keys]
+            else:
+                keys = main.get_and_use_license_keys_gsheet(
+                    to_email, SPREADSHEET_ID, RANGE_NAME, count, order_id=order_id)
+            if keys is None:
+                break
+            issued.extend(keys)
+        return issued
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        issued = [key for keys in pool.map(run, range(threads)) for key in keys]
+    results.put(issued)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--claims", type=int, default=25, help="réservations par thread")
+    parser.add_argument("--max-per-claim", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--used-fraction", type=float, default=0.5)
+    parser.add_argument("--mixed-orders", action="store_true",
+                        help="chaque réservation est une commande sur deux ranges (claim_license_keys_for_order)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="footbar-stress-")
+    os.environ["KEY_LOCK_DIR"] = work_dir
+    os.environ["KEY_CURSOR_STATE_FILE"] = os.path.join(work_dir, "key_cursor_state.json")
+    os.environ["KEY_INVENTORY_DB"] = ""
+
+    manager, backend = shared_backend({
+        SHEET_NAME: seed_rows(args.rows, args.used_fraction),
+        SECOND_SHEET_NAME: seed_rows(args.rows, args.used_fraction, prefix="COACH"),
+    })
+    results = multiprocessing.Queue()
+    started = time.perf_counter()
+    processes = [
+        multiprocessing.Process(
+            target=_worker, args=(
+                backend, worker_id, args.threads, args.claims, args.max_per_claim, args.mixed_orders, results,
+            ),
+        )
+        for worker_id in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    issued = [key for _ in processes for key in results.get()]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    seeded_used = int(args.rows * args.used_fraction)
+    marked = []
+    for sheet_name in (SHEET_NAME, SECOND_SHEET_NAME):
+        rows = backend.snapshot(sheet_name)
+        used_index = rows[0].index("used")
+        marked += [row[0] for row in rows[1 + seeded_used:] if len(row) > used_index and row[used_index] == "true"]
+    stats = backend.stats()
+    manager.shutdown()
+
+    duplicates = len(issued) - len(set(issued))
+    report = {
+        "processes": args.processes,
+        "threads": args.threads,
+        "mixed_orders": args.mixed_orders,
+        "keys_issued": len(issued),
+        "duplicates": duplicates,
+        "rows_marked_used": len(marked),
+        "elapsed_s": round(elapsed, 3),
+        "sheets_calls": stats["calls"],
+    }
+    print(json.dumps(report, indent=2))
+
+    assert duplicates == 0, f"{duplicates} clé(s) distribuée(s) plusieurs fois"
+    assert sorted(marked) == sorted(issued), "la sheet ne reflète pas exactement les clés émises"
+    print("OK: toutes les clés émises sont uniques")
+
+
+if __name__ == "__main__":
+    main()
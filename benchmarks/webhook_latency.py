@@ -0,0 +1,98 @@
+"""
+Latence de réponse de /webhook avec un aval lent (réservation Sheets + emails CR7M simulés par une
+attente de --downstream-ms, avec quelques pics à --spike-ms) : traitement en ligne (WEBHOOK_ASYNC=0)
+contre file durable + réponse 202 (WEBHOOK_ASYNC=1). Requêtes concurrentes via le client de test
+Flask, file SQLite dans un répertoire temporaire. Résultat en JSON.
+
+    python benchmarks/webhook_latency.py --requests 200 --concurrency 8 --downstream-ms 300
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)  # noqa: E731
+    return {"p50_ms": pick(0.5), "p90_ms": pick(0.9), "p99_ms": pick(0.99), "max_ms": round(ordered[-1], 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--downstream-ms", type=float, default=300, help="durée simulée du traitement aval")
+    parser.add_argument("--spike-ms", type=float, default=3000, help="durée des appels aval lents")
+    parser.add_argument("--spike-rate", type=float, default=0.02, help="proportion d'appels aval lents")
+    parser.add_argument("--timeout", type=float, default=120, help="attente max du traitement de la file (s)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="webhook-latency-")
+    os.environ.update(
+        WEBHOOK_QUEUE_DB=os.path.join(directory, "webhook_jobs.db"),
+        WEBHOOK_QUEUE_WORKERS=str(args.concurrency),
+        KEY_CURSOR_STATE_FILE=os.path.join(directory, "cursor.json"),
+        KEY_LOCK_DIR=directory,
+        KEY_HOLDS_DB=os.path.join(directory, "key_holds.db"),
+        WEBHOOK_DEDUPE_DB=os.path.join(directory, "webhook_dedupe.db"),
+        ORDER_JOURNAL_DB=os.path.join(directory, "order_journal.db"),
+    )
+    import main as app
+
+    processed = []
+
+    def slow_process_order(customer_email, language_email, line_items, order_id=None):
+        spike = random.random() < args.spike_rate
+        time.sleep((args.spike_ms if spike else args.downstream_ms) / 1000)
+        processed.append(customer_email)
+        return {"message": "1 clé(s) envoyée(s)"}, 200
+
+    app.process_order = slow_process_order
+    app.log = lambda msg: None
+
+    def post(mode, i):
+        client = app.app.test_client()
+        # Corps uniques par mode : la déduplication rejouerait sinon les réponses de la passe précédente
+        body = json.dumps({"email": f"bench{i}-{mode}@webhook.local", "language": "fr",
+                           "line_items": [{"sku": "B2C001_BUNDLE", "quantity": 1}]})
+        started = time.perf_counter()
+        response = client.post("/webhook", data=body)
+        return (time.perf_counter() - started) * 1000, response.status_code
+
+    report = {"benchmark": "webhook_latency", "requests": args.requests, "concurrency": args.concurrency,
+              "downstream_ms": args.downstream_ms, "spike_ms": args.spike_ms, "spike_rate": args.spike_rate,
+              "modes": {}}
+    for mode, asynchronous in (("inline", False), ("queued", True)):
+        app.WEBHOOK_ASYNC = asynchronous
+        processed.clear()
+        random.seed(0)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results = list(pool.map(lambda i: post(mode, i), range(args.requests)))
+        responded = time.perf_counter() - started
+        deadline = time.monotonic() + args.timeout
+        while len(processed) < args.requests:
+            if time.monotonic() >= deadline:
+                app.get_webhook_queue().stop()
+                sys.exit(f"{mode}: {len(processed)}/{args.requests} webhook(s) traité(s) après {args.timeout}s")
+            time.sleep(0.01)
+        drained = time.perf_counter() - started
+        report["modes"][mode] = dict(
+            percentiles([ms for ms, _ in results]),
+            statuses=sorted({status for _, status in results}),
+            all_responded_s=round(responded, 2),
+            all_processed_s=round(drained, 2),
+        )
+    app.get_webhook_queue().stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
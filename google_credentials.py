@@ -0,0 +1,148 @@
+import atexit
+import datetime
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def _utcnow():
+    # google-auth manipule des expirations UTC naïves
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class GoogleCredentialsManager:
+    """
+    Credentials Google du process : configuration lue une seule fois (load_info), un objet Credentials
+    par variante ("service_account", "oauth", ...) partagé par Sheets et Drive, et jetons d'accès
+    rafraîchis en arrière-plan `refresh_margin_seconds` avant expiration : aucune requête ne paie un
+    aller-retour de rafraîchissement (la marge dépasse le seuil de rafraîchissement de google-auth).
+
+    load_info() -> dict de configuration (JSON du compte de service ou client OAuth)
+    request_factory() -> google.auth.transport.Request utilisé pour les rafraîchissements
+    """
+
+    def __init__(self, load_info, request_factory, refresh_margin_seconds=600, check_seconds=60, log=None):
+        self.load_info = load_info
+        self.request_factory = request_factory
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.check_seconds = check_seconds
+        self.log = log or logger.info
+        self._lock = threading.Lock()
+        self._info = None
+        self._entries = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def info(self):
+        if self._info is None:
+            with self._lock:
+                if self._info is None:
+                    self._info = self.load_info()
+        return self._info
+
+    def get(self, variant, factory, on_refresh=None):
+        """Credentials de la variante (créés une fois via factory(), valides au retour)."""
+        entry = self._entries.get(variant)
+        if entry is None:
+            with self._lock:
+                entry = self._entries.get(variant)
+                if entry is None:
+                    entry = {
+                        "credentials": factory(),
+                        "on_refresh": on_refresh,
+                        "refresh_lock": threading.Lock(),
+                        "refreshed_at": None,
+                        "refresh_count": 0,
+                        "refresh_failures": 0,
+                        "last_refresh_ms": None,
+                        "total_refresh_ms": 0.0,
+                        "last_error": None,
+                    }
+                    self._entries[variant] = entry
+            self.start()
+        if self._due(entry):
+            self._refresh(variant, entry)
+        return entry["credentials"]
+
+    def _due(self, entry):
+        creds = entry["credentials"]
+        expiry = getattr(creds, "expiry", None)
+        if not getattr(creds, "token", None):
+            return True
+        if expiry is None:
+            return False
+        return (expiry - _utcnow()).total_seconds() < self.refresh_margin_seconds
+
+    def _refresh(self, variant, entry):
+        with entry["refresh_lock"]:
+            # Un autre thread vient peut-être de rafraîchir
+            if not self._due(entry):
+                return
+            creds = entry["credentials"]
+            started = time.perf_counter()
+            try:
+                creds.refresh(self.request_factory())
+            except Exception as e:
+                entry["refresh_failures"] += 1
+                entry["last_error"] = str(e)
+                raise
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            entry["refreshed_at"] = time.time()
+            entry["refresh_count"] += 1
+            entry["last_refresh_ms"] = round(elapsed_ms, 1)
+            entry["total_refresh_ms"] += elapsed_ms
+            entry["last_error"] = None
+            if entry["on_refresh"]:
+                entry["on_refresh"](creds)
+
+    def refresh_due(self):
+        for variant, entry in list(self._entries.items()):
+            if self._due(entry):
+                try:
+                    self._refresh(variant, entry)
+                except Exception as e:
+                    logger.warning("Rafraîchissement du jeton Google %s échoué: %s", variant, e)
+
+    def metrics(self):
+        now = time.time()
+        result = {}
+        for variant, entry in list(self._entries.items()):
+            expiry = getattr(entry["credentials"], "expiry", None)
+            result[variant] = {
+                "token_age_seconds": round(now - entry["refreshed_at"], 1) if entry["refreshed_at"] else None,
+                "expires_in_seconds": round((expiry - _utcnow()).total_seconds(), 1) if expiry else None,
+                "refresh_count": entry["refresh_count"],
+                "refresh_failures": entry["refresh_failures"],
+                "last_refresh_ms": entry["last_refresh_ms"],
+                "avg_refresh_ms": (
+                    round(entry["total_refresh_ms"] / entry["refresh_count"], 1) if entry["refresh_count"] else None
+                ),
+                "last_error": entry["last_error"],
+            }
+        return {
+            "refresh_margin_seconds": self.refresh_margin_seconds,
+            "check_seconds": self.check_seconds,
+            "credentials": result,
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return self._thread
+
+        def run():
+            while not self._stop.wait(self.check_seconds):
+                self.refresh_due()
+
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return self._thread
+            self._thread = threading.Thread(target=run, name="google-credentials", daemon=True)
+            self._thread.start()
+        atexit.register(self._stop.set)
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
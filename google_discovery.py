@@ -0,0 +1,206 @@
+"""
+Documents de découverte Google figés dans le dépôt (discovery_docs/), réduits aux méthodes utilisées
+par l'app : la construction d'un client est locale et ne parse que quelques dizaines de Ko au lieu
+du document complet (~300 Ko pour Sheets) embarqué par google-api-python-client.
+
+Régénérer après une montée de version de google-api-python-client ou pour exposer une nouvelle méthode :
+
+    python google_discovery.py
+
+Vérifier que chaque méthode Google appelée dans le code existe dans les clients figés (sans réseau) :
+
+    python google_discovery.py --check
+"""
+import json
+import os
+import re
+import sys
+import threading
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "discovery_docs")
+
+# (api, version) -> méthodes appelées par l'app, par chemin de ressource
+PINNED_METHODS = {
+    ("sheets", "v4"): {
+        "spreadsheets": ["get", "batchUpdate"],
+        "spreadsheets.values": ["get", "update", "append", "batchGet", "batchUpdate", "batchClear"],
+    },
+    ("drive", "v3"): {
+        "files": ["create"],
+    },
+}
+
+# Schémas figés sans leur contenu : googleapiclient ne s'en sert que pour les docstrings des méthodes,
+# et leur fermeture (Request, Spreadsheet : ~250 schémas) multiplierait par 100 la construction du client
+OPAQUE_SCHEMAS = {
+    ("sheets", "v4"): ["Spreadsheet", "BatchUpdateSpreadsheetRequest", "BatchUpdateSpreadsheetResponse"],
+}
+
+_docs_lock = threading.Lock()
+_docs = {}
+
+
+def doc_path(api, version):
+    return os.path.join(DOCS_DIR, f"{api}.{version}.json")
+
+
+def load_discovery_doc(api, version):
+    """Texte du document figé (lu une fois par process), ou None s'il n'est pas livré."""
+    cache_key = (api, version)
+    if cache_key not in _docs:
+        with _docs_lock:
+            if cache_key not in _docs:
+                try:
+                    with open(doc_path(api, version), "r", encoding="utf-8") as f:
+                        _docs[cache_key] = f.read()
+                except FileNotFoundError:
+                    _docs[cache_key] = None
+    return _docs[cache_key]
+
+
+def build_service(api, version, credentials=None, http=None, client_options=None):
+    """
+    Client googleapiclient construit depuis le document figé, sinon via build() (document de la lib).
+    `http` (transport déjà autorisé) et `credentials` sont exclusifs, comme pour build().
+    Chaque construction reparse sa propre copie : build_from_document complète le document en place.
+    """
+    from googleapiclient.discovery import build, build_from_document
+
+    doc = load_discovery_doc(api, version)
+    if doc is None:
+        return build(api, version, credentials=credentials, http=http, client_options=client_options,
+                     cache_discovery=False)
+    return build_from_document(json.loads(doc), credentials=credentials, http=http, client_options=client_options)
+
+
+def _schema_refs(node, found):
+    if isinstance(node, dict):
+        ref = node.get("$ref")
+        if isinstance(ref, str):
+            found.add(ref)
+        for value in node.values():
+            _schema_refs(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            _schema_refs(value, found)
+    return found
+
+
+def trim_discovery_doc(doc, methods, opaque=()):
+    """
+    Ne garde que les ressources/méthodes listées et les schémas qu'elles référencent (fermeture des $ref).
+    Les schémas de `opaque` sont gardés comme simples objets, sans leurs propriétés ni leurs références.
+    """
+    trimmed = {name: value for name, value in doc.items() if name not in ("resources", "schemas")}
+    trimmed["resources"] = {}
+    for resource_path, method_names in methods.items():
+        source = doc
+        target = trimmed
+        for part in resource_path.split("."):
+            source = source["resources"][part]
+            target = target.setdefault("resources", {}).setdefault(
+                part, {name: value for name, value in source.items() if name not in ("resources", "methods")})
+        target["methods"] = {name: source["methods"][name] for name in method_names}
+
+    schemas = dict(doc.get("schemas", {}))
+    for name in opaque:
+        if name in schemas:
+            schemas[name] = {key: value for key, value in schemas[name].items() if key in ("id", "description")}
+            schemas[name].update(type="object", additionalProperties={"type": "any"})
+    wanted = _schema_refs(trimmed["resources"], set())
+    pending = list(wanted)
+    while pending:
+        for ref in _schema_refs(schemas.get(pending.pop(), {}), set()):
+            if ref not in wanted:
+                wanted.add(ref)
+                pending.append(ref)
+    trimmed["schemas"] = {name: schemas[name] for name in sorted(wanted) if name in schemas}
+    return trimmed
+
+
+# Ressource googleapiclient (service.<nom>()) -> (api, version) et chemin de ressource dans le document
+APP_RESOURCES = {
+    "spreadsheets": (("sheets", "v4"), "spreadsheets"),
+    "values": (("sheets", "v4"), "spreadsheets.values"),
+    "files": (("drive", "v3"), "files"),
+}
+# Lookahead : dans spreadsheets().values().get( les deux maillons doivent être relevés
+_CALL_RE = re.compile(r"\b(" + "|".join(APP_RESOURCES) + r")\(\)(?=\s*\.\s*(\w+)\()")
+
+
+def app_method_calls(root=None):
+    """{(api, version, chemin de ressource, méthode)} appelés par le code de l'app (hors benchmarks)."""
+    root = root or os.path.dirname(os.path.abspath(__file__))
+    calls = set()
+    for name in sorted(os.listdir(root)):
+        if not name.endswith(".py") or name == os.path.basename(__file__):
+            continue
+        with open(os.path.join(root, name), "r", encoding="utf-8") as f:
+            source = f.read()
+        for resource, method in _CALL_RE.findall(source):
+            (api, version), path = APP_RESOURCES[resource]
+            if method in APP_RESOURCES:
+                continue  # sous-ressource (spreadsheets().values())
+            calls.add((api, version, path, method))
+    return calls
+
+
+def check_pinned_clients(calls=None):
+    """
+    Construit chaque client depuis son document figé (transport factice, rien n'est envoyé) et prépare
+    chaque appel de l'app avec ses paramètres obligatoires. Retourne la liste des problèmes ([] si tout va bien).
+    """
+    from googleapiclient.http import HttpMock
+
+    problems = []
+    services = {}
+    for api, version, path, method in sorted(calls if calls is not None else app_method_calls()):
+        doc = load_discovery_doc(api, version)
+        if doc is None:
+            problems.append(f"{api}.{version}: document figé absent ({doc_path(api, version)})")
+            continue
+        if (api, version) not in services:
+            services[(api, version)] = build_service(api, version, http=HttpMock())
+        resource = services[(api, version)]
+        method_doc = json.loads(doc)
+        try:
+            for part in path.split("."):
+                resource = getattr(resource, part)()
+                method_doc = method_doc["resources"][part]
+            method_doc = method_doc["methods"][method]
+            call = getattr(resource, method)
+        except (AttributeError, KeyError):
+            problems.append(f"{api}.{version}: {path}.{method} absent du document figé (PINNED_METHODS)")
+            continue
+        params = {name: "x" for name, spec in method_doc.get("parameters", {}).items() if spec.get("required")}
+        if "request" in method_doc:
+            params["body"] = {}
+        try:
+            call(**params)
+        except Exception as e:
+            problems.append(f"{api}.{version}: {path}.{method} inutilisable ({e})")
+    return problems
+
+
+def pin_discovery_docs():
+    from googleapiclient import discovery_cache
+
+    os.makedirs(DOCS_DIR, exist_ok=True)
+    for (api, version), methods in PINNED_METHODS.items():
+        doc = json.loads(discovery_cache.get_static_doc(api, version))
+        trimmed = trim_discovery_doc(doc, methods, OPAQUE_SCHEMAS.get((api, version), ()))
+        with open(doc_path(api, version), "w", encoding="utf-8") as f:
+            json.dump(trimmed, f, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+            f.write("\n")
+        print(f"{api}.{version}: {len(trimmed['schemas'])} schéma(s), révision {trimmed.get('revision')}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    if "--check" not in sys.argv[1:]:
+        pin_discovery_docs()
+    problems = check_pinned_clients()
+    for problem in problems:
+        print(f"❌ {problem}", file=sys.stderr)
+    if problems:
+        sys.exit(1)
+    print(f"{len(app_method_calls())} appel(s) Google vérifié(s) sur les clients figés", file=sys.stderr)
@@ -0,0 +1,74 @@
+import random
+import time
+from urllib.parse import urlsplit
+
+import httplib2
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+# POST de l'API Sheets qui relisent ou réécrivent les mêmes cellules : rejouables sans effet de bord.
+# Segment /values compris : spreadsheets:batchUpdate (appendDimension...) n'est pas rejouable
+IDEMPOTENT_POST_SUFFIXES = ("/values:batchGet", "/values:batchUpdate", "/values:batchClear", "/values:batchGetByDataFilter")
+MAX_RETRY_AFTER_SECONDS = 30
+
+
+class PooledHttp:
+    """
+    Transport compatible httplib2 (interface attendue par googleapiclient) au-dessus d'une
+    AuthorizedSession requests : pool de connexions keep-alive partagé entre threads, délais d'attente,
+    nouvelle tentative sur 429 (toujours) et sur 5xx pour les requêtes idempotentes uniquement
+    (un values.append, un appendDimension ou un files.create rejoué pourrait dupliquer des lignes ou des fichiers).
+    """
+
+    def __init__(self, credentials, pool_size=10, timeout=(10, 60), max_retries=3, backoff_seconds=0.5, session=None):
+        self.credentials = credentials
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.session = session or AuthorizedSession(credentials)
+        # Erreurs de connexion (requête jamais envoyée) : toujours rejouables
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=2, connect=2, read=0, redirect=0, status=0, other=0),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _retryable(self, method, uri, status):
+        if status == 429:
+            return True
+        method = method.upper()
+        if method in IDEMPOTENT_METHODS:
+            return True
+        return method == "POST" and urlsplit(uri).path.endswith(IDEMPOTENT_POST_SUFFIXES)
+
+    def _delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(int(retry_after), MAX_RETRY_AFTER_SECONDS)
+        return self.backoff_seconds * (2 ** (attempt - 1)) * (1 + random.random() / 2)
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        attempt = 0
+        while True:
+            response = self.session.request(method, uri, data=body, headers=headers, timeout=self.timeout)
+            if (response.status_code in RETRY_STATUSES and attempt < self.max_retries
+                    and self._retryable(method, uri, response.status_code)):
+                attempt += 1
+                time.sleep(self._delay(response, attempt))
+                continue
+            info = {name.lower(): value for name, value in response.headers.items()}
+            info["status"] = str(response.status_code)
+            resp = httplib2.Response(info)
+            resp.reason = response.reason
+            return resp, response.content
+
+    def close(self):
+        self.session.close()
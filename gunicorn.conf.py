@@ -0,0 +1,15 @@
+# Configuration gunicorn, chargée automatiquement depuis le répertoire de travail (`gunicorn main:app`)
+
+
+def post_fork(server, worker):
+    import main
+
+    # Préchauffage par worker (voir main.start_warmup) : /ready répond 503 tant qu'il n'est pas terminé
+    if main.WARMUP_ON_BOOT:
+        main.start_warmup()
+    # Jobs webhook restés en file (redémarrage, worker tué) repris dès le démarrage du worker
+    if main.WEBHOOK_ASYNC:
+        main.get_webhook_queue()
+    # Tampon de clés démarré tout de suite : son reaper rend les pré-réservations orphelines d'un crash
+    if main.KEY_PREFETCH_LOW_WATERMARK > 0:
+        main.get_key_prefetch_buffer()
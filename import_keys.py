@@ -0,0 +1,34 @@
+"""
+Import en masse de clés de licence depuis un CSV (format keys.csv ou une clé par ligne),
+avec détection des doublons sur tous les ranges/stores configurés.
+
+    python import_keys.py --sku B2C001_BUNDLE_LIFE nouvelles_cles.csv [--dry-run]
+"""
+import argparse
+import json
+import sys
+
+from main import _keys_from_csv_lines, find_product_config_for_sku, import_license_keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv_path", help="fichier CSV ('-' pour l'entrée standard)")
+    parser.add_argument("--sku", required=True, help="SKU dont le range/store reçoit les clés")
+    parser.add_argument("--dry-run", action="store_true", help="détecte les doublons sans rien écrire")
+    args = parser.parse_args()
+
+    config = find_product_config_for_sku(args.sku.strip().upper())
+    if not config:
+        parser.error(f"SKU inconnu: {args.sku}")
+
+    if args.csv_path == "-":
+        result = import_license_keys(config, _keys_from_csv_lines(sys.stdin), dry_run=args.dry_run)
+    else:
+        with open(args.csv_path, newline="", encoding="utf-8-sig") as f:
+            result = import_license_keys(config, _keys_from_csv_lines(f), dry_run=args.dry_run)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
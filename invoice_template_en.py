@@ -8,6 +8,7 @@ import subprocess
 from dataclasses import dataclass, field
 from datetime import date, datetime
 from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
 from html import escape
 from pathlib import Path
 from typing import Any
@@ -63,6 +64,13 @@ def image_data_uri(path: Path | None) -> str | None:
     if path is None or not path.exists():
         return None
 
+    stat = path.stat()
+    return _encoded_data_uri(str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=16)
+def _encoded_data_uri(resolved_path: str, mtime_ns: int, size: int) -> str:
+    path = Path(resolved_path)
     mime_types = {
         ".png": "image/png",
         ".jpg": "image/jpeg",
@@ -0,0 +1,183 @@
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS key_holds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    spreadsheet_id TEXT NOT NULL DEFAULT '',
+    range_name TEXT NOT NULL DEFAULT '',
+    row_number INTEGER,
+    key TEXT NOT NULL DEFAULT '',
+    quantity INTEGER NOT NULL DEFAULT 1,
+    header TEXT NOT NULL DEFAULT '[]',
+    to_email TEXT NOT NULL DEFAULT '',
+    language TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'held'
+);
+CREATE INDEX IF NOT EXISTS key_holds_order_idx ON key_holds (order_id, status);
+CREATE INDEX IF NOT EXISTS key_holds_expiry_idx ON key_holds (status, expires_at);
+"""
+
+COLUMNS = (
+    "id", "order_id", "sku", "spreadsheet_id", "range_name", "row_number", "key", "quantity",
+    "header", "to_email", "language", "created_at", "expires_at", "status",
+)
+
+
+class KeyHolds:
+    """
+    Registre partagé (SQLite, commun aux workers) des clés retenues pour une commande entre sa création
+    (reserve) et son paiement (commit). Une retenue Sheets pointe une ligne déjà marquée used='reserved'
+    dans la sheet ; une retenue sans row_number est une réservation différée au commit (store non Sheets).
+
+    Statuts : held -> committed (commit) ou held -> released (expiration, remise à disposition).
+    Les transitions se font en transaction : une retenue n'est jamais à la fois finalisée et libérée.
+
+    release(holds) remet les lignes expirées à disposition dans la sheet (appelé par le thread de fond).
+    """
+
+    def __init__(self, db_path, release=None):
+        self.db_path = db_path
+        self.release = release
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._reaper = None
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _rows(self, sql, params=()):
+        return [
+            dict(zip(COLUMNS, row), header=json.loads(row[8]))
+            for row in self._conn().execute(f"SELECT {', '.join(COLUMNS)} FROM key_holds {sql}", params)
+        ]
+
+    def add(self, order_id, to_email, language, holds, ttl_seconds):
+        """
+        holds = [{"sku", "spreadsheet_id", "range_name", "row_number", "key", "quantity", "header"}]
+        Retourne False (rien n'est enregistré) si la commande a déjà une retenue active ou a été finalisée.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = conn.execute(
+                """
+                SELECT 1 FROM key_holds
+                WHERE order_id = ? AND (status = 'committed' OR (status = 'held' AND expires_at > ?)) LIMIT 1
+                """,
+                (order_id, now),
+            ).fetchone()
+            if existing:
+                conn.execute("ROLLBACK")
+                return False
+            conn.executemany(
+                """
+                INSERT INTO key_holds (order_id, sku, spreadsheet_id, range_name, row_number, key, quantity,
+                                       header, to_email, language, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(
+                    order_id, hold["sku"], hold.get("spreadsheet_id") or "", hold.get("range_name") or "",
+                    hold.get("row_number"), hold.get("key") or "", hold.get("quantity", 1),
+                    json.dumps(hold.get("header") or []), to_email, language or "", now, now + ttl_seconds,
+                ) for hold in holds],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def for_order(self, order_id):
+        return self._rows("WHERE order_id = ? ORDER BY id", (order_id,))
+
+    def order_status(self, order_id):
+        """'committed' si la commande a déjà été finalisée, 'held' si une retenue est active, sinon None."""
+        statuses = {hold["status"] for hold in self.for_order(order_id)
+                    if hold["status"] != "held" or hold["expires_at"] > time.time()}
+        if "committed" in statuses:
+            return "committed"
+        return "held" if "held" in statuses else None
+
+    def take_for_commit(self, order_id):
+        """Passe les retenues actives de la commande en 'committed' et les retourne ([] si expirées ou absentes)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            holds = self._rows("WHERE order_id = ? AND status = 'held' AND expires_at > ? ORDER BY id",
+                               (order_id, time.time()))
+            conn.executemany("UPDATE key_holds SET status = 'committed' WHERE id = ?", [(h["id"],) for h in holds])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return holds
+
+    def restore(self, holds):
+        # Échec de finalisation : les retenues redeviennent actives (un nouveau commit pourra réessayer)
+        self._conn().executemany(
+            "UPDATE key_holds SET status = 'held' WHERE id = ? AND status = 'committed'", [(h["id"],) for h in holds])
+
+    def take_expired(self, limit=500):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            holds = self._rows("WHERE status = 'held' AND expires_at <= ? ORDER BY id LIMIT ?", (time.time(), limit))
+            conn.executemany("UPDATE key_holds SET status = 'released' WHERE id = ?", [(h["id"],) for h in holds])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return holds
+
+    def reap_expired(self):
+        """Libère les retenues expirées ; retourne le nombre de retenues traitées."""
+        released = 0
+        while True:
+            holds = self.take_expired()
+            if not holds:
+                return released
+            try:
+                if self.release:
+                    self.release(holds)
+            except Exception:
+                # Remises en 'held' (toujours expirées) : le prochain passage réessaiera
+                self._conn().executemany(
+                    "UPDATE key_holds SET status = 'held' WHERE id = ? AND status = 'released'",
+                    [(h["id"],) for h in holds])
+                raise
+            released += len(holds)
+
+    def start_reaper(self, interval_seconds):
+        if self._reaper and self._reaper.is_alive():
+            return self._reaper
+
+        def run():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.reap_expired()
+                except Exception as e:
+                    logger.warning("Libération des clés retenues expirées échouée: %s", e)
+
+        self._reaper = threading.Thread(target=run, name="key-holds-reaper", daemon=True)
+        self._reaper.start()
+        atexit.register(self._stop.set)
+        return self._reaper
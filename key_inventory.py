@@ -0,0 +1,273 @@
+import atexit
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS key_ranges (
+    spreadsheet_id TEXT NOT NULL,
+    range_name TEXT NOT NULL,
+    header TEXT NOT NULL,
+    imported_at TEXT NOT NULL,
+    PRIMARY KEY (spreadsheet_id, range_name)
+);
+CREATE TABLE IF NOT EXISTS license_keys (
+    spreadsheet_id TEXT NOT NULL,
+    range_name TEXT NOT NULL,
+    row_number INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    used INTEGER NOT NULL DEFAULT 0,
+    mail TEXT NOT NULL DEFAULT '',
+    date TEXT NOT NULL DEFAULT '',
+    order_id TEXT NOT NULL DEFAULT '',
+    synced INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (spreadsheet_id, range_name, row_number)
+);
+CREATE INDEX IF NOT EXISTS license_keys_free_idx
+    ON license_keys (spreadsheet_id, range_name, used, row_number);
+CREATE INDEX IF NOT EXISTS license_keys_unsynced_idx
+    ON license_keys (synced) WHERE synced = 0;
+"""
+
+
+class KeyInventory:
+    """
+    Inventaire local (SQLite) des clés de licence, importé depuis les ranges Google Sheets.
+    Les réservations sont de simples transactions locales ; les colonnes used/mail/date/order_id
+    sont repoussées vers la sheet en arrière-plan (write-behind), qui reste le registre lisible.
+
+    read_range(spreadsheet_id, range_name) -> [header, *rows] (premier numéro de ligne = header_row)
+    push_claims(spreadsheet_id, range_name, header, claims) où claims = [(row_number, {colonne: valeur})]
+    """
+
+    def __init__(self, db_path, read_range, push_claims, header_row_for_range=None, sync_batch_size=500):
+        self.db_path = db_path
+        self.read_range = read_range
+        self.push_claims = push_claims
+        self.header_row_for_range = header_row_for_range or (lambda range_name: 1)
+        self.sync_batch_size = sync_batch_size
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._syncer = None
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def has_range(self, spreadsheet_id, range_name):
+        row = self._conn().execute(
+            "SELECT 1 FROM key_ranges WHERE spreadsheet_id = ? AND range_name = ?",
+            (spreadsheet_id, range_name),
+        ).fetchone()
+        return row is not None
+
+    def import_range(self, spreadsheet_id, range_name):
+        values = self.read_range(spreadsheet_id, range_name)
+        if not values:
+            return 0
+        header = values[0]
+        col = {name: header.index(name) for name in ("key", "used", "mail", "date", "order_id") if name in header}
+        first_row = self.header_row_for_range(range_name) + 1
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+        def cell(row, name):
+            index = col.get(name)
+            return row[index] if index is not None and index < len(row) else ""
+
+        records = []
+        for offset, row in enumerate(values[1:]):
+            key = cell(row, "key").strip()
+            if not key:
+                continue
+            records.append((
+                spreadsheet_id, range_name, first_row + offset, key,
+                1 if cell(row, "used").strip().lower() != "false" else 0,
+                cell(row, "mail"), cell(row, "date"), cell(row, "order_id"),
+            ))
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # La sheet fait foi pour les lignes déjà synchronisées, sans jamais libérer une clé utilisée localement.
+            # Une ligne dont la clé a changé (vidée par l'archivage puis réutilisée par un import) est une nouvelle clé.
+            conn.executemany(
+                """
+                INSERT INTO license_keys (spreadsheet_id, range_name, row_number, key, used, mail, date, order_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (spreadsheet_id, range_name, row_number) DO UPDATE SET
+                    key = excluded.key,
+                    used = CASE WHEN license_keys.key != excluded.key THEN excluded.used
+                                ELSE MAX(license_keys.used, excluded.used) END,
+                    mail = CASE WHEN license_keys.key = excluded.key AND license_keys.used = 1 AND excluded.used = 0
+                                THEN license_keys.mail ELSE excluded.mail END,
+                    date = CASE WHEN license_keys.key = excluded.key AND license_keys.used = 1 AND excluded.used = 0
+                                THEN license_keys.date ELSE excluded.date END,
+                    order_id = CASE WHEN license_keys.key = excluded.key AND license_keys.used = 1 AND excluded.used = 0
+                                    THEN license_keys.order_id ELSE excluded.order_id END
+                WHERE license_keys.synced = 1
+                """,
+                records,
+            )
+            conn.execute(
+                """
+                INSERT INTO key_ranges (spreadsheet_id, range_name, header, imported_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (spreadsheet_id, range_name) DO UPDATE SET header = excluded.header, imported_at = excluded.imported_at
+                """,
+                (spreadsheet_id, range_name, json.dumps(header), now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(records)
+
+    def claim(self, spreadsheet_id, range_name, count, to_email, order_id=None):
+        """Réserve `count` clés en une transaction ; None (rien n'est marqué) si le stock est insuffisant."""
+        if count <= 0:
+            return []
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                """
+                SELECT row_number, key FROM license_keys
+                WHERE spreadsheet_id = ? AND range_name = ? AND used = 0
+                ORDER BY row_number LIMIT ?
+                """,
+                (spreadsheet_id, range_name, count),
+            ).fetchall()
+            if len(rows) < count:
+                conn.execute("ROLLBACK")
+                return None
+            conn.executemany(
+                """
+                UPDATE license_keys SET used = 1, mail = ?, date = ?, order_id = ?, synced = 0
+                WHERE spreadsheet_id = ? AND range_name = ? AND row_number = ?
+                """,
+                [(to_email, now, order_id or "", spreadsheet_id, range_name, row_number) for row_number, _ in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [key for _, key in rows]
+
+    def release(self, spreadsheet_id, range_name, keys):
+        """Remet des clés réservées à disposition (synchro vers la sheet comme une réservation) ; retourne leur nombre."""
+        keys = list(keys)
+        if not keys:
+            return 0
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            released = conn.executemany(
+                """
+                UPDATE license_keys SET used = 0, mail = '', date = '', order_id = '', synced = 0
+                WHERE spreadsheet_id = ? AND range_name = ? AND key = ? AND used = 1
+                """,
+                [(spreadsheet_id, range_name, key) for key in keys],
+            ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return released
+
+    def counts(self, ranges):
+        """{(spreadsheet_id, range_name): {"free": n, "reserved": 0, "used": n}} via l'index (pas de lecture Sheets)."""
+        result = {tuple(range_id): {"free": 0, "reserved": 0, "used": 0} for range_id in ranges}
+        rows = self._conn().execute(
+            "SELECT spreadsheet_id, range_name, used, COUNT(*) FROM license_keys GROUP BY spreadsheet_id, range_name, used"
+        ).fetchall()
+        for spreadsheet_id, range_name, used, total in rows:
+            if (spreadsheet_id, range_name) in result:
+                result[(spreadsheet_id, range_name)]["used" if used else "free"] = total
+        return result
+
+    def sync_pending(self):
+        """Pousse les réservations non synchronisées vers la sheet, par lots. Retourne le nombre de lignes poussées."""
+        pushed = 0
+        with self._sync_lock:
+            conn = self._conn()
+            while True:
+                rows = conn.execute(
+                    """
+                    SELECT k.spreadsheet_id, k.range_name, k.row_number, k.key, k.used, k.mail, k.date, k.order_id,
+                           r.header
+                    FROM license_keys k JOIN key_ranges r
+                        ON r.spreadsheet_id = k.spreadsheet_id AND r.range_name = k.range_name
+                    WHERE k.synced = 0
+                    ORDER BY k.spreadsheet_id, k.range_name, k.row_number
+                    LIMIT ?
+                    """,
+                    (self.sync_batch_size,),
+                ).fetchall()
+                if not rows:
+                    return pushed
+                grouped = {}
+                for spreadsheet_id, range_name, row_number, key, used, mail, date, order_id, header in rows:
+                    claims = grouped.setdefault((spreadsheet_id, range_name, header), [])
+                    claims.append((row_number, {
+                        "key": key, "used": "true" if used else "false", "mail": mail, "date": date, "order_id": order_id,
+                    }))
+                for (spreadsheet_id, range_name, header), claims in grouped.items():
+                    self.push_claims(spreadsheet_id, range_name, json.loads(header), claims)
+                    conn.executemany(
+                        """
+                        UPDATE license_keys SET synced = 1
+                        WHERE spreadsheet_id = ? AND range_name = ? AND row_number = ? AND used = ?
+                        """,
+                        [(spreadsheet_id, range_name, row_number, int(values["used"] == "true"))
+                         for row_number, values in claims],
+                    )
+                    pushed += len(claims)
+                if len(rows) < self.sync_batch_size:
+                    return pushed
+
+    def start_syncer(self, interval_seconds, refresh_ranges=None, refresh_every_seconds=None):
+        """
+        Thread de fond : pousse les réservations toutes les `interval_seconds` et réimporte
+        périodiquement `refresh_ranges` pour récupérer les nouvelles clés collées dans la sheet.
+        """
+        if self._syncer and self._syncer.is_alive():
+            return self._syncer
+
+        def run():
+            last_refresh = datetime.datetime.now(datetime.timezone.utc)
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.sync_pending()
+                    if refresh_ranges and refresh_every_seconds:
+                        now = datetime.datetime.now(datetime.timezone.utc)
+                        if (now - last_refresh).total_seconds() >= refresh_every_seconds:
+                            for spreadsheet_id, range_name in refresh_ranges:
+                                self.import_range(spreadsheet_id, range_name)
+                            last_refresh = now
+                except Exception as e:
+                    logger.warning("Sync inventaire de clés échouée: %s", e)
+
+        self._syncer = threading.Thread(target=run, name="key-inventory-sync", daemon=True)
+        self._syncer.start()
+        atexit.register(self.stop)
+        return self._syncer
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self.sync_pending()
+        except Exception as e:
+            logger.warning("Sync finale de l'inventaire de clés échouée: %s", e)
@@ -0,0 +1,96 @@
+import atexit
+import datetime
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+STATES = ("free", "reserved", "used")
+
+
+class KeyLevels:
+    """
+    Compteurs de clés libres/réservées/utilisées par range, tenus à jour à chaque réservation
+    (record) et recalés périodiquement par un thread de fond via fetch_counts, qui ne doit faire
+    qu'un batchGet par spreadsheet. Les lectures (snapshot) ne touchent jamais la sheet.
+    `ranges` est une liste ou un callable réévalué à chaque recalage (config rechargée à chaud).
+
+    fetch_counts(ranges) -> {(spreadsheet_id, range_name): {"free": n, "reserved": n, "used": n}}
+    """
+
+    def __init__(self, fetch_counts, ranges, refresh_seconds=300, alert_threshold=0, log=None):
+        self.fetch_counts = fetch_counts
+        self.ranges = ranges if callable(ranges) else list(ranges)
+        self.refresh_seconds = refresh_seconds
+        self.alert_threshold = alert_threshold
+        self.log = log or logger.warning
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._refreshed_at = None
+        self._alerted = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, spreadsheet_id, range_name, count, from_state="free", to_state="used"):
+        range_id = (spreadsheet_id, range_name)
+        with self._lock:
+            counts = self._counts.get(range_id)
+            if counts is None:
+                return
+            if from_state:
+                counts[from_state] = max(0, counts[from_state] - count)
+            counts[to_state] += count
+        self._check_threshold(range_id)
+
+    def refresh(self):
+        fresh = self.fetch_counts(self.ranges() if callable(self.ranges) else self.ranges)
+        with self._lock:
+            for range_id, counts in fresh.items():
+                self._counts[range_id] = {state: int(counts.get(state, 0)) for state in STATES}
+            self._refreshed_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        for range_id in fresh:
+            self._check_threshold(range_id)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "refreshed_at": self._refreshed_at,
+                "alert_threshold": self.alert_threshold,
+                "ranges": {range_id: dict(counts) for range_id, counts in self._counts.items()},
+            }
+
+    def _check_threshold(self, range_id):
+        if not self.alert_threshold:
+            return
+        with self._lock:
+            counts = self._counts.get(range_id)
+            if counts is None:
+                return
+            low = counts["free"] < self.alert_threshold
+            newly_low = low and range_id not in self._alerted
+            if low:
+                self._alerted.add(range_id)
+            else:
+                self._alerted.discard(range_id)
+            free = counts["free"]
+        if newly_low:
+            self.log(f"🚨 Stock de clés bas pour {range_id[1]}: {free} clé(s) libre(s) (seuil {self.alert_threshold})")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return self._thread
+
+        def run():
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.warning("Rafraîchissement des niveaux de clés échoué: %s", e)
+                if self._stop.wait(self.refresh_seconds):
+                    break
+
+        self._thread = threading.Thread(target=run, name="key-levels", daemon=True)
+        self._thread.start()
+        atexit.register(self._stop.set)
+        return self._thread
@@ -0,0 +1,178 @@
+import atexit
+import collections
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class KeyPrefetchBuffer:
+    """
+    Tampon par range de clés pré-réservées dans la sheet (used='reserved'), rechargé en arrière-plan
+    dès qu'il passe sous `low_watermark`. Une commande pioche dans le tampon sans lecture ni verrou :
+    seule la finalisation (used/mail/date/order_id) est écrite, avant de rendre les clés, pour qu'une
+    clé livrée ne reste jamais 'reserved' (le reaper la remettrait en vente après un crash).
+
+    Un arrêt propre (atexit) rend les clés du tampon ; contre un arrêt brutal (crash, SIGKILL, OOM),
+    le tampon rend lui-même ses clés de plus de max_age_seconds, et reap(owned) est appelé au
+    démarrage du thread puis toutes les reap_interval_seconds pour libérer les pré-réservations
+    orphelines de la sheet (owned = {(range_id, row_number)} encore tenues par ce process).
+
+    reserve(spreadsheet_id, range_name, count) -> (header, [(row_number, key), ...]) ou None
+    push(spreadsheet_id, range_name, header, claims) où claims = [(row_number, {colonne: valeur})]
+    on_release(spreadsheet_id, range_name, row_numbers) appelé après remise à disposition des clés
+    """
+
+    def __init__(self, reserve, push, low_watermark, batch_size, interval_seconds=5, on_release=None,
+                 max_age_seconds=3600, reap=None, reap_interval_seconds=600):
+        self.reserve = reserve
+        self.push = push
+        self.on_release = on_release
+        self.low_watermark = low_watermark
+        self.batch_size = max(batch_size, low_watermark)
+        self.interval_seconds = interval_seconds
+        self.max_age_seconds = max_age_seconds
+        self.reap = reap
+        self.reap_interval_seconds = reap_interval_seconds
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._headers = {}
+        # Lignes sorties du tampon dont la finalisation est en cours d'écriture
+        self._issuing = set()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def take(self, spreadsheet_id, range_name, count, to_email, order_id, now):
+        """
+        Finalise `count` clés du tampon dans la sheet (un seul batchUpdate) et les retourne, ou None si le
+        tampon n'en contient pas assez (le range est alors enregistré) ou si l'écriture échoue (les clés
+        retournent dans le tampon).
+        """
+        range_id = (spreadsheet_id, range_name)
+        with self._lock:
+            buffer = self._buffers.setdefault(range_id, collections.deque())
+            if len(buffer) < count:
+                self._wake.set()
+                return None
+            taken = [buffer.popleft() for _ in range(count)]
+            issued = {(range_id, row_number) for row_number, _, _ in taken}
+            self._issuing.update(issued)
+            header = self._headers[range_id]
+            if len(buffer) < self.low_watermark:
+                self._wake.set()
+        claims = [
+            (row_number, {"key": key, "used": "true", "mail": to_email, "date": now, "order_id": order_id or ""})
+            for row_number, key, _ in taken
+        ]
+        try:
+            self.push(spreadsheet_id, range_name, header, claims)
+        except Exception as e:
+            # Les lignes sont toujours pré-réservées à notre nom : une autre commande pourra les prendre
+            with self._lock:
+                self._issuing.difference_update(issued)
+                buffer.extendleft(reversed(taken))
+            logger.warning("Tampon de clés: finalisation de %s clé(s) %s échouée: %s", count, range_name, e)
+            return None
+        with self._lock:
+            self._issuing.difference_update(issued)
+        return [key for _, key, _ in taken]
+
+    def levels(self):
+        with self._lock:
+            return {range_id: len(buffer) for range_id, buffer in self._buffers.items()}
+
+    def owned_rows(self):
+        """{(range_id, row_number)} tenues par ce process : en tampon ou en cours de finalisation."""
+        with self._lock:
+            owned = {(range_id, row_number) for range_id, buffer in self._buffers.items() for row_number, _, _ in buffer}
+            owned.update(self._issuing)
+        return owned
+
+    def _release(self, buffers):
+        # buffers = {range_id: [(row_number, key)]} -> used='false' dans la sheet, puis on_release
+        for (spreadsheet_id, range_name), rows in buffers.items():
+            claims = [
+                (row_number, {"key": key, "used": "false", "mail": "", "date": "", "order_id": ""})
+                for row_number, key in rows
+            ]
+            try:
+                self.push(spreadsheet_id, range_name, self._headers[(spreadsheet_id, range_name)], claims)
+                if self.on_release:
+                    self.on_release(spreadsheet_id, range_name, [row_number for row_number, _ in rows])
+            except Exception as e:
+                logger.warning("Tampon de clés: libération de %s clé(s) %s échouée: %s", len(rows), range_name, e)
+
+    def expire_old(self):
+        """Rend les clés pré-réservées depuis plus de max_age_seconds (le reaper des autres process les croirait orphelines)."""
+        cutoff = time.monotonic() - self.max_age_seconds
+        expired = {}
+        with self._lock:
+            for range_id, buffer in self._buffers.items():
+                # Entrées ajoutées dans l'ordre de réservation : les plus anciennes en tête
+                while buffer and buffer[0][2] < cutoff:
+                    expired.setdefault(range_id, []).append(buffer.popleft()[:2])
+        self._release(expired)
+        return sum(len(rows) for rows in expired.values())
+
+    def refill(self):
+        with self._lock:
+            missing = {
+                range_id: self.batch_size - len(buffer)
+                for range_id, buffer in self._buffers.items()
+                if len(buffer) < self.low_watermark
+            }
+        for (spreadsheet_id, range_name), count in missing.items():
+            reserved = self.reserve(spreadsheet_id, range_name, count)
+            if not reserved:
+                logger.warning("Pré-réservation impossible pour %s (%s clé(s))", range_name, count)
+                continue
+            header, rows = reserved
+            reserved_at = time.monotonic()
+            with self._lock:
+                self._headers[(spreadsheet_id, range_name)] = header
+                self._buffers[(spreadsheet_id, range_name)].extend(
+                    (row_number, key, reserved_at) for row_number, key in rows)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return self._thread
+
+        def run():
+            last_reap = None
+            while not self._stop.is_set():
+                # Même thread que refill : une ligne en cours de pré-réservation n'est jamais prise pour orpheline
+                if self.reap and (last_reap is None or time.monotonic() - last_reap >= self.reap_interval_seconds):
+                    last_reap = time.monotonic()
+                    try:
+                        self.reap(self.owned_rows())
+                    except Exception as e:
+                        logger.warning("Tampon de clés: libération des pré-réservations orphelines échouée: %s", e)
+                self._wake.wait(self.interval_seconds)
+                self._wake.clear()
+                if self._stop.is_set():
+                    break
+                try:
+                    self.expire_old()
+                    self.refill()
+                except Exception as e:
+                    logger.warning("Tampon de clés: échec de rechargement: %s", e)
+
+        self._thread = threading.Thread(target=run, name="key-prefetch", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self._thread
+
+    def stop(self):
+        """Remet à disposition (used='false') les clés encore en tampon."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=10)
+        with self._lock:
+            buffers = {range_id: [entry[:2] for entry in buffer] for range_id, buffer in self._buffers.items() if buffer}
+            for buffer in self._buffers.values():
+                buffer.clear()
+        self._release(buffers)
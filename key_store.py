@@ -0,0 +1,327 @@
+import abc
+import contextlib
+import csv
+import datetime
+import fcntl
+import os
+import sqlite3
+import threading
+
+
+KEY_COLUMNS = ["key", "used", "mail", "date", "order_id"]
+
+
+class KeyStoreError(RuntimeError):
+    pass
+
+
+class KeyStore(abc.ABC):
+    """
+    Stockage de clés de licence. Une entrée de PRODUCT_CONFIG choisit son backend via "store"
+    ("sheets" par défaut, "csv" ou "sqlite").
+
+    claim(count, to_email, order_id=None) -> [clés] ou None si le stock est insuffisant (rien n'est marqué)
+    release(keys) -> nombre de clés réservées remises à disposition (commande abandonnée avant envoi)
+    counts() -> {"free": n, "reserved": n, "used": n}
+    add_keys(keys) -> nombre de clés ajoutées
+    all_keys() -> toutes les clés connues du store (index de doublons)
+    """
+
+    kind = None
+
+    @property
+    @abc.abstractmethod
+    def store_id(self):
+        """Identifiant du stock (clé des compteurs de niveaux)."""
+
+    def describe(self):
+        return {"store": self.kind}
+
+    @abc.abstractmethod
+    def claim(self, count, to_email, order_id=None):
+        pass
+
+    @abc.abstractmethod
+    def release(self, keys):
+        pass
+
+    @abc.abstractmethod
+    def counts(self):
+        pass
+
+    @abc.abstractmethod
+    def add_keys(self, keys):
+        pass
+
+    @abc.abstractmethod
+    def all_keys(self):
+        pass
+
+
+class SheetsKeyStore(KeyStore):
+    """Délègue aux fonctions Google Sheets de main (curseur, verrou, écriture ciblée)."""
+
+    kind = "sheets"
+
+    def __init__(self, spreadsheet_id, range_name, claim_fn, counts_fn, add_keys_fn=None, release_fn=None,
+                 all_keys_fn=None):
+        self.spreadsheet_id = spreadsheet_id
+        self.range_name = range_name
+        self._claim_fn = claim_fn
+        self._counts_fn = counts_fn
+        self._add_keys_fn = add_keys_fn
+        self._release_fn = release_fn
+        self._all_keys_fn = all_keys_fn
+
+    @property
+    def store_id(self):
+        return (self.spreadsheet_id, self.range_name)
+
+    def describe(self):
+        return {"store": self.kind, "spreadsheet_id": self.spreadsheet_id, "range_name": self.range_name}
+
+    def claim(self, count, to_email, order_id=None):
+        return self._claim_fn(to_email, self.spreadsheet_id, self.range_name, count, order_id=order_id)
+
+    def release(self, keys):
+        if not self._release_fn:
+            raise KeyStoreError("Remise à disposition non supportée pour ce range Sheets")
+        return self._release_fn(self.spreadsheet_id, self.range_name, keys)
+
+    def counts(self):
+        return self._counts_fn([self.store_id]).get(self.store_id, {"free": 0, "reserved": 0, "used": 0})
+
+    def add_keys(self, keys):
+        if not self._add_keys_fn:
+            raise KeyStoreError("Ajout de clés non supporté pour ce range Sheets")
+        return self._add_keys_fn(self.spreadsheet_id, self.range_name, keys)
+
+    def all_keys(self):
+        if not self._all_keys_fn:
+            raise KeyStoreError("Lecture des clés non supportée pour ce range Sheets")
+        return self._all_keys_fn(self.spreadsheet_id, self.range_name)
+
+
+def _now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class CsvKeyStore(KeyStore):
+    """Fichier CSV au format de keys.csv (key,used,mail,date[,order_id]) ; verrou fcntl + réécriture atomique."""
+
+    kind = "csv"
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+
+    @property
+    def store_id(self):
+        return ("csv", os.path.abspath(self.path))
+
+    def describe(self):
+        return {"store": self.kind, "path": self.path}
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._thread_lock, open(f"{self.path}.lock", "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return list(KEY_COLUMNS), []
+        with open(self.path, newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        if not rows:
+            return list(KEY_COLUMNS), []
+        header = [name.strip() for name in rows[0]]
+        return header, [row + [""] * (len(header) - len(row)) for row in rows[1:]]
+
+    def _write(self, header, rows):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(header)
+            writer.writerows(rows)
+        os.replace(tmp_path, self.path)
+
+    def claim(self, count, to_email, order_id=None):
+        if count <= 0:
+            return []
+        with self._locked():
+            header, rows = self._read()
+            used_index = header.index("used")
+            free_rows = [row for row in rows if row[used_index].strip().lower() == "false"][:count]
+            if len(free_rows) < count:
+                return None
+            now = _now_iso()
+            for row in free_rows:
+                row[used_index] = "true"
+                row[header.index("mail")] = to_email
+                row[header.index("date")] = now
+                if "order_id" in header:
+                    row[header.index("order_id")] = order_id or ""
+            self._write(header, rows)
+        return [row[header.index("key")] for row in free_rows]
+
+    def release(self, keys):
+        keys = set(keys)
+        if not keys:
+            return 0
+        with self._locked():
+            header, rows = self._read()
+            released = 0
+            for row in rows:
+                if row[header.index("key")] in keys and row[header.index("used")].strip().lower() == "true":
+                    row[header.index("used")] = "false"
+                    for name in ("mail", "date", "order_id"):
+                        if name in header:
+                            row[header.index(name)] = ""
+                    released += 1
+            if released:
+                self._write(header, rows)
+        return released
+
+    def counts(self):
+        header, rows = self._read()
+        used_index = header.index("used")
+        result = {"free": 0, "reserved": 0, "used": 0}
+        for row in rows:
+            value = row[used_index].strip().lower()
+            if value == "false":
+                result["free"] += 1
+            elif value == "reserved":
+                result["reserved"] += 1
+            elif value:
+                result["used"] += 1
+        return result
+
+    def all_keys(self):
+        header, rows = self._read()
+        key_index = header.index("key")
+        return [row[key_index] for row in rows if row[key_index]]
+
+    def add_keys(self, keys):
+        with self._locked():
+            header, rows = self._read()
+            blank = [""] * len(header)
+            for key in keys:
+                row = list(blank)
+                row[header.index("key")] = key
+                row[header.index("used")] = "false"
+                rows.append(row)
+            self._write(header, rows)
+        return len(keys)
+
+
+class SqliteKeyStore(KeyStore):
+    """Clés stockées uniquement en SQLite (sans miroir Sheets), un espace de noms par produit/range."""
+
+    kind = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS store_keys (
+        namespace TEXT NOT NULL,
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT NOT NULL,
+        used INTEGER NOT NULL DEFAULT 0,
+        mail TEXT NOT NULL DEFAULT '',
+        date TEXT NOT NULL DEFAULT '',
+        order_id TEXT NOT NULL DEFAULT ''
+    );
+    CREATE INDEX IF NOT EXISTS store_keys_free_idx ON store_keys (namespace, used, id);
+    """
+
+    def __init__(self, path, namespace):
+        self.path = path
+        self.namespace = namespace
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+
+    @property
+    def store_id(self):
+        return (f"sqlite:{os.path.abspath(self.path)}", self.namespace)
+
+    def describe(self):
+        return {"store": self.kind, "path": self.path, "namespace": self.namespace}
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def claim(self, count, to_email, order_id=None):
+        if count <= 0:
+            return []
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, key FROM store_keys WHERE namespace = ? AND used = 0 ORDER BY id LIMIT ?",
+                (self.namespace, count),
+            ).fetchall()
+            if len(rows) < count:
+                conn.execute("ROLLBACK")
+                return None
+            now = _now_iso()
+            conn.executemany(
+                "UPDATE store_keys SET used = 1, mail = ?, date = ?, order_id = ? WHERE id = ?",
+                [(to_email, now, order_id or "", row_id) for row_id, _ in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [key for _, key in rows]
+
+    def release(self, keys):
+        keys = list(keys)
+        if not keys:
+            return 0
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            released = conn.executemany(
+                "UPDATE store_keys SET used = 0, mail = '', date = '', order_id = '' "
+                "WHERE namespace = ? AND key = ? AND used = 1",
+                [(self.namespace, key) for key in keys],
+            ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return released
+
+    def counts(self):
+        result = {"free": 0, "reserved": 0, "used": 0}
+        for used, total in self._conn().execute(
+            "SELECT used, COUNT(*) FROM store_keys WHERE namespace = ? GROUP BY used", (self.namespace,)
+        ):
+            result["used" if used else "free"] = total
+        return result
+
+    def add_keys(self, keys):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO store_keys (namespace, key) VALUES (?, ?)",
+                [(self.namespace, key) for key in keys],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(keys)
+
+    def all_keys(self):
+        return [key for (key,) in self._conn().execute(
+            "SELECT key FROM store_keys WHERE namespace = ?", (self.namespace,)
+        )]
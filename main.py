@@ -7,17 +7,36 @@ import pickle
 import re
 import requests
 import tempfile
+import csv
+import io
+import threading
+import time
+import contextlib
+import fcntl
+import hashlib
+import hmac
+import socket
 from pathlib import Path
 from urllib.parse import quote
 import subprocess
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.http import MediaFileUpload
-from invoice_template_en import invoice_from_shopify_payload, write_invoice_html, write_invoice_pdf
+from concurrent.futures import ThreadPoolExecutor, as_completed
+# googleapiclient, google-auth, google_auth_oauthlib (et httplib2/pyparsing) sont importés au premier
+# appel Google : un worker qui ne sert que /webhook ne les charge pas au démarrage (cf. benchmarks/import_time.py)
+from google_credentials import GoogleCredentialsManager
+from google_discovery import build_service as build_google_service
+from key_holds import KeyHolds
+from key_inventory import KeyInventory
+from key_prefetch import KeyPrefetchBuffer
+from key_levels import KeyLevels
+from order_journal import OrderJournal
+from key_store import CsvKeyStore, KeyStoreError, SheetsKeyStore, SqliteKeyStore
+from sku_router import ReloadingSkuRouter, SkuRouter
+from startup_warmup import SkipStep, Warmup
+from webhook_dedupe import WebhookDedupe
+from webhook_jobs import WebhookJobQueue
+from invoice_template_en import image_data_uri, invoice_from_shopify_payload, write_invoice_html, write_invoice_pdf
 from google_business_reviews import bp as google_business_reviews_bp
-from store_reviews import bp as store_reviews_bp
+from store_reviews import StoreReviewsConfigError, bp as store_reviews_bp, warm_app_store_token
 from decathlon_reviews import bp as decathlon_reviews_bp
 from judgeme_reviews import bp as judgeme_reviews_bp
 
@@ -45,6 +64,76 @@ MIRAKL_SHOP_IDS = [
     if s.strip()
 ]
 
+# Table de routage SKU externe (fichier JSON rechargé à chaud ou JSON inline) ; à défaut, PRODUCT_CONFIG ci-dessous
+PRODUCT_CONFIG_FILE = os.environ.get("PRODUCT_CONFIG_FILE", "")
+PRODUCT_CONFIG_JSON = os.environ.get("PRODUCT_CONFIG_JSON", "")
+PRODUCT_CONFIG_RELOAD_SECONDS = float(os.environ.get("PRODUCT_CONFIG_RELOAD_SECONDS", "5"))
+
+# Curseur de première ligne libre par range de clés (évite de rescanner les clés déjà utilisées)
+KEY_CURSOR_STATE_FILE = os.environ.get("KEY_CURSOR_STATE_FILE", "key_cursor_state.json")
+KEY_CURSOR_WINDOW_ROWS = int(os.environ.get("KEY_CURSOR_WINDOW_ROWS", "200"))
+
+# Verrou inter-workers sur les réservations de clés (fichiers de lock partagés par les process de la machine)
+KEY_LOCK_DIR = os.environ.get("KEY_LOCK_DIR", tempfile.gettempdir())
+KEY_LOCK_TIMEOUT_SECONDS = float(os.environ.get("KEY_LOCK_TIMEOUT_SECONDS", "30"))
+KEY_CLAIM_MAX_ATTEMPTS = int(os.environ.get("KEY_CLAIM_MAX_ATTEMPTS", "3"))
+
+# Tampon de clés pré-réservées par range (0 = désactivé) : une commande n'écrit que sa finalisation, sans lecture ni verrou
+KEY_PREFETCH_LOW_WATERMARK = int(os.environ.get("KEY_PREFETCH_LOW_WATERMARK", "0"))
+KEY_PREFETCH_BATCH_SIZE = int(os.environ.get("KEY_PREFETCH_BATCH_SIZE", "20"))
+KEY_PREFETCH_INTERVAL_SECONDS = float(os.environ.get("KEY_PREFETCH_INTERVAL_SECONDS", "5"))
+# Clés du tampon rendues par leur process au-delà de cet âge ; une pré-réservation de plus du double
+# (ou d'un process disparu de cette machine) est orpheline et remise à disposition par le reaper
+KEY_PREFETCH_MAX_AGE_SECONDS = float(os.environ.get("KEY_PREFETCH_MAX_AGE_SECONDS", "3600"))
+KEY_PREFETCH_REAP_SECONDS = float(os.environ.get("KEY_PREFETCH_REAP_SECONDS", "600"))
+
+# Niveaux de stock de clés (compteurs en cache, recalés périodiquement) + alerte dans les logs
+KEY_LEVELS_REFRESH_SECONDS = float(os.environ.get("KEY_LEVELS_REFRESH_SECONDS", "300"))
+KEY_LEVELS_ALERT_THRESHOLD = int(os.environ.get("KEY_LEVELS_ALERT_THRESHOLD", "50"))
+KEYS_ADMIN_TOKEN = os.environ.get("KEYS_ADMIN_TOKEN", "").strip()
+
+# Archivage des clés utilisées : copiées dans l'onglet "<onglet><suffixe>" (à créer) puis effacées du range actif
+KEY_ARCHIVE_SPREADSHEET_ID = os.environ.get("KEY_ARCHIVE_SPREADSHEET_ID", "")  # vide = même spreadsheet
+KEY_ARCHIVE_SHEET_SUFFIX = os.environ.get("KEY_ARCHIVE_SHEET_SUFFIX", " (archive)")
+KEY_ARCHIVE_BATCH_ROWS = int(os.environ.get("KEY_ARCHIVE_BATCH_ROWS", "500"))
+
+# Import de clés en masse : une écriture Sheets par paquet de KEY_IMPORT_CHUNK_ROWS lignes
+KEY_IMPORT_CHUNK_ROWS = int(os.environ.get("KEY_IMPORT_CHUNK_ROWS", "10000"))
+
+# Inventaire local SQLite des clés (optionnel) : vide = réservation directe dans Google Sheets
+KEY_INVENTORY_DB = os.environ.get("KEY_INVENTORY_DB", "")
+KEY_INVENTORY_SYNC_SECONDS = float(os.environ.get("KEY_INVENTORY_SYNC_SECONDS", "5"))
+KEY_INVENTORY_REFRESH_SECONDS = float(os.environ.get("KEY_INVENTORY_REFRESH_SECONDS", "600"))
+
+# Réservation en deux temps (création de commande -> paiement) : registre partagé des clés retenues
+KEY_HOLDS_DB = os.environ.get("KEY_HOLDS_DB", "key_holds.db")
+KEY_HOLD_TTL_SECONDS = float(os.environ.get("KEY_HOLD_TTL_SECONDS", "900"))
+KEY_HOLD_REAP_SECONDS = float(os.environ.get("KEY_HOLD_REAP_SECONDS", "30"))
+
+# File durable des webhooks /webhook et /webhook/invoice : 202 immédiat, traitement par des threads de fond
+WEBHOOK_ASYNC = os.environ.get("WEBHOOK_ASYNC", "1").lower() in {"1", "true", "yes"}
+WEBHOOK_QUEUE_DB = os.environ.get("WEBHOOK_QUEUE_DB", "webhook_jobs.db")
+WEBHOOK_QUEUE_WORKERS = int(os.environ.get("WEBHOOK_QUEUE_WORKERS", "4"))
+WEBHOOK_QUEUE_POLL_SECONDS = float(os.environ.get("WEBHOOK_QUEUE_POLL_SECONDS", "1"))
+WEBHOOK_JOB_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_JOB_MAX_ATTEMPTS", "5"))
+WEBHOOK_JOB_RETRY_SECONDS = float(os.environ.get("WEBHOOK_JOB_RETRY_SECONDS", "30"))
+# Bail d'un job en cours : au-delà, le job est considéré abandonné (worker tué) et repris ailleurs
+WEBHOOK_JOB_LEASE_SECONDS = float(os.environ.get("WEBHOOK_JOB_LEASE_SECONDS", "900"))
+
+# Déduplication des renvois de webhooks (empreinte : id de commande, en-tête webhook, sinon hash du body).
+# Renvoi volontaire dans la fenêtre : en-têtes X-Dedupe-Bypass: 1 + X-Admin-Token (voir _deduplicated)
+WEBHOOK_DEDUPE_DB = os.environ.get("WEBHOOK_DEDUPE_DB", "webhook_dedupe.db")
+WEBHOOK_DEDUPE_TTL_SECONDS = float(os.environ.get("WEBHOOK_DEDUPE_TTL_SECONDS", "172800"))
+# Hash du body seul : fenêtre courte (deux commandes légitimes identiques d'un même client restent possibles)
+WEBHOOK_DEDUPE_BODY_TTL_SECONDS = float(os.environ.get("WEBHOOK_DEDUPE_BODY_TTL_SECONDS", "900"))
+
+# Journal de traitement par commande : une nouvelle tentative réutilise les clés réservées et les emails envoyés
+ORDER_JOURNAL_DB = os.environ.get("ORDER_JOURNAL_DB", "order_journal.db")
+ORDER_JOURNAL_RETENTION_SECONDS = float(os.environ.get("ORDER_JOURNAL_RETENTION_SECONDS", str(30 * 86400)))
+
+# Emails d'une commande envoyés en parallèle une fois les clés réservées (1 = un par un)
+ORDER_DELIVERY_WORKERS = int(os.environ.get("ORDER_DELIVERY_WORKERS", "4"))
+
 # Amazon SP-API
 AMAZON_LWA_CLIENT_ID = os.environ.get("AMAZON_LWA_CLIENT_ID")
 AMAZON_LWA_CLIENT_SECRET = os.environ.get("AMAZON_LWA_CLIENT_SECRET")
@@ -72,8 +161,21 @@ app.register_blueprint(store_reviews_bp)
 app.register_blueprint(decathlon_reviews_bp)
 app.register_blueprint(judgeme_reviews_bp)
 GOOGLE_DRIVE_INVOICE_FOLDER_ID = os.environ.get("GOOGLE_DRIVE_INVOICE_FOLDER_ID", "1bnXRpUh6Du2ofq_WNTEtWvrrIh1e-xQf")
+# Jetons Google rafraîchis en arrière-plan avant expiration (marge > seuil de rafraîchissement de google-auth)
+GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS = float(os.environ.get("GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS", "600"))
+GOOGLE_TOKEN_CHECK_SECONDS = float(os.environ.get("GOOGLE_TOKEN_CHECK_SECONDS", "60"))
+# Transport HTTP partagé (pool keep-alive) des clients Sheets/Drive
+GOOGLE_HTTP_POOL_SIZE = int(os.environ.get("GOOGLE_HTTP_POOL_SIZE", "10"))
+GOOGLE_HTTP_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("GOOGLE_HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+GOOGLE_HTTP_READ_TIMEOUT_SECONDS = float(os.environ.get("GOOGLE_HTTP_READ_TIMEOUT_SECONDS", "60"))
+GOOGLE_HTTP_MAX_RETRIES = int(os.environ.get("GOOGLE_HTTP_MAX_RETRIES", "3"))
+
+# Préchauffage au démarrage du worker (sonde Chrome, logo, client/jeton Google, jetons LWA/App Store)
+WARMUP_ON_BOOT = os.environ.get("WARMUP_ON_BOOT", "1").lower() in {"1", "true", "yes"}
 
 # Configuration par produit (routing via SKU)
+# Backend de clés par entrée via "store" : "sheets" (défaut, spreadsheet_id + range_name),
+# "csv" ("path", format keys.csv) ou "sqlite" ("path" + "namespace")
 PRODUCT_CONFIG = {
     "FOOTBAR_GOLD_1_AN": {
         "spreadsheet_id": "1x9vyp_TLr7NJSt6n-2qnXF43-MY1fG67ghu0B425or0",
@@ -159,44 +261,118 @@ PRODUCT_REGEX_CONFIG = [
     })
 ]
 
+# Routeur compilé (exact puis regex combinées, lookups mémoïsés), remplacé atomiquement au rechargement
+product_router = ReloadingSkuRouter(
+    SkuRouter(PRODUCT_CONFIG, PRODUCT_REGEX_CONFIG),
+    path=PRODUCT_CONFIG_FILE or None,
+    inline_json=PRODUCT_CONFIG_JSON or None,
+    check_seconds=PRODUCT_CONFIG_RELOAD_SECONDS,
+    log=log,
+)
+
 def find_product_config_for_sku(sku):
-    # 1) Correspondance exacte
-    if sku in PRODUCT_CONFIG:
-        return PRODUCT_CONFIG[sku]
-    # 2) Correspondance par regex
-    for pattern, cfg in PRODUCT_REGEX_CONFIG:
-        if pattern.match(sku):
-            return cfg
-    return None
+    # 1) Correspondance exacte, 2) correspondance par regex
+    return product_router.lookup(sku)
+
+# 🔐 Clients Google mis en cache par process : credentials chargés une fois (GoogleCredentialsManager),
+# un transport HTTP poolé (thread-safe) par credentials et un objet service par (api, version, variante),
+# partagés par tous les threads : la construction discovery n'est payée qu'une fois par worker.
+_google_clients_lock = threading.Lock()
+_google_services_lock = threading.Lock()
+_google_credentials_manager = None
+_google_transports = {}
+_google_services = {}
+
+def reset_google_clients():
+    # Après un fork (workers gunicorn) : pas de sockets, de verrou ni de thread de rafraîchissement hérités du parent
+    global _google_clients_lock, _google_services_lock, _google_credentials_manager, _google_transports, _google_services
+    _google_clients_lock = threading.Lock()
+    _google_services_lock = threading.Lock()
+    _google_credentials_manager = None
+    _google_transports = {}
+    _google_services = {}
+
+def _google_transport(creds):
+    from google_http import PooledHttp
+
+    with _google_clients_lock:
+        entry = _google_transports.get(id(creds))
+        if entry is None or entry[0] is not creds:
+            entry = _google_transports[id(creds)] = (creds, PooledHttp(
+                creds,
+                pool_size=GOOGLE_HTTP_POOL_SIZE,
+                timeout=(GOOGLE_HTTP_CONNECT_TIMEOUT_SECONDS, GOOGLE_HTTP_READ_TIMEOUT_SECONDS),
+                max_retries=GOOGLE_HTTP_MAX_RETRIES,
+            ))
+        return entry[1]
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_google_clients)
+
+def _google_auth_request():
+    from google.auth.transport.requests import Request
+
+    return Request()
+
+def get_google_credentials_manager():
+    global _google_credentials_manager
+    with _google_clients_lock:
+        if _google_credentials_manager is None:
+            _google_credentials_manager = GoogleCredentialsManager(
+                _load_google_creds_info,
+                _google_auth_request,
+                refresh_margin_seconds=GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS,
+                check_seconds=GOOGLE_TOKEN_CHECK_SECONDS,
+                log=log,
+            )
+        return _google_credentials_manager
+
+def _cached_google_service(api, version, load_credentials, variant=None):
+    cache_key = (api, version, variant)
+    service = _google_services.get(cache_key)
+    if service is None:
+        # Credentials et transport hors du verrou des services (ils prennent _google_clients_lock)
+        http = _google_transport(load_credentials())
+        with _google_services_lock:
+            service = _google_services.get(cache_key)
+            if service is None:
+                service = _google_services[cache_key] = build_google_service(api, version, http=http)
+    return service
 
 def get_sheets_service():
-    # Détecte automatiquement le type de credentials et s'adapte:
-    # - Production/Render: privilégie un compte de service (env GOOGLE_CREDENTIALS ou credentials.json type service_account)
-    # - Local: OAuth installed app (credentials.json type installed) avec cache token.pickle
+    return _cached_google_service('sheets', 'v4', _load_sheets_credentials)
+
+def _service_account_credentials(manager, creds_info):
+    # Un seul compte de service (et donc un seul jeton) pour Sheets et Drive
+    from google.oauth2 import service_account
+    return manager.get(
+        "service_account",
+        lambda: service_account.Credentials.from_service_account_info(creds_info, scopes=SCOPES),
+    )
 
-    # Charge les credentials depuis env ou fichier
-    creds_json_str = os.environ.get('GOOGLE_CREDENTIALS')
-    creds_file_path = os.environ.get('CREDENTIALS_FILE')
-    creds_info = None
-    if creds_json_str:
+def _read_token_pickle():
+    if not os.path.exists('token.pickle'):
+        return None
+    with open('token.pickle', 'rb') as token:
         try:
-            creds_info = json.loads(creds_json_str)
+            return pickle.load(token)
         except Exception:
-            raise RuntimeError("GOOGLE_CREDENTIALS n'est pas un JSON valide.")
-    elif creds_file_path and os.path.exists(creds_file_path):
-        with open(creds_file_path, 'r') as f:
-            creds_info = json.load(f)
-    else:
-        if not os.path.exists('credentials.json'):
-            raise RuntimeError("Aucun credentials trouvé. Définissez GOOGLE_CREDENTIALS, CREDENTIALS_FILE ou ajoutez credentials.json.")
-        with open('credentials.json', 'r') as f:
-            creds_info = json.load(f)
+            return None
+
+def _save_token_pickle(creds):
+    with open('token.pickle', 'wb') as token_out:
+        pickle.dump(creds, token_out)
+
+def _load_sheets_credentials():
+    # Détecte automatiquement le type de credentials et s'adapte:
+    # - Production/Render: privilégie un compte de service (env GOOGLE_CREDENTIALS ou credentials.json type service_account)
+    # - Local: OAuth installed app (credentials.json type installed) avec cache token.pickle
+    manager = get_google_credentials_manager()
+    creds_info = manager.info()
 
     # Chemin compte de service
     if isinstance(creds_info, dict) and creds_info.get('type') == 'service_account':
-        from google.oauth2 import service_account
-        creds = service_account.Credentials.from_service_account_info(creds_info, scopes=SCOPES)
-        return build('sheets', 'v4', credentials=creds)
+        return _service_account_credentials(manager, creds_info)
 
     # Chemin OAuth client (installed/web) - pour local uniquement
     is_render = os.environ.get('RENDER', '') == 'true' or os.environ.get('RENDER_SERVICE_ID')
@@ -204,26 +380,20 @@ def get_sheets_service():
     if is_render or is_production:
         raise RuntimeError("Le credentials fourni n'est pas un compte de service. Utilisez un JSON type 'service_account' en production (Render).")
 
-    # Local dev: OAuth installed/web
-    creds = None
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            try:
-                creds = pickle.load(token)
-            except Exception:
-                creds = None
-    if not creds or not getattr(creds, 'valid', False):
-        if creds and getattr(creds, 'expired', False) and getattr(creds, 'refresh_token', None):
-            creds.refresh(Request())
-            with open('token.pickle', 'wb') as token_out:
-                pickle.dump(creds, token_out)
-        else:
-            # Supporte formats 'installed' ou 'web'
-            flow = InstalledAppFlow.from_client_config(creds_info, SCOPES)
-            creds = flow.run_local_server(port=0)
-            with open('token.pickle', 'wb') as token_out:
-                pickle.dump(creds, token_out)
-    return build('sheets', 'v4', credentials=creds)
+    def oauth_credentials():
+        # Local dev: OAuth installed/web ; un jeton expiré est rafraîchi par le gestionnaire
+        creds = _read_token_pickle()
+        if creds and (getattr(creds, 'valid', False) or getattr(creds, 'refresh_token', None)):
+            return creds
+        # Supporte formats 'installed' ou 'web'
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        flow = InstalledAppFlow.from_client_config(creds_info, SCOPES)
+        creds = flow.run_local_server(port=0)
+        _save_token_pickle(creds)
+        return creds
+
+    return manager.get("oauth", oauth_credentials, on_refresh=_save_token_pickle)
 
 def read_keys(spreadsheet_id, range_name):
     service = get_sheets_service()
@@ -241,6 +411,53 @@ def write_keys(spreadsheet_id, range_name, values):
         valueInputOption='RAW', body=body).execute()
     return result
 
+def write_key_cells(spreadsheet_id, data):
+    # data = [{"range": "'Feuille 1'!B12:E12", "values": [[...]]}, ...] : un seul appel batchUpdate
+    if not data:
+        return None
+    service = get_sheets_service()
+    body = {'valueInputOption': 'RAW', 'data': data}
+    result = service.spreadsheets().values().batchUpdate(
+        spreadsheetId=spreadsheet_id, body=body).execute()
+    return result
+
+def _col_to_index(col):
+    index = 0
+    for char in col:
+        index = index * 26 + (ord(char) - ord('A') + 1)
+    return index - 1
+
+def _index_to_col(index):
+    col = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        col = chr(ord('A') + rem) + col
+    return col
+
+def _parse_a1_range(range_name):
+    """'Feuille 1!A1:E' -> ('Feuille 1', 0, 1, 4) : onglet, 1re colonne, 1re ligne, dernière colonne (ou None)."""
+    sheet_name, _, cells = range_name.rpartition('!')
+    sheet_name = sheet_name.strip("'").replace("''", "'")
+    start, _, end = cells.partition(':')
+    match = re.match(r"^([A-Za-z]+)(\d*)$", start)
+    if not match:
+        raise ValueError(f"Range A1 non supporté: {range_name}")
+    end_match = re.match(r"^([A-Za-z]+)", end)
+    last_col = _col_to_index(end_match.group(1).upper()) if end_match else None
+    return sheet_name, _col_to_index(match.group(1).upper()), int(match.group(2) or 1), last_col
+
+def _quote_sheet_name(sheet_name):
+    return "'" + sheet_name.replace("'", "''") + "'"
+
+def _a1_block_range(sheet_name, first_col, last_col, first_row, last_row=None):
+    last_row = first_row if last_row is None else last_row
+    return f"{_quote_sheet_name(sheet_name)}!{_index_to_col(first_col)}{first_row}:{_index_to_col(last_col)}{last_row}"
+
+def _a1_column_range(sheet_name, col, first_row):
+    # Colonne ouverte vers le bas : 'Feuille 1'!B2:B
+    return f"{_quote_sheet_name(sheet_name)}!{_index_to_col(col)}{first_row}:{_index_to_col(col)}"
+
 # 📩 Texte du message pour la Messaging API Amazon
 def _amazon_license_message_text(licence_key, order_id, language_code="fr"):
     """Retourne le texte du message (clé + instructions) envoyé au buyer via Messaging API."""
@@ -378,6 +595,28 @@ def _invoice_template_id(payload, language_code):
         candidate = str(payload.get("email_id_en") or CR7M_INVOICE_EMAIL_ID_EN or CR7M_INVOICE_EMAIL_ID or "").strip()
     return candidate
 
+# Binaire Chrome/Chromium sondé une fois par process (préchauffage ou première facture)
+_chrome_path_probed = False
+_chrome_path = None
+
+def find_chrome_binary():
+    global _chrome_path_probed, _chrome_path
+    if not _chrome_path_probed:
+        env_chrome = os.environ.get("CHROME_BIN") or os.environ.get("GOOGLE_CHROME_BIN")
+        chrome_candidates = []
+        if env_chrome:
+            chrome_candidates.append(Path(env_chrome))
+        chrome_candidates.extend([
+            Path("/usr/bin/google-chrome"),
+            Path("/usr/bin/google-chrome-stable"),
+            Path("/usr/bin/chromium-browser"),
+            Path("/usr/bin/chromium"),
+            Path("/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"),
+        ])
+        _chrome_path = next((p for p in chrome_candidates if p.exists()), None)
+        _chrome_path_probed = True
+    return _chrome_path
+
 def send_invoice_email(invoice_data):
     try:
         payload = invoice_data if isinstance(invoice_data, dict) else {}
@@ -415,18 +654,7 @@ def send_invoice_email(invoice_data):
             attachment_filename = html_filename
             attachment_mime = "text/html"
             try:
-                env_chrome = os.environ.get("CHROME_BIN") or os.environ.get("GOOGLE_CHROME_BIN")
-                chrome_candidates = []
-                if env_chrome:
-                    chrome_candidates.append(Path(env_chrome))
-                chrome_candidates.extend([
-                    Path("/usr/bin/google-chrome"),
-                    Path("/usr/bin/google-chrome-stable"),
-                    Path("/usr/bin/chromium-browser"),
-                    Path("/usr/bin/chromium"),
-                    Path("/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"),
-                ])
-                chrome_path = next((p for p in chrome_candidates if p.exists()), None)
+                chrome_path = find_chrome_binary()
                 if chrome_path:
                     write_invoice_pdf(html_path, pdf_path, chrome_path=chrome_path)
                     attachment_path = pdf_path
@@ -474,6 +702,9 @@ def send_invoice_email(invoice_data):
         return False, str(e)
 
 def upload_invoice_to_drive(file_path, file_name, mime_type):
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaFileUpload
+
     drive = get_drive_service(prefer_oauth=False)
     metadata = {
         "name": file_name,
@@ -510,35 +741,26 @@ def upload_invoice_to_drive(file_path, file_name, mime_type):
         raise
 
 def _load_google_creds_info():
+    # Lu une seule fois par process via GoogleCredentialsManager.info()
     creds_json_str = os.environ.get('GOOGLE_CREDENTIALS')
     creds_file_path = os.environ.get('CREDENTIALS_FILE')
-    creds_info = None
     if creds_json_str:
-        creds_info = json.loads(creds_json_str)
-    elif creds_file_path and os.path.exists(creds_file_path):
+        try:
+            return json.loads(creds_json_str)
+        except Exception:
+            raise RuntimeError("GOOGLE_CREDENTIALS n'est pas un JSON valide.")
+    if creds_file_path and os.path.exists(creds_file_path):
         with open(creds_file_path, "r") as f:
-            creds_info = json.load(f)
-    elif os.path.exists("credentials.json"):
+            return json.load(f)
+    if os.path.exists("credentials.json"):
         with open("credentials.json", "r") as f:
-            creds_info = json.load(f)
-    else:
-        raise RuntimeError("Aucun credentials Google trouvé pour Drive")
-    return creds_info
+            return json.load(f)
+    raise RuntimeError("Aucun credentials trouvé. Définissez GOOGLE_CREDENTIALS, CREDENTIALS_FILE ou ajoutez credentials.json.")
 
 def _oauth_google_creds_from_client_config(creds_info):
-    creds = None
-    if os.path.exists("token.pickle"):
-        with open("token.pickle", "rb") as token:
-            try:
-                creds = pickle.load(token)
-            except Exception:
-                creds = None
-    if creds and getattr(creds, "valid", False):
-        return creds
-    if creds and getattr(creds, "expired", False) and getattr(creds, "refresh_token", None):
-        creds.refresh(Request())
-        with open("token.pickle", "wb") as token_out:
-            pickle.dump(creds, token_out)
+    creds = _read_token_pickle()
+    # Un jeton expiré avec refresh_token est rafraîchi par le gestionnaire de credentials
+    if creds and (getattr(creds, "valid", False) or getattr(creds, "refresh_token", None)):
         return creds
     # En serveur, on ne peut pas lancer un flow interactif
     raise RuntimeError(
@@ -547,22 +769,25 @@ def _oauth_google_creds_from_client_config(creds_info):
     )
 
 def get_drive_service(prefer_oauth=False):
-    creds_info = _load_google_creds_info()
+    return _cached_google_service("drive", "v3", lambda: _load_drive_credentials(prefer_oauth), variant=prefer_oauth)
+
+def _load_drive_credentials(prefer_oauth=False):
+    manager = get_google_credentials_manager()
+    creds_info = manager.info()
     creds_type = creds_info.get("type") if isinstance(creds_info, dict) else None
 
+    def oauth_credentials():
+        return manager.get("oauth", lambda: _oauth_google_creds_from_client_config(creds_info), on_refresh=_save_token_pickle)
+
     if prefer_oauth:
         if creds_type in {"installed", "web"}:
-            creds = _oauth_google_creds_from_client_config(creds_info)
-            return build("drive", "v3", credentials=creds)
+            return oauth_credentials()
         raise RuntimeError("Fallback OAuth demandé mais credentials OAuth (installed/web) absents.")
 
-    if isinstance(creds_info, dict) and creds_info.get("type") == "service_account":
-        from google.oauth2 import service_account
-        creds = service_account.Credentials.from_service_account_info(creds_info, scopes=SCOPES)
-        return build("drive", "v3", credentials=creds)
+    if creds_type == "service_account":
+        return _service_account_credentials(manager, creds_info)
     if creds_type in {"installed", "web"}:
-        creds = _oauth_google_creds_from_client_config(creds_info)
-        return build("drive", "v3", credentials=creds)
+        return oauth_credentials()
     raise RuntimeError("Type de credentials Google non supporté pour Drive")
 
 def parse_iso8601(value):
@@ -666,15 +891,8 @@ def build_mirakl_order_summary(order):
         shipping_address or "(non communiquée)",
     ])
 
-def process_order(customer_email, language_email, line_items, order_id=None):
-    if not customer_email:
-        return {"error": "Email manquant"}, 400
-
-    language_email = language_email or "fr"
-
-    if not line_items:
-        return {"error": "Aucun produit trouvé"}, 400
-
+def _order_key_demands(line_items):
+    """Lignes de commande -> ([(sku, config, quantité)], SKU inconnus ignorés)."""
     bundle_skus = {"B2C001_BUNDLE"}
     subscription_skus = {"FOOTBAR_GOLD_1_AN_BUNDLE"}  # Seulement FOOTBAR_GOLD_1_AN_BUNDLE doit être ignoré en présence du bundle
     order_sku_set = set()
@@ -684,9 +902,8 @@ def process_order(customer_email, language_email, line_items, order_id=None):
             order_sku_set.add(sku_clean)
     skip_subscription_items = bool(bundle_skus & order_sku_set)
 
-    results = []
-    total_keys_sent = 0
     skipped_skus = []
+    wanted = []
 
     for item in line_items:
         title = item.get("title", "")
@@ -715,39 +932,115 @@ def process_order(customer_email, language_email, line_items, order_id=None):
             skipped_skus.append(sku)
             continue
 
-        for _ in range(qty):
-            key = get_and_use_license_key_gsheet(
-                customer_email,
-                config["spreadsheet_id"],
-                config["range_name"],
-                order_id=order_id,
-            )
-            if not key:
-                return {"error": f"Aucune clé disponible pour {sku}"}, 500
-
-            email_sent = send_email_with_template(
-                customer_email,
-                key,
-                language_email,
-                email_id_fr=config.get("email_id_fr"),
-                email_id_en=config.get("email_id_en"),
-                order_id=order_id,
-            )
-            if not email_sent:
-                return {"error": f"Échec d'envoi d'email pour {sku}"}, 500
+        wanted.append((sku, config, qty))
+
+    return wanted, skipped_skus
+
+# 📒 Journal par commande : une nouvelle tentative reprend là où la précédente s'est arrêtée
+_order_journal_lock = threading.Lock()
+_order_journal = None
+
+def get_order_journal():
+    global _order_journal
+    with _order_journal_lock:
+        if _order_journal is None:
+            _order_journal = OrderJournal(ORDER_JOURNAL_DB)
+            purged = _order_journal.purge_completed(ORDER_JOURNAL_RETENTION_SECONDS)
+            if purged:
+                log(f"🧹 Journal commandes: {purged} commande(s) terminée(s) oubliée(s)")
+        return _order_journal
+
+def _order_journal_key(order_id, customer_email, line_items):
+    if order_id:
+        return f"order:{order_id}"
+    # Sans id de commande : même email et mêmes lignes = même commande (renvoi du même webhook)
+    lines = sorted([(item.get("sku") or "").strip().upper(), str(item.get("quantity", 0))] for item in line_items)
+    digest = hashlib.sha256(json.dumps([(customer_email or "").strip().lower(), lines]).encode("utf-8")).hexdigest()
+    return f"lines:{digest}"
+
+def _email_order_keys(customer_email, language_email, order_id, units, on_sent=None):
+    """
+    Envoie un email CR7M par unité (sku, config, clé), sur au plus ORDER_DELIVERY_WORKERS threads.
+    Retourne le SKU du premier envoi en échec (dans l'ordre des lignes) ou None. Au premier échec, les
+    envois pas encore partis sont annulés, mais ceux déjà en cours (jusqu'à ORDER_DELIVERY_WORKERS - 1)
+    vont à leur terme : le client peut donc recevoir ces emails alors que la commande répond 500.
+    On attend la fin de chacun avant de retourner et chaque envoi réussi est signalé à on_sent (journal)
+    depuis le thread appelant, pour qu'une nouvelle tentative ne le refasse pas.
+    """
+    def send(unit):
+        _, config, key = unit
+        return send_email_with_template(
+            customer_email,
+            key,
+            language_email,
+            email_id_fr=config.get("email_id_fr"),
+            email_id_en=config.get("email_id_en"),
+            order_id=order_id,
+        )
 
-            results.append({
-                "sku": sku,
-                "key": key,
-                "quantity_sent": 1
-            })
-            total_keys_sent += 1
+    workers = min(ORDER_DELIVERY_WORKERS, len(units))
+    if workers <= 1:
+        for sku, config, key in units:
+            if not send((sku, config, key)):
+                return sku
+            if on_sent:
+                on_sent(key)
+        return None
+
+    failed = []
+    error = None
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="order-delivery") as pool:
+        futures = {pool.submit(send, unit): index for index, unit in enumerate(units)}
+        # Parcourt tous les envois, y compris ceux encore en cours après un échec : leur succès doit être journalisé
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            index = futures[future]
+            try:
+                sent = future.result()
+            except Exception as e:
+                error = error or e
+                sent = False
+            if sent:
+                if on_sent:
+                    try:
+                        on_sent(units[index][2])
+                    except Exception as e:
+                        error = error or e
+                continue
+            failed.append(index)
+            for pending in futures:
+                pending.cancel()
+    if error:
+        raise error
+    return units[min(failed)][0] if failed else None
+
+def _send_order_keys(customer_email, language_email, order_id, claimed, skipped_skus, journal_key=None):
+    # claimed = [(sku, config, [clés])] -> un email par clé (sauf ceux déjà envoyés selon le journal), puis la réponse
+    journal = get_order_journal() if journal_key else None
+    entry = journal.load(journal_key) if journal else None
+    already_sent = {k["key"] for k in entry["keys"] if k["emailed"]} if entry else set()
+
+    units = [(sku, config, key) for sku, config, keys in claimed for key in keys]
+    for sku, _, key in units:
+        if key in already_sent:
+            log(f"ℹ️ Email déjà envoyé pour {sku} (tentative précédente)")
+    failed_sku = _email_order_keys(
+        customer_email, language_email, order_id,
+        [unit for unit in units if unit[2] not in already_sent],
+        on_sent=(lambda key: journal.mark_emailed(journal_key, key)) if journal else None,
+    )
+    if failed_sku:
+        return {"error": f"Échec d'envoi d'email pour {failed_sku}"}, 500
+
+    results = [{"sku": sku, "key": key, "quantity_sent": 1} for sku, _, key in units]
+    total_keys_sent = len(results)
 
     if total_keys_sent == 0:
         return {
             "error": "Aucun produit configuré trouvé dans la commande",
             "skipped_skus": skipped_skus,
-            "known_skus": list(PRODUCT_CONFIG.keys())
+            "known_skus": list(product_router.current().exact.keys())
         }, 400
 
     response = {
@@ -760,64 +1053,159 @@ def process_order(customer_email, language_email, line_items, order_id=None):
         response["skipped_skus"] = skipped_skus
         response["message"] += f" ({len(skipped_skus)} SKU(s) ignoré(s))"
 
+    if journal:
+        journal.complete(journal_key, response)
     return response, 200
 
-
-def process_order_via_amazon_messaging(access_token, order_id, marketplace_id, language_email, line_items):
+# 🧩 Pipeline de commande commun aux canaux : normalisation -> routage des SKU -> réservation -> livraison
+def _pipeline_order(channel, order_id, email, language_email, line_items, **delivery):
     """
-    Traite une commande Amazon sans email buyer : réserve les clés (placeholder dans la sheet)
-    et envoie la clé au client via la Messaging API (Amazon lui transmet par email/message).
-    Nécessite le rôle Buyer Communication sur l'app SP-API.
+    Commande normalisée, quel que soit le canal : channel = 'cr7m' (email via CR7M) ou 'amazon_messaging'
+    (Messaging API, delivery = access_token et marketplace_id). Les étapes y ajoutent routage, clés et résultat.
     """
-    language_email = language_email or "fr"
-    if not line_items:
-        return {"error": "Aucun produit trouvé"}, 400
+    line_items = line_items or []
+    if channel == "amazon_messaging":
+        journal_key = f"amazon:{order_id}"
+    else:
+        journal_key = _order_journal_key(order_id, email, line_items)
+    return {
+        "channel": channel,
+        "order_id": order_id,
+        "email": email,
+        "language": language_email or "fr",
+        "line_items": line_items,
+        "delivery": delivery,
+        "journal_key": journal_key,
+        "result": None,
+    }
 
-    bundle_skus = {"B2C001_BUNDLE"}
-    subscription_skus = {"FOOTBAR_GOLD_1_AN_BUNDLE"}
-    order_sku_set = set()
-    for item in line_items:
-        sku_clean = (item.get("sku") or "").strip().upper()
-        if sku_clean:
-            order_sku_set.add(sku_clean)
-    skip_subscription_items = bool(bundle_skus & order_sku_set)
+def _mirakl_pipeline_order(order):
+    customer = order.get("customer", {})
+    line_items = [{
+        "title": line.get("product_title"),
+        "sku": line.get("offer_sku") or line.get("product_shop_sku"),
+        "quantity": line.get("quantity", 0),
+    } for line in order.get("order_lines", [])]
+    return _pipeline_order(
+        "cr7m",
+        order.get("order_id"),
+        order.get("customer_notification_email"),
+        customer.get("locale") or order.get("channel", {}).get("code") or "fr",
+        line_items,
+    )
 
-    placeholder_email = f"amazon-{order_id}@messaging.footbar"
-    keys_and_skus = []
+def _amazon_order_language(order):
+    # Détection de la langue basée sur le marketplace
+    marketplace_id = order.get("MarketplaceId", "")
+    sales_channel = order.get("SalesChannel", "")
+    if "DE" in sales_channel or marketplace_id == "A1PA6795UKMFR9":
+        return "de"
+    if "IT" in sales_channel or marketplace_id == "APJ6JRA9NG5V4":
+        return "it"
+    if "ES" in sales_channel or marketplace_id == "A1RKKUPIHCS9HS":
+        return "es"
+    if "NL" in sales_channel or marketplace_id == "A1805IZSGTT6HS":
+        return "nl"
+    return "fr"  # par défaut (Belgique = français)
+
+def _amazon_pipeline_order(order, access_token):
+    # Commandes Amazon sans email buyer : clés marquées avec un placeholder, envoyées via la Messaging API
+    order_id = order.get("AmazonOrderId")
+    line_items = [{
+        "title": item.get("Title", ""),
+        "sku": item.get("SellerSKU") or "",
+        "quantity": item.get("QuantityOrdered", 0),
+    } for item in order.get("_orderItems") or []]
+    return _pipeline_order(
+        "amazon_messaging",
+        order_id,
+        f"amazon-{order_id}@messaging.footbar",
+        _amazon_order_language(order),
+        line_items,
+        access_token=access_token,
+        marketplace_id=order.get("MarketplaceId", ""),
+    )
 
-    for item in line_items:
-        raw_sku = (item.get("sku") or "").strip().upper()
-        qty_raw = item.get("quantity", 0)
-        try:
-            qty = int(qty_raw)
-        except Exception:
-            qty = 0
-        if skip_subscription_items and raw_sku in subscription_skus:
-            continue
-        if not raw_sku or qty <= 0:
+def _route_orders(orders):
+    for order in orders:
+        if order["result"] is not None:
             continue
-        config = find_product_config_for_sku(raw_sku)
-        if not config:
+        if not order["email"]:
+            order["result"] = {"error": "Email manquant"}, 400
+        elif not order["line_items"]:
+            order["result"] = {"error": "Aucun produit trouvé"}, 400
+        elif order["channel"] == "amazon_messaging" and not order["delivery"].get("marketplace_id"):
+            order["result"] = {"error": "MarketplaceId manquant pour Messaging API"}, 400
+        else:
+            order["wanted"], order["skipped_skus"] = _order_key_demands(order["line_items"])
+
+def _reserve_orders(orders):
+    """
+    Réserve les clés de tout le lot : celles déjà journalisées par une tentative précédente sont
+    réutilisées, les manquantes réservées d'un coup pour toutes les commandes (claim_license_keys_for_orders)
+    et journalisées avant toute livraison.
+    """
+    journal = get_order_journal()
+    batch = []
+    for order in orders:
+        if order["result"] is not None:
             continue
-        for _ in range(qty):
-            key = get_and_use_license_key_gsheet(
-                placeholder_email,
-                config["spreadsheet_id"],
-                config["range_name"],
-                order_id=order_id,
-            )
-            if not key:
-                return {"error": f"Aucune clé disponible pour {raw_sku}"}, 500
-            keys_and_skus.append((key, raw_sku))
+        journal_key = order["journal_key"]
+        entry = journal.load(journal_key)
+        if entry and entry["status"] == "completed":
+            if order["order_id"]:
+                log(f"ℹ️ Commande {order['order_id']} déjà traitée: réponse d'origine")
+                order["result"] = entry["response"], 200
+                continue
+            # Mêmes lignes qu'une commande déjà livrée mais sans id : c'est une nouvelle commande
+            journal.reset(journal_key)
+            entry = None
+
+        # Clés réservées par une tentative précédente : réutilisées avant d'en réserver de nouvelles
+        reusable = {}
+        for journaled in entry["keys"] if entry else []:
+            reusable.setdefault(journaled["sku"], []).append(journaled["key"])
+        order["keys"] = []
+        for sku, _, qty in order["wanted"]:
+            pool = reusable.get(sku, [])
+            order["keys"].append(pool[:qty])
+            reusable[sku] = pool[qty:]
+        if entry:
+            log(f"🔁 Reprise de la commande {order['order_id'] or journal_key}: "
+                f"{sum(map(len, order['keys']))} clé(s) déjà réservée(s)")
+        if order["wanted"]:
+            journal.open(journal_key, order["email"], order["language"])
+
+        missing = [i for i, (_, _, qty) in enumerate(order["wanted"]) if qty > len(order["keys"][i])]
+        if missing:
+            batch.append((order, missing))
+
+    claimed = claim_license_keys_for_orders([(
+        [(order["wanted"][i][1], order["wanted"][i][2] - len(order["keys"][i])) for i in missing],
+        order["email"],
+        order["order_id"],
+    ) for order, missing in batch])
+    for (order, missing), order_claims in zip(batch, claimed):
+        for i, keys in zip(missing, order_claims):
+            if keys:
+                journal.record_claims(order["journal_key"], order["wanted"][i][0], keys)
+                order["keys"][i] = order["keys"][i] + keys
+        for i, keys in zip(missing, order_claims):
+            if keys is None:
+                order["result"] = {"error": f"Aucune clé disponible pour {order['wanted'][i][0]}"}, 500
+                break
 
-    if not keys_and_skus:
+def _send_amazon_order_keys(order, claimed):
+    keys = [key for _, _, sku_keys in claimed for key in sku_keys]
+    if not keys:
         return {"error": "Aucun produit configuré trouvé dans la commande"}, 400
 
-    if len(keys_and_skus) == 1:
-        message_text = _amazon_license_message_text(keys_and_skus[0][0], order_id, language_email)
+    order_id = order["order_id"]
+    if len(keys) == 1:
+        message_text = _amazon_license_message_text(keys[0], order_id, order["language"])
     else:
-        keys_list = "\n".join(f"• Code : {k}" for k, _ in keys_and_skus)
-        if language_email and language_email.lower().startswith("fr"):
+        keys_list = "\n".join(f"• Code : {k}" for k in keys)
+        if order["language"].lower().startswith("fr"):
             message_text = f"""Bonjour,
 
 Concernant votre commande Amazon {order_id}, voici les codes pour accéder au service inclus avec votre produit Footbar :
@@ -834,14 +1222,59 @@ Regarding your Amazon order {order_id}, here are the codes for the service inclu
 
 Best regards, Footbar"""
 
-    ok = send_amazon_buyer_message(access_token, order_id, marketplace_id, message_text)
+    delivery = order["delivery"]
+    ok = send_amazon_buyer_message(delivery["access_token"], order_id, delivery["marketplace_id"], message_text)
     if not ok:
         return {"error": "Échec d'envoi du message au buyer (vérifier le rôle Buyer Communication)"}, 500
-    return {
-        "message": f"{len(keys_and_skus)} clé(s) envoyée(s) via Messaging API",
-        "total_keys": len(keys_and_skus),
+    response = {
+        "message": f"{len(keys)} clé(s) envoyée(s) via Messaging API",
+        "total_keys": len(keys),
         "channel": "amazon_messaging",
-    }, 200
+    }
+    journal = get_order_journal()
+    for key in keys:
+        journal.mark_emailed(order["journal_key"], key)
+    journal.complete(order["journal_key"], response)
+    return response, 200
+
+def _deliver_orders(orders):
+    # Livraison et enregistrement (journal) de chaque commande réservée
+    for order in orders:
+        if order["result"] is not None:
+            continue
+        claimed = [(sku, config, keys) for (sku, config, _), keys in zip(order["wanted"], order["keys"])]
+        if order["channel"] == "amazon_messaging":
+            order["result"] = _send_amazon_order_keys(order, claimed)
+        else:
+            order["result"] = _send_order_keys(
+                order["email"], order["language"], order["order_id"], claimed, order["skipped_skus"],
+                journal_key=order["journal_key"],
+            )
+
+def run_order_pipeline(orders):
+    """
+    Traite un lot de commandes normalisées (_pipeline_order) étape par étape, chaque étape sur tout le lot :
+    routage des SKU, réservation des clés (un aller-retour Sheets par spreadsheet pour le lot), livraison
+    (CR7M ou Amazon Messaging) et journal. Retourne [(réponse, status)] aligné sur orders.
+    """
+    _route_orders(orders)
+    _reserve_orders(orders)
+    _deliver_orders(orders)
+    return [order["result"] for order in orders]
+
+def process_order(customer_email, language_email, line_items, order_id=None):
+    return run_order_pipeline([_pipeline_order("cr7m", order_id, customer_email, language_email, line_items)])[0]
+
+def process_order_via_amazon_messaging(access_token, order_id, marketplace_id, language_email, line_items):
+    """
+    Traite une commande Amazon sans email buyer : réserve les clés (placeholder dans la sheet)
+    et envoie la clé au client via la Messaging API (Amazon lui transmet par email/message).
+    Nécessite le rôle Buyer Communication sur l'app SP-API.
+    """
+    return run_order_pipeline([_pipeline_order(
+        "amazon_messaging", order_id, f"amazon-{order_id}@messaging.footbar", language_email, line_items,
+        access_token=access_token, marketplace_id=marketplace_id,
+    )])[0]
 
 
 def poll_mirakl_and_notify():
@@ -875,21 +1308,11 @@ def poll_mirakl_and_notify():
         log("ℹ️ Mirakl: aucune nouvelle commande")
         return {"message": "Aucune nouvelle commande Mirakl"}, 200
 
+    # Toutes les nouvelles commandes du cycle passent ensemble dans le pipeline (clés réservées en un lot)
+    pipeline_orders = [_mirakl_pipeline_order(order) for order in new_orders]
     notifications = []
-    for order in new_orders:
-        order_id = order.get("order_id")
-        customer_email = order.get("customer_notification_email")
-        customer = order.get("customer", {})
-        locale = customer.get("locale") or order.get("channel", {}).get("code") or "fr"
-        line_items = []
-        for line in order.get("order_lines", []):
-            line_items.append({
-                "title": line.get("product_title"),
-                "sku": line.get("offer_sku") or line.get("product_shop_sku"),
-                "quantity": line.get("quantity", 0),
-            })
-
-        payload, status = process_order(customer_email, locale, line_items, order_id=order_id)
+    for pipeline_order, (payload, status) in zip(pipeline_orders, run_order_pipeline(pipeline_orders)):
+        order_id = pipeline_order["order_id"]
         success = status == 200
         notifications.append({
             "order_id": order_id,
@@ -917,11 +1340,24 @@ def poll_mirakl_and_notify():
 
 # ========== Amazon SP-API ==========
 
+# Access token LWA réutilisé jusqu'à une minute de son expiration (1 h)
+_amazon_token_lock = threading.Lock()
+_amazon_token = None
+_amazon_token_expires_at = 0.0
+
 def get_amazon_access_token():
-    """Obtient un access token LWA à partir du refresh token"""
+    """Obtient un access token LWA à partir du refresh token (mis en cache jusqu'à expiration)"""
+    global _amazon_token, _amazon_token_expires_at
     if not AMAZON_LWA_CLIENT_ID or not AMAZON_LWA_CLIENT_SECRET or not AMAZON_LWA_REFRESH_TOKEN:
         raise RuntimeError("Credentials Amazon LWA manquants")
-    
+    with _amazon_token_lock:
+        if _amazon_token and time.time() < _amazon_token_expires_at - 60:
+            return _amazon_token
+        access_token, expires_in = _fetch_amazon_access_token()
+        _amazon_token, _amazon_token_expires_at = access_token, time.time() + float(expires_in)
+        return access_token
+
+def _fetch_amazon_access_token():
     url = "https://api.amazon.com/auth/o2/token"
     data = {
         "grant_type": "refresh_token",
@@ -937,7 +1373,7 @@ def get_amazon_access_token():
     access_token = result.get("access_token")
     if not access_token:
         raise RuntimeError("Access token non reçu dans la réponse LWA")
-    return access_token
+    return access_token, result.get("expires_in") or 3600
 
 def load_amazon_state():
     """Charge l'état Amazon depuis le fichier"""
@@ -1242,54 +1678,23 @@ def poll_amazon_and_notify():
         return {"message": "Aucune nouvelle commande Amazon"}, 200
 
     notifications = []
+    pipeline_orders = []
     for order in new_orders:
-        order_id = order.get("AmazonOrderId")
-
-        # Détection de la langue basée sur le marketplace
-        marketplace_id = order.get("MarketplaceId", "")
-        sales_channel = order.get("SalesChannel", "")
-        language_email = "fr"  # par défaut
-        if "DE" in sales_channel or marketplace_id == "A1PA6795UKMFR9":
-            language_email = "de"
-        elif "IT" in sales_channel or marketplace_id == "APJ6JRA9NG5V4":
-            language_email = "it"
-        elif "ES" in sales_channel or marketplace_id == "A1RKKUPIHCS9HS":
-            language_email = "es"
-        elif "NL" in sales_channel or marketplace_id == "A1805IZSGTT6HS":
-            language_email = "nl"
-        elif "BE" in sales_channel or marketplace_id == "AMEN7PMS3EDWL":
-            language_email = "fr"  # Belgique = français par défaut
-
-        # Items déjà dans la commande normalisée (v2026)
-        order_items = order.get("_orderItems") or []
-        line_items = []
-        for item in order_items:
-            sku = item.get("SellerSKU") or ""
-            qty = item.get("QuantityOrdered", 0)
-            title = item.get("Title", "")
-            line_items.append({
-                "title": title,
-                "sku": sku,
-                "quantity": qty,
-            })
-
-        if not line_items:
-            log(f"⚠️ Amazon commande {order_id}: aucun item trouvé")
+        pipeline_order = _amazon_pipeline_order(order, access_token)
+        if not pipeline_order["line_items"]:
+            log(f"⚠️ Amazon commande {pipeline_order['order_id']}: aucun item trouvé")
             notifications.append({
-                "order_id": order_id,
+                "order_id": pipeline_order["order_id"],
                 "status": 400,
                 "result": {"error": "Aucun item trouvé dans la commande"},
             })
             continue
+        pipeline_orders.append(pipeline_order)
 
-        # Commandes Amazon : toujours utiliser la Messaging API (Amazon transmet au buyer).
-        # Nécessite le rôle Buyer Communication sur l'app SP-API.
-        if not marketplace_id:
-            payload, status = {"error": "MarketplaceId manquant pour Messaging API"}, 400
-        else:
-            payload, status = process_order_via_amazon_messaging(
-                access_token, order_id, marketplace_id, language_email, line_items
-            )
+    # Commandes Amazon : toujours via la Messaging API (Amazon transmet au buyer), clés réservées en un lot.
+    # Nécessite le rôle Buyer Communication sur l'app SP-API.
+    for pipeline_order, (payload, status) in zip(pipeline_orders, run_order_pipeline(pipeline_orders)):
+        order_id = pipeline_order["order_id"]
         notifications.append({"order_id": order_id, "status": status, "result": payload})
         if status == 200 and order_id and order_id not in processed_ids:
             processed_ids.add(order_id)
@@ -1308,49 +1713,1254 @@ def poll_amazon_and_notify():
         "notifications": notifications,
     }, 200
 
-# 🔑 Fonction de récupération de clé
-def get_and_use_license_key_gsheet(to_email, spreadsheet_id, range_name, order_id=None):
-    values = read_keys(spreadsheet_id, range_name)
-
-    # Première ligne = header, données à partir de l’indice 1
-    header = values[0]
-    data = values[1:]
-
-    key_index = header.index('key')
-    used_index = header.index('used')
-    mail_index = header.index('mail')
-    date_index = header.index('date')
-    order_id_index = header.index('order_id') if 'order_id' in header else None
-
-    selected_key = None
-
-    for row in data:
-        # Par sécurité, on étend la ligne au besoin
-        while len(row) < len(header):
-            row.append('')
-
-        if row[used_index].lower() == 'false' and not selected_key:
-            selected_key = row[key_index]
-            row[used_index] = 'true'
-            row[mail_index] = to_email
-            row[date_index] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+# 📍 Curseur de première ligne libre, par (spreadsheet_id, range_name)
+_key_cursor_lock = threading.Lock()
+_key_cursor_state = {}
+
+def load_key_cursor_state():
+    if not KEY_CURSOR_STATE_FILE:
+        return {}
+    if os.path.exists(KEY_CURSOR_STATE_FILE):
+        try:
+            with open(KEY_CURSOR_STATE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            log(f"⚠️ Impossible de lire {KEY_CURSOR_STATE_FILE}: {e}")
+    return {}
+
+def save_key_cursor_state(state):
+    if not KEY_CURSOR_STATE_FILE:
+        return
+    try:
+        tmp_path = f"{KEY_CURSOR_STATE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, KEY_CURSOR_STATE_FILE)
+    except Exception as e:
+        log(f"⚠️ Impossible d'écrire {KEY_CURSOR_STATE_FILE}: {e}")
+
+def _key_cursor_id(spreadsheet_id, range_name):
+    return f"{spreadsheet_id}|{range_name}"
+
+def get_key_cursor(spreadsheet_id, range_name):
+    # Relu depuis le fichier : les autres workers avancent aussi le curseur (appelé sous key_range_lock)
+    with _key_cursor_lock:
+        _key_cursor_state.update(load_key_cursor_state())
+        return _key_cursor_state.get(_key_cursor_id(spreadsheet_id, range_name))
+
+def set_key_cursor(spreadsheet_id, range_name, row_number):
+    with _key_cursor_lock:
+        _key_cursor_state.update(load_key_cursor_state())
+        cursor_id = _key_cursor_id(spreadsheet_id, range_name)
+        if _key_cursor_state.get(cursor_id) == row_number:
+            return
+        _key_cursor_state[cursor_id] = row_number
+        save_key_cursor_state(_key_cursor_state)
+
+# 🔒 Verrou inter-process par range (workers gunicorn, polls Mirakl/Amazon en parallèle)
+@contextlib.contextmanager
+def key_range_lock(spreadsheet_id, range_name):
+    lock_name = hashlib.sha1(_key_cursor_id(spreadsheet_id, range_name).encode("utf-8")).hexdigest()[:16]
+    lock_path = os.path.join(KEY_LOCK_DIR, f"footbar-keys-{lock_name}.lock")
+    deadline = time.monotonic() + KEY_LOCK_TIMEOUT_SECONDS
+    with open(lock_path, "a+") as lock_file:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"Verrou des clés {range_name} indisponible après {KEY_LOCK_TIMEOUT_SECONDS}s")
+                time.sleep(0.02)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _pad_row(row, width):
+    # Par sécurité, on étend la ligne au besoin
+    while len(row) < width:
+        row.append('')
+    return row
+
+def _find_free_key_rows(spreadsheet_id, demands):
+    """
+    demands = {range_name: nombre de clés} -> {range_name: (header, [(numéro de ligne sheet, row), ...])}.
+    Chaque range part de son curseur (fenêtre de KEY_CURSOR_WINDOW_ROWS lignes) ; tous les ranges d'un
+    tour sont lus dans un seul batchGet. Sans curseur, ou si la fenêtre ne suffit pas (curseur périmé,
+    stock presque épuisé), le range complet est relu au tour suivant.
+    """
+    pending = {}
+    for range_name in demands:
+        _, _, header_row, last_col = _parse_a1_range(range_name)
+        cursor = get_key_cursor(spreadsheet_id, range_name)
+        pending[range_name] = max(int(cursor), header_row + 1) if cursor and last_col is not None else None
+
+    found = {range_name: ([], []) for range_name in demands}
+    service = get_sheets_service()
+    while pending:
+        reads = []
+        ranges = []
+        for range_name, start_row in pending.items():
+            sheet_name, first_col, header_row, last_col = _parse_a1_range(range_name)
+            if start_row is None:
+                reads.append((range_name, None, None))
+                ranges.append(range_name)
+            else:
+                window = max(KEY_CURSOR_WINDOW_ROWS, demands[range_name] * 2)
+                reads.append((range_name, start_row, window))
+                ranges.append(_a1_block_range(sheet_name, first_col, last_col, header_row))
+                ranges.append(_a1_block_range(sheet_name, first_col, last_col, start_row, start_row + window - 1))
+        result = service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id, ranges=ranges).execute()
+        value_ranges = iter(result.get('valueRanges', []))
+
+        pending = {}
+        for range_name, start_row, window in reads:
+            count = demands[range_name]
+            if start_row is None:
+                values = next(value_ranges, {}).get('values', [])
+                header, rows = (values[0] if values else []), values[1:]
+                first_row = _parse_a1_range(range_name)[2] + 1
+                free_rows = []
+            else:
+                header_values = next(value_ranges, {}).get('values', [])
+                rows = next(value_ranges, {}).get('values', [])
+                header, first_row = (header_values[0] if header_values else []), start_row
+                free_rows = found[range_name][1]
+            found[range_name] = (header, free_rows)
+            if not header or 'used' not in header:
+                if start_row is not None:
+                    pending[range_name] = None
+                continue
+            used_index = header.index('used')
+            for offset, row in enumerate(rows):
+                _pad_row(row, len(header))
+                if row[used_index].lower() == 'false':
+                    free_rows.append((first_row + offset, row))
+                    if len(free_rows) == count:
+                        break
+            if len(free_rows) == count or start_row is None:
+                continue
+            if len(rows) == window:
+                pending[range_name] = start_row + window
+            else:
+                log(f"ℹ️ Curseur {range_name} insuffisant, relecture complète du range")
+                pending[range_name] = None
+    return found
+
+def _key_claim_update(header, range_name, row_number, row):
+    # Seules les cellules modifiées par une réservation (used/mail/date/order_id) sont renvoyées
+    sheet_name, first_col, _, _ = _parse_a1_range(range_name)
+    changed_indexes = [header.index(name) for name in ('used', 'mail', 'date', 'order_id') if name in header]
+    lo, hi = min(changed_indexes), max(changed_indexes)
+    return {
+        "range": _a1_block_range(sheet_name, first_col + lo, first_col + hi, row_number),
+        "values": [_pad_row(list(row), len(header))[lo:hi + 1]],
+    }
+
+def push_key_claims_gsheet(spreadsheet_id, range_name, header, claims):
+    # claims = [(numéro de ligne, {"used": ..., "mail": ..., ...})] -> un seul batchUpdate
+    updates = [
+        _key_claim_update(header, range_name, row_number, [values.get(name, '') for name in header])
+        for row_number, values in claims
+    ]
+    return write_key_cells(spreadsheet_id, updates)
+
+def _all_product_configs():
+    return product_router.current().configs()
+
+def _all_key_ranges():
+    # Ranges Google Sheets uniquement (entrées sans "store" ou avec "store": "sheets")
+    seen = []
+    for cfg in _all_product_configs():
+        if (cfg.get("store") or "sheets") != "sheets":
+            continue
+        pair = (cfg["spreadsheet_id"], cfg["range_name"])
+        if pair not in seen:
+            seen.append(pair)
+    return seen
+
+# 🗃️ Backends de clés (KeyStore) par entrée de config
+_key_stores_lock = threading.Lock()
+_key_stores = {}
+
+def get_key_store(config):
+    kind = (config.get("store") or "sheets").lower()
+    if kind == "sheets":
+        cache_key = (kind, config["spreadsheet_id"], config["range_name"])
+    elif kind == "csv":
+        cache_key = (kind, config["path"])
+    elif kind == "sqlite":
+        cache_key = (kind, config["path"], config.get("namespace") or config.get("range_name") or "default")
+    else:
+        raise KeyStoreError(f"Backend de clés inconnu: {kind}")
+    with _key_stores_lock:
+        store = _key_stores.get(cache_key)
+        if store is None:
+            if kind == "sheets":
+                store = SheetsKeyStore(
+                    config["spreadsheet_id"], config["range_name"],
+                    claim_fn=get_and_use_license_keys_gsheet,
+                    counts_fn=_fetch_sheets_key_counts,
+                    add_keys_fn=append_license_keys_gsheet,
+                    release_fn=release_license_keys_gsheet,
+                    all_keys_fn=_all_keys_gsheet,
+                )
+            elif kind == "csv":
+                store = CsvKeyStore(config["path"])
+            else:
+                store = SqliteKeyStore(config["path"], cache_key[2])
+            _key_stores[cache_key] = store
+        return store
+
+def _all_key_stores():
+    stores = {}
+    for cfg in _all_product_configs():
+        store = get_key_store(cfg)
+        stores.setdefault(store.store_id, store)
+    return stores
+
+def claim_license_keys(config, to_email, count, order_id=None):
+    store = get_key_store(config)
+    keys = store.claim(count, to_email, order_id=order_id)
+    # Le chemin Sheets tient lui-même les compteurs (prefetch, inventaire SQLite)
+    if keys and store.kind != "sheets":
+        get_key_levels().record(*store.store_id, len(keys))
+    return keys
+
+def release_license_keys(config, keys):
+    # Inverse de claim_license_keys pour des clés jamais envoyées
+    store = get_key_store(config)
+    released = store.release(keys)
+    if released and store.kind != "sheets":
+        get_key_levels().record(*store.store_id, released, from_state="used", to_state="free")
+    return released
+
+# 🗄️ Inventaire SQLite local (optionnel, KEY_INVENTORY_DB) avec synchro différée vers la sheet
+_key_inventory_lock = threading.Lock()
+_key_inventory = None
+
+def get_key_inventory():
+    global _key_inventory
+    with _key_inventory_lock:
+        if _key_inventory is not None:
+            return _key_inventory
+        inventory = KeyInventory(
+            KEY_INVENTORY_DB,
+            read_keys,
+            push_key_claims_gsheet,
+            header_row_for_range=lambda range_name: _parse_a1_range(range_name)[2],
+        )
+        ranges = _all_key_ranges()
+        for spreadsheet_id, range_name in ranges:
+            if not inventory.has_range(spreadsheet_id, range_name):
+                imported = inventory.import_range(spreadsheet_id, range_name)
+                log(f"🗄️ Inventaire clés: {imported} clé(s) importée(s) depuis {range_name}")
+        inventory.start_syncer(
+            KEY_INVENTORY_SYNC_SECONDS,
+            refresh_ranges=ranges,
+            refresh_every_seconds=KEY_INVENTORY_REFRESH_SECONDS,
+        )
+        _key_inventory = inventory
+        return _key_inventory
+
+# 📊 Niveaux de stock par range : compteurs en mémoire, recalés par un batchGet de la seule colonne 'used'
+_key_headers = {}
+_key_levels_lock = threading.Lock()
+_key_levels = None
+
+def load_key_headers(spreadsheet_id, range_names):
+    # En-têtes des ranges mis en cache (un batchGet pour ceux qui manquent)
+    missing_headers = [rn for rn in range_names if (spreadsheet_id, rn) not in _key_headers]
+    if missing_headers:
+        header_ranges = []
+        for range_name in missing_headers:
+            sheet_name, first_col, header_row, last_col = _parse_a1_range(range_name)
+            header_ranges.append(_a1_block_range(sheet_name, first_col, last_col, header_row))
+        service = get_sheets_service()
+        result = service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id, ranges=header_ranges).execute()
+        for range_name, value_range in zip(missing_headers, result.get('valueRanges', [])):
+            values = value_range.get('values', [])
+            _key_headers[(spreadsheet_id, range_name)] = values[0] if values else []
+    return {rn: _key_headers.get((spreadsheet_id, rn)) or [] for rn in range_names}
+
+def fetch_key_counts_gsheet(ranges):
+    counts = {}
+    by_spreadsheet = {}
+    for spreadsheet_id, range_name in ranges:
+        by_spreadsheet.setdefault(spreadsheet_id, []).append(range_name)
+    service = get_sheets_service()
+    for spreadsheet_id, range_names in by_spreadsheet.items():
+        load_key_headers(spreadsheet_id, range_names)
+        used_ranges = []
+        counted = []
+        for range_name in range_names:
+            header = _key_headers.get((spreadsheet_id, range_name)) or []
+            if 'used' not in header:
+                continue
+            sheet_name, first_col, header_row, _ = _parse_a1_range(range_name)
+            used_col = first_col + header.index('used')
+            used_ranges.append(_a1_column_range(sheet_name, used_col, header_row + 1))
+            counted.append(range_name)
+        if not used_ranges:
+            continue
+        result = service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id, ranges=used_ranges).execute()
+        for range_name, value_range in zip(counted, result.get('valueRanges', [])):
+            range_counts = {"free": 0, "reserved": 0, "used": 0}
+            for cells in value_range.get('values', []):
+                value = (cells[0] if cells else '').strip().lower()
+                if value == 'false':
+                    range_counts["free"] += 1
+                elif value == 'reserved':
+                    range_counts["reserved"] += 1
+                elif value:
+                    range_counts["used"] += 1
+            counts[(spreadsheet_id, range_name)] = range_counts
+    return counts
+
+def get_key_levels():
+    global _key_levels
+    with _key_levels_lock:
+        if _key_levels is None:
+            _key_levels = KeyLevels(
+                fetch_key_counts,
+                lambda: list(_all_key_stores()),
+                refresh_seconds=KEY_LEVELS_REFRESH_SECONDS,
+                alert_threshold=KEY_LEVELS_ALERT_THRESHOLD,
+                log=log,
+            )
+            _key_levels.start()
+        return _key_levels
+
+def _fetch_sheets_key_counts(ranges):
+    if KEY_INVENTORY_DB:
+        return get_key_inventory().counts(ranges)
+    return fetch_key_counts_gsheet(ranges)
+
+def fetch_key_counts(store_ids):
+    stores = _all_key_stores()
+    store_ids = [store_id for store_id in store_ids if store_id in stores]
+    sheets_ids = [store_id for store_id in store_ids if stores[store_id].kind == "sheets"]
+    counts = _fetch_sheets_key_counts(sheets_ids) if sheets_ids else {}
+    for store_id in store_ids:
+        if stores[store_id].kind != "sheets":
+            counts[store_id] = stores[store_id].counts()
+    return counts
+
+def _skus_for_store(store_id):
+    router = product_router.current()
+    skus = [sku for sku, cfg in router.exact.items() if get_key_store(cfg).store_id == store_id]
+    skus += [pattern.pattern for pattern, cfg in router.patterns if get_key_store(cfg).store_id == store_id]
+    return skus
+
+# 📦 Tampon de clés pré-réservées (optionnel, KEY_PREFETCH_LOW_WATERMARK)
+_key_prefetch_lock = threading.Lock()
+_key_prefetch_buffer = None
+
+def get_key_prefetch_buffer():
+    global _key_prefetch_buffer
+    with _key_prefetch_lock:
+        if _key_prefetch_buffer is None:
+            _key_prefetch_buffer = KeyPrefetchBuffer(
+                reserve_license_keys_gsheet,
+                push_key_claims_gsheet,
+                low_watermark=KEY_PREFETCH_LOW_WATERMARK,
+                batch_size=KEY_PREFETCH_BATCH_SIZE,
+                interval_seconds=KEY_PREFETCH_INTERVAL_SECONDS,
+                on_release=release_reserved_keys,
+                max_age_seconds=KEY_PREFETCH_MAX_AGE_SECONDS,
+                reap=reap_orphaned_prefetch_keys,
+                reap_interval_seconds=KEY_PREFETCH_REAP_SECONDS,
+            )
+            _key_prefetch_buffer.start()
+        return _key_prefetch_buffer
+
+# 🔑 Fonction de récupération de clés (réservation groupée)
+def get_and_use_license_keys_gsheet(to_email, spreadsheet_id, range_name, count, order_id=None):
+    """
+    Réserve `count` clés libres d'un même range en une seule lecture et une seule écriture ciblée.
+    Retourne la liste des clés, ou None si le stock est insuffisant (aucune clé n'est alors marquée).
+    """
+    if count <= 0:
+        return []
+
+    if KEY_INVENTORY_DB:
+        keys = get_key_inventory().claim(spreadsheet_id, range_name, count, to_email, order_id=order_id)
+        if keys:
+            get_key_levels().record(spreadsheet_id, range_name, len(keys))
+        return keys
+
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    if KEY_PREFETCH_LOW_WATERMARK > 0:
+        keys = get_key_prefetch_buffer().take(spreadsheet_id, range_name, count, to_email, order_id, now)
+        if keys is not None:
+            get_key_levels().record(spreadsheet_id, range_name, len(keys), from_state="reserved")
+            return keys
+
+    with key_range_lock(spreadsheet_id, range_name):
+        claimed = _claim_rows_locked(spreadsheet_id, range_name, count, to_email, order_id, now)
+    if not claimed:
+        return None
+    get_key_levels().record(spreadsheet_id, range_name, len(claimed[1]))
+    return [key for _, key in claimed[1]]
+
+def release_license_keys_gsheet(spreadsheet_id, range_name, keys):
+    """
+    Remet à disposition (used='false') des clés déjà marquées 'true' mais jamais envoyées (commande
+    abandonnée en cours de finalisation). Retourne le nombre de clés libérées.
+    """
+    keys = set(keys)
+    if not keys:
+        return 0
+    if KEY_INVENTORY_DB:
+        released = get_key_inventory().release(spreadsheet_id, range_name, keys)
+    else:
+        _, _, header_row, _ = _parse_a1_range(range_name)
+        with key_range_lock(spreadsheet_id, range_name):
+            values = read_keys(spreadsheet_id, range_name)
+            header = values[0] if values else []
+            if not all(name in header for name in ('key', 'used')):
+                raise RuntimeError(f"Colonnes 'key'/'used' introuvables dans {range_name}")
+            key_index, used_index = header.index('key'), header.index('used')
+            freed = []
+            for offset, row in enumerate(values[1:]):
+                _pad_row(row, len(header))
+                if row[key_index] in keys and row[used_index].strip().lower() == 'true':
+                    freed.append((header_row + 1 + offset, {"key": row[key_index], "used": "false"}))
+            if freed:
+                push_key_claims_gsheet(spreadsheet_id, range_name, header, freed)
+        # Hors du verrou : rewind_key_cursor le reprend
+        rewind_key_cursor(spreadsheet_id, range_name, [row_number for row_number, _ in freed])
+        released = len(freed)
+    if released:
+        get_key_levels().record(spreadsheet_id, range_name, released, from_state="used", to_state="free")
+    return released
+
+def _prefetch_owner():
+    return f"reserved:{socket.gethostname()}:{os.getpid()}"
+
+def _prefetch_owner_alive(owner):
+    # Process d'une pré-réservation encore vivant ? Seulement vérifiable sur cette machine (sinon None)
+    host, _, pid = owner[len("reserved:"):].rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def reap_orphaned_prefetch_keys(owned):
+    """
+    Remet à disposition (used='false') les pré-réservations du tampon (mail 'reserved:<hôte>:<pid>')
+    laissées par un process mort sans passer par atexit : process de cette machine disparu, lignes au nom
+    du process courant absentes de owned (redémarrage avec le même pid), ou pré-réservation de plus de
+    2 x KEY_PREFETCH_MAX_AGE_SECONDS (autre machine : un tampon vivant rend ses clés avant). Les retenues
+    de commande (used='reserved', mail client) ne sont jamais touchées.
+    """
+    own = _prefetch_owner()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    max_age = datetime.timedelta(seconds=2 * KEY_PREFETCH_MAX_AGE_SECONDS)
+    reaped = 0
+    for spreadsheet_id, range_name in _all_key_ranges():
+        _, _, header_row, _ = _parse_a1_range(range_name)
+        with key_range_lock(spreadsheet_id, range_name):
+            values = read_keys(spreadsheet_id, range_name)
+            header = values[0] if values else []
+            if not all(name in header for name in ('key', 'used', 'mail', 'date')):
+                continue
+            key_index, used_index, mail_index, date_index = (header.index(n) for n in ('key', 'used', 'mail', 'date'))
+            stale = []
+            for offset, row in enumerate(values[1:]):
+                _pad_row(row, len(header))
+                owner = row[mail_index].strip()
+                if row[used_index].strip().lower() != 'reserved' or not owner.startswith("reserved:"):
+                    continue
+                row_number = header_row + 1 + offset
+                if owner == own:
+                    orphaned = ((spreadsheet_id, range_name), row_number) not in owned
+                else:
+                    reserved_at = parse_iso8601(row[date_index])
+                    if reserved_at and reserved_at.tzinfo is None:
+                        reserved_at = reserved_at.replace(tzinfo=datetime.timezone.utc)
+                    orphaned = _prefetch_owner_alive(owner) is False or not reserved_at or now - reserved_at > max_age
+                if orphaned:
+                    stale.append((row_number, {"key": row[key_index], "used": "false", "mail": "", "date": "", "order_id": ""}))
+            if stale:
+                push_key_claims_gsheet(spreadsheet_id, range_name, header, stale)
+        if stale:
+            # Hors du verrou : rewind_key_cursor le reprend
+            release_reserved_keys(spreadsheet_id, range_name, [row_number for row_number, _ in stale])
+            log(f"🧹 {range_name}: {len(stale)} pré-réservation(s) orpheline(s) remise(s) à disposition")
+            reaped += len(stale)
+    return reaped
+
+def reserve_license_keys_gsheet(spreadsheet_id, range_name, count):
+    # Pré-réservation visible dans la sheet : used='reserved', mail=reserved:<hôte>:<pid>
+    owner = _prefetch_owner()
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    with key_range_lock(spreadsheet_id, range_name):
+        claimed = _claim_rows_locked(spreadsheet_id, range_name, count, owner, None, now, used_value='reserved')
+    if claimed:
+        get_key_levels().record(spreadsheet_id, range_name, len(claimed[1]), to_state="reserved")
+    return claimed
+
+def release_reserved_keys(spreadsheet_id, range_name, row_numbers):
+    rewind_key_cursor(spreadsheet_id, range_name, row_numbers)
+    get_key_levels().record(spreadsheet_id, range_name, len(row_numbers), from_state="reserved", to_state="free")
+
+def rewind_key_cursor(spreadsheet_id, range_name, row_numbers):
+    # Des clés redeviennent libres : le curseur ne doit pas les avoir dépassées
+    if not row_numbers:
+        return
+    with key_range_lock(spreadsheet_id, range_name):
+        cursor = get_key_cursor(spreadsheet_id, range_name)
+        if cursor is not None and min(row_numbers) < int(cursor):
+            set_key_cursor(spreadsheet_id, range_name, min(row_numbers))
+
+def _rows_claimed_meanwhile(spreadsheet_id, found):
+    # Compare-before-write : relit uniquement la cellule 'used' des lignes choisies, tous ranges en un batchGet
+    checked = []
+    ranges = []
+    for range_name, (header, free_rows) in found.items():
+        sheet_name, first_col, _, _ = _parse_a1_range(range_name)
+        used_col = first_col + header.index('used')
+        for row_number, _ in free_rows:
+            checked.append((range_name, row_number))
+            ranges.append(_a1_block_range(sheet_name, used_col, used_col, row_number))
+    if not ranges:
+        return {}
+    service = get_sheets_service()
+    result = service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id, ranges=ranges).execute()
+    taken = {}
+    for (range_name, row_number), value_range in zip(checked, result.get('valueRanges', [])):
+        values = value_range.get('values') or [['']]
+        if str(values[0][0] if values[0] else '').lower() != 'false':
+            taken.setdefault(range_name, []).append(row_number)
+    return taken
+
+def _select_free_rows_locked(spreadsheet_id, demands):
+    """
+    Choisit les lignes libres de plusieurs ranges d'un même spreadsheet (appelé sous leurs key_range_lock).
+    Retourne {range_name: (header, [(numéro de ligne, row)])} ; un range au stock insuffisant a moins de lignes que demandé.
+    """
+    for attempt in range(1, KEY_CLAIM_MAX_ATTEMPTS + 1):
+        found = _find_free_key_rows(spreadsheet_id, demands)
+        if any(len(found[range_name][1]) < count for range_name, count in demands.items()):
+            return found
+        taken = _rows_claimed_meanwhile(spreadsheet_id, found)
+        if not taken:
+            return found
+        log(f"⚠️ Ligne(s) {taken} prise(s) entre lecture et écriture (tentative {attempt})")
+    raise RuntimeError(f"Réservation de clés {', '.join(demands)} impossible après {KEY_CLAIM_MAX_ATTEMPTS} tentatives")
+
+def _write_key_claims_locked(spreadsheet_id, found, to_email, order_id, now, used_value='true', owners=None):
+    """
+    Marque les lignes choisies en un seul batchUpdate ; retourne {range_name: (header, [(numéro de ligne, clé)])}.
+    owners = {range_name: [(email, order_id)] alignée sur les lignes} quand elles servent plusieurs commandes.
+    """
+    claimed = {}
+    updates = []
+    for range_name, (header, free_rows) in found.items():
+        key_index = header.index('key')
+        used_index = header.index('used')
+        mail_index = header.index('mail')
+        date_index = header.index('date')
+        order_id_index = header.index('order_id') if 'order_id' in header else None
+        range_owners = (owners or {}).get(range_name)
+        keys = []
+        for position, (row_number, row) in enumerate(free_rows):
+            row_email, row_order_id = range_owners[position] if range_owners else (to_email, order_id)
+            keys.append((row_number, row[key_index]))
+            row[used_index] = used_value
+            row[mail_index] = row_email
+            row[date_index] = now
             if order_id_index is not None:
-                row[order_id_index] = order_id if order_id else ''
-            break
+                row[order_id_index] = row_order_id if row_order_id else ''
+            updates.append(_key_claim_update(header, range_name, row_number, row))
+        claimed[range_name] = (header, keys)
+
+    write_key_cells(spreadsheet_id, updates)
 
-    if not selected_key:
+    # Les lignes libres sont prises dans l'ordre : tout ce qui précède la dernière est utilisé
+    for range_name, (_, free_rows) in found.items():
+        set_key_cursor(spreadsheet_id, range_name, free_rows[-1][0] + 1)
+
+    return claimed
+
+def _claim_rows_locked(spreadsheet_id, range_name, count, to_email, order_id, now, used_value='true'):
+    """Réserve `count` lignes (appelé sous key_range_lock) ; retourne (header, [(numéro de ligne, clé)]) ou None."""
+    found = _select_free_rows_locked(spreadsheet_id, {range_name: count})
+    if len(found[range_name][1]) < count:
         return None
+    return _write_key_claims_locked(spreadsheet_id, found, to_email, order_id, now, used_value)[range_name]
+
+# 🧾 Réservation de toutes les clés d'une commande (tous SKU confondus)
+@contextlib.contextmanager
+def key_ranges_lock(range_ids):
+    # Verrous toujours pris dans le même ordre : pas d'interblocage entre commandes concurrentes
+    with contextlib.ExitStack() as stack:
+        for spreadsheet_id, range_name in sorted(set(range_ids)):
+            stack.enter_context(key_range_lock(spreadsheet_id, range_name))
+        yield
+
+def _group_sheets_demands(stores, demands):
+    """
+    Regroupe les lignes servies directement par la sheet : ({spreadsheet_id: {range_name: quantité}}, [index des autres]).
+    Inventaire SQLite, tampon pré-réservé et stores CSV/SQLite ne lisent pas la sheet : réservation par store.
+    """
+    grouped_mode = not KEY_INVENTORY_DB and KEY_PREFETCH_LOW_WATERMARK <= 0
+    grouped = {}
+    others = []
+    for index, (store, (_, count)) in enumerate(zip(stores, demands)):
+        if count <= 0:
+            continue
+        if grouped_mode and store.kind == "sheets":
+            ranges = grouped.setdefault(store.spreadsheet_id, {})
+            ranges[store.range_name] = ranges.get(store.range_name, 0) + count
+        else:
+            others.append(index)
+    return grouped, others
+
+def _select_grouped_rows_locked(grouped):
+    # -> ({spreadsheet_id: lignes choisies}, (spreadsheet_id, range_name) à court de stock ou None)
+    selected = {}
+    for spreadsheet_id, ranges in grouped.items():
+        found = _select_free_rows_locked(spreadsheet_id, ranges)
+        for range_name, count in ranges.items():
+            if len(found[range_name][1]) < count:
+                return selected, (spreadsheet_id, range_name)
+        selected[spreadsheet_id] = found
+    return selected, None
+
+def _write_grouped_claims_locked(selected, to_email, order_id, now, used_value='true', owners=None):
+    # -> {(spreadsheet_id, range_name): (header, [(numéro de ligne, clé)])}, un batchUpdate par spreadsheet
+    # owners = {(spreadsheet_id, range_name): [(email, order_id)]} pour un lot de plusieurs commandes
+    claimed = {}
+    for spreadsheet_id, found in selected.items():
+        range_owners = {r: owners[(spreadsheet_id, r)] for r in found} if owners else None
+        for range_name, rows in _write_key_claims_locked(
+                spreadsheet_id, found, to_email, order_id, now, used_value, owners=range_owners).items():
+            claimed[(spreadsheet_id, range_name)] = rows
+    return claimed
+
+def _split_claimed_rows(stores, demands, claimed, skip=()):
+    # Répartit les lignes réservées par range entre les lignes de commande, dans l'ordre
+    remaining = {range_id: list(rows) for range_id, (_, rows) in claimed.items()}
+    split = {}
+    for index, (store, (_, count)) in enumerate(zip(stores, demands)):
+        if index in skip or count <= 0:
+            continue
+        rows = remaining[store.store_id]
+        split[index], remaining[store.store_id] = rows[:count], rows[count:]
+    return split
+
+def claim_license_keys_for_order(demands, to_email, order_id=None):
+    """
+    demands = [(config, quantité), ...] -> liste alignée de listes de clés.
+    Les ranges Sheets d'un même spreadsheet sont lus en un batchGet, vérifiés en un batchGet et marqués
+    en un batchUpdate, quel que soit le nombre de SKU et d'unités. Si une ligne manque de stock, son
+    entrée vaut None et aucune clé n'est marquée (les clés des autres stores déjà réservées sont rendues).
+    """
+    stores = [get_key_store(config) for config, _ in demands]
+    results = [[] for _ in demands]
+    grouped, others = _group_sheets_demands(stores, demands)
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    with key_ranges_lock((s, r) for s, ranges in grouped.items() for r in ranges):
+        selected, short = _select_grouped_rows_locked(grouped)
+        if short:
+            results[next(i for i, store in enumerate(stores) if store.store_id == short)] = None
+            return results
+
+        deferred = []
+        try:
+            for index in others:
+                config, count = demands[index]
+                keys = claim_license_keys(config, to_email, count, order_id=order_id)
+                if not keys:
+                    _release_deferred_claims(order_id, deferred)
+                    return [None if i == index else [] for i in range(len(demands))]
+                deferred.append((config, keys))
+                results[index] = keys
+
+            claimed = _write_grouped_claims_locked(selected, to_email, order_id, now)
+        except Exception:
+            _release_deferred_claims(order_id, deferred)
+            raise
+
+    for (spreadsheet_id, range_name), (_, rows) in claimed.items():
+        get_key_levels().record(spreadsheet_id, range_name, len(rows))
+    for index, rows in _split_claimed_rows(stores, demands, claimed, skip=set(others)).items():
+        results[index] = [key for _, key in rows]
+    return results
+
+def claim_license_keys_for_orders(orders):
+    """
+    orders = [(demands, to_email, order_id), ...] -> liste alignée de résultats de claim_license_keys_for_order.
+    Toutes les commandes d'un cycle de poll sont réservées ensemble : un batchGet de lecture, un batchGet de
+    vérification et un batchUpdate par spreadsheet pour tout le lot, chaque ligne marquée avec l'email et
+    l'order_id de sa commande. Lot non servi entièrement par Sheets (inventaire, tampon, stores CSV/SQLite)
+    ou stock insuffisant pour le lot : chaque commande est réservée séparément.
+    """
+    if len(orders) <= 1:
+        return [claim_license_keys_for_order(demands, to_email, order_id=order_id) for demands, to_email, order_id in orders]
+
+    demands = [demand for order_demands, _, _ in orders for demand in order_demands]
+    stores = [get_key_store(config) for config, _ in demands]
+    grouped, others = _group_sheets_demands(stores, demands)
+    if others or not grouped:
+        return [claim_license_keys_for_order(demands, to_email, order_id=order_id) for demands, to_email, order_id in orders]
+
+    # Lignes attribuées dans l'ordre des demandes, comme _split_claimed_rows les répartira
+    owners = {}
+    stores_left = iter(stores)
+    for order_demands, to_email, order_id in orders:
+        for (_, count), store in zip(order_demands, stores_left):
+            if count > 0:
+                owners.setdefault(store.store_id, []).extend([(to_email, order_id)] * count)
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    with key_ranges_lock((s, r) for s, ranges in grouped.items() for r in ranges):
+        selected, short = _select_grouped_rows_locked(grouped)
+        if not short:
+            claimed = _write_grouped_claims_locked(selected, None, None, now, owners=owners)
+    if short:
+        log(f"ℹ️ Stock {short[1]} insuffisant pour le lot de {len(orders)} commande(s): réservation commande par commande")
+        return [claim_license_keys_for_order(demands, to_email, order_id=order_id) for demands, to_email, order_id in orders]
+
+    for (spreadsheet_id, range_name), (_, rows) in claimed.items():
+        get_key_levels().record(spreadsheet_id, range_name, len(rows))
+    split = _split_claimed_rows(stores, demands, claimed)
+    results = []
+    index = 0
+    for order_demands, _, _ in orders:
+        results.append([[key for _, key in split.get(index + offset, [])] for offset in range(len(order_demands))])
+        index += len(order_demands)
+    return results
+
+# ⏳ Réservation en deux temps : retenue à la création de commande, finalisation au paiement
+_key_holds_lock = threading.Lock()
+_key_holds = None
+
+def get_key_holds():
+    global _key_holds
+    with _key_holds_lock:
+        if _key_holds is None:
+            _key_holds = KeyHolds(KEY_HOLDS_DB, release=release_key_holds)
+            _key_holds.start_reaper(KEY_HOLD_REAP_SECONDS)
+        return _key_holds
+
+def release_key_holds(holds):
+    # Lignes retenues remises à disposition dans la sheet (used='false'), un batchUpdate par range
+    by_range = {}
+    for hold in holds:
+        if hold["row_number"] is not None:
+            by_range.setdefault((hold["spreadsheet_id"], hold["range_name"]), []).append(hold)
+    for (spreadsheet_id, range_name), range_holds in by_range.items():
+        push_key_claims_gsheet(spreadsheet_id, range_name, range_holds[0]["header"], [
+            (hold["row_number"], {"key": hold["key"], "used": "false", "mail": "", "date": "", "order_id": ""})
+            for hold in range_holds
+        ])
+        release_reserved_keys(spreadsheet_id, range_name, [hold["row_number"] for hold in range_holds])
+        log(f"⏳ {range_name}: {len(range_holds)} clé(s) retenue(s) remise(s) à disposition")
+
+def reserve_order_keys(customer_email, language_email, line_items, order_id):
+    """
+    Création de commande : retient les clés de toutes les lignes (used='reserved' dans la sheet, mail et
+    order_id renseignés) pendant KEY_HOLD_TTL_SECONDS. La lecture Sheets a lieu ici ; commit_order_keys
+    n'a plus qu'à basculer les lignes. Les stores non Sheets (et les modes inventaire/tampon, sans lecture
+    de la sheet) sont réservés au commit.
+    """
+    if not customer_email:
+        return {"error": "Email manquant"}, 400
+    if not order_id:
+        return {"error": "order_id manquant"}, 400
+    if not line_items:
+        return {"error": "Aucun produit trouvé"}, 400
+
+    holds = get_key_holds()
+    status = holds.order_status(order_id)
+    if status:
+        return {"message": f"Commande {order_id} déjà {'finalisée' if status == 'committed' else 'réservée'}",
+                "order_id": order_id, "status": status}, 200
+
+    wanted, skipped_skus = _order_key_demands(line_items)
+    if not wanted:
+        return {"error": "Aucun produit configuré trouvé dans la commande", "skipped_skus": skipped_skus}, 400
+
+    demands = [(config, qty) for _, config, qty in wanted]
+    stores = [get_key_store(config) for config, _ in demands]
+    grouped, others = _group_sheets_demands(stores, demands)
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    with key_ranges_lock((s, r) for s, ranges in grouped.items() for r in ranges):
+        selected, short = _select_grouped_rows_locked(grouped)
+        if short:
+            sku = wanted[next(i for i, store in enumerate(stores) if store.store_id == short)][0]
+            return {"error": f"Aucune clé disponible pour {sku}"}, 500
+        claimed = _write_grouped_claims_locked(selected, customer_email, order_id, now, used_value='reserved')
+
+    for (spreadsheet_id, range_name), (_, rows) in claimed.items():
+        get_key_levels().record(spreadsheet_id, range_name, len(rows), to_state="reserved")
+
+    records = []
+    for index, rows in _split_claimed_rows(stores, demands, claimed, skip=set(others)).items():
+        store = stores[index]
+        records += [{
+            "sku": wanted[index][0], "spreadsheet_id": store.spreadsheet_id, "range_name": store.range_name,
+            "row_number": row_number, "key": key, "header": claimed[store.store_id][0],
+        } for row_number, key in rows]
+    records += [{"sku": wanted[index][0], "quantity": wanted[index][2]} for index in others]
+
+    if not holds.add(order_id, customer_email, language_email, records, KEY_HOLD_TTL_SECONDS):
+        # Réservation concurrente de la même commande : on rend nos lignes
+        release_key_holds([record for record in records if record.get("row_number") is not None])
+        return {"message": f"Commande {order_id} déjà réservée", "order_id": order_id, "status": "held"}, 200
+
+    held = sum(1 for record in records if record.get("row_number") is not None)
+    log(f"⏳ Commande {order_id}: {held} clé(s) retenue(s) pour {int(KEY_HOLD_TTL_SECONDS)}s")
+    response = {
+        "message": f"{held} clé(s) retenue(s)",
+        "order_id": order_id,
+        "held_keys": held,
+        "expires_in_seconds": KEY_HOLD_TTL_SECONDS,
+    }
+    if others:
+        response["deferred_skus"] = [wanted[index][0] for index in others]
+    if skipped_skus:
+        response["skipped_skus"] = skipped_skus
+    return response, 200
+
+def _release_deferred_claims(order_id, deferred):
+    # Best effort : une clé non rendue reste marquée au nom de la commande (order_id) pour reprise manuelle
+    for config, keys in deferred:
+        try:
+            release_license_keys(config, keys)
+        except Exception as e:
+            log(f"❌ Commande {order_id}: clés {keys} non remises à disposition: {e}")
+
+def commit_order_keys(customer_email, language_email, line_items, order_id):
+    """
+    Paiement : finalise les clés retenues (un batchUpdate par spreadsheet, sans lecture) puis envoie les
+    emails. Sans retenue active (jamais posée ou expirée), retombe sur le traitement complet de process_order.
+    """
+    if not order_id:
+        return {"error": "order_id manquant"}, 400
+
+    holds = get_key_holds()
+    journal_key = _order_journal_key(order_id, customer_email, line_items)
+    if holds.order_status(order_id) == "committed":
+        entry = get_order_journal().load(journal_key)
+        if entry and entry["status"] != "completed" and entry["keys"]:
+            # Finalisée mais emails interrompus : seuls les emails manquants sont envoyés
+            log(f"🔁 Commande {order_id}: reprise des emails non envoyés")
+            by_sku = {}
+            for journaled in entry["keys"]:
+                by_sku.setdefault(journaled["sku"], []).append(journaled["key"])
+            return _send_order_keys(
+                customer_email or entry["to_email"], language_email or entry["language"] or "fr", order_id,
+                [(sku, find_product_config_for_sku(sku) or {}, keys) for sku, keys in by_sku.items()],
+                [],
+                journal_key=journal_key,
+            )
+        return {"message": f"Commande {order_id} déjà finalisée", "order_id": order_id, "status": "committed"}, 200
+
+    taken = holds.take_for_commit(order_id)
+    if not taken:
+        log(f"ℹ️ Commande {order_id}: aucune retenue active, traitement complet")
+        return process_order(customer_email, language_email, line_items, order_id=order_id)
+
+    customer_email = customer_email or taken[0]["to_email"]
+    language_email = language_email or taken[0]["language"] or "fr"
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    claimed = {}
+    # Clés réservées ici hors retenue (CSV/SQLite, inventaire, prefetch) : à rendre si la finalisation échoue
+    deferred = []
+    try:
+        for hold in taken:
+            if hold["row_number"] is None:
+                config = find_product_config_for_sku(hold["sku"])
+                keys = claim_license_keys(config, customer_email, hold["quantity"], order_id=order_id) if config else None
+                if not keys:
+                    _release_deferred_claims(order_id, deferred)
+                    holds.restore(taken)
+                    return {"error": f"Aucune clé disponible pour {hold['sku']}"}, 500
+                deferred.append((config, keys))
+                claimed.setdefault(hold["sku"], []).extend(keys)
+
+        updates = {}
+        for hold in taken:
+            if hold["row_number"] is None:
+                continue
+            values = {"key": hold["key"], "used": "true", "mail": customer_email, "date": now, "order_id": order_id}
+            updates.setdefault(hold["spreadsheet_id"], []).append(_key_claim_update(
+                hold["header"], hold["range_name"], hold["row_number"], [values.get(name, '') for name in hold["header"]]))
+            claimed.setdefault(hold["sku"], []).append(hold["key"])
+        for spreadsheet_id, data in updates.items():
+            write_key_cells(spreadsheet_id, data)
+    except Exception:
+        _release_deferred_claims(order_id, deferred)
+        holds.restore(taken)
+        raise
 
-    # On réinjecte les données modifiées
-    updated_values = [header] + data
-    write_keys(spreadsheet_id, range_name, updated_values)
+    committed = {}
+    for hold in taken:
+        if hold["row_number"] is not None:
+            range_id = (hold["spreadsheet_id"], hold["range_name"])
+            committed[range_id] = committed.get(range_id, 0) + 1
+    for (spreadsheet_id, range_name), count in committed.items():
+        get_key_levels().record(spreadsheet_id, range_name, count, from_state="reserved")
+
+    journal = get_order_journal()
+    journal.open(journal_key, customer_email, language_email)
+    for sku, keys in claimed.items():
+        journal.record_claims(journal_key, sku, keys)
+    return _send_order_keys(
+        customer_email, language_email, order_id,
+        [(sku, find_product_config_for_sku(sku) or {}, keys) for sku, keys in claimed.items()],
+        [],
+        journal_key=journal_key,
+    )
+
+# 🗄️ Archivage des clés utilisées
+def _row_runs(row_numbers):
+    # [5, 6, 7, 10] -> [(5, 7), (10, 10)]
+    runs = []
+    for row_number in sorted(row_numbers):
+        if runs and row_number == runs[-1][1] + 1:
+            runs[-1][1] = row_number
+        else:
+            runs.append([row_number, row_number])
+    return [tuple(run) for run in runs]
+
+def archive_used_keys(spreadsheet_id, range_name):
+    """
+    Copie les lignes utilisées (used='true') dans l'onglet d'archive puis les efface du range actif,
+    par lots de KEY_ARCHIVE_BATCH_ROWS, chacun sous key_range_lock. Les lignes sont vidées et non
+    supprimées : les numéros de ligne (curseur, tampon, inventaire SQLite) restent valides.
+    """
+    sheet_name, first_col, header_row, last_col = _parse_a1_range(range_name)
+    archive_spreadsheet_id = KEY_ARCHIVE_SPREADSHEET_ID or spreadsheet_id
+    archive_range = f"{_quote_sheet_name(sheet_name + KEY_ARCHIVE_SHEET_SUFFIX)}!A1"
+    service = get_sheets_service()
+    archived = 0
+    while True:
+        with key_range_lock(spreadsheet_id, range_name):
+            values = read_keys(spreadsheet_id, range_name)
+            if not values or 'used' not in values[0]:
+                break
+            header = values[0]
+            used_index = header.index('used')
+            batch = []
+            for offset, row in enumerate(values[1:]):
+                _pad_row(row, len(header))
+                if row[used_index].strip().lower() == 'true':
+                    batch.append((header_row + 1 + offset, row))
+                    if len(batch) == KEY_ARCHIVE_BATCH_ROWS:
+                        break
+            if not batch:
+                break
+            # Append d'abord : en cas d'échec avant l'effacement, au pire un doublon dans l'archive
+            service.spreadsheets().values().append(
+                spreadsheetId=archive_spreadsheet_id,
+                range=archive_range,
+                valueInputOption="RAW",
+                insertDataOption="INSERT_ROWS",
+                body={"values": [row for _, row in batch]},
+            ).execute()
+            clear_ranges = [
+                _a1_block_range(sheet_name, first_col, last_col, start, end)
+                for start, end in _row_runs([row_number for row_number, _ in batch])
+            ]
+            service.spreadsheets().values().batchClear(
+                spreadsheetId=spreadsheet_id, body={"ranges": clear_ranges}).execute()
+        archived += len(batch)
+        log(f"🗄️ {range_name}: {len(batch)} clé(s) utilisée(s) archivée(s) (total {archived})")
+        if len(batch) < KEY_ARCHIVE_BATCH_ROWS:
+            break
+    return archived
+
+# 📥 Import de clés en masse avec détection des doublons tous ranges confondus
+def _read_key_columns_gsheet(spreadsheet_id, range_names, include_archives=True):
+    """{range_name: [clés de la colonne 'key' (vides comprises)]} en un batchGet (+ un pour les archives)."""
+    from googleapiclient.errors import HttpError
 
-    return selected_key
+    headers = load_key_headers(spreadsheet_id, range_names)
+    service = get_sheets_service()
+    columns = {}
+    targets = []
+    archives = []
+    for range_name in range_names:
+        header = headers[range_name]
+        if 'key' not in header:
+            continue
+        sheet_name, first_col, header_row, _ = _parse_a1_range(range_name)
+        key_col = first_col + header.index('key')
+        targets.append((range_name, _a1_column_range(sheet_name, key_col, header_row + 1)))
+        if include_archives:
+            # Les lignes archivées sont copiées à partir de la 1re colonne du range
+            archive_sheet = sheet_name + KEY_ARCHIVE_SHEET_SUFFIX
+            archives.append((archive_sheet, (f"archive:{range_name}", _a1_column_range(archive_sheet, header.index('key'), 1))))
+
+    def fetch(batch, target_spreadsheet_id):
+        if not batch:
+            return
+        result = service.spreadsheets().values().batchGet(
+            spreadsheetId=target_spreadsheet_id, ranges=[a1 for _, a1 in batch]).execute()
+        for (name, _), value_range in zip(batch, result.get('valueRanges', [])):
+            columns[name] = [(cells[0] if cells else '').strip() for cells in value_range.get('values', [])]
+
+    fetch(targets, spreadsheet_id)
+    if archives:
+        # Un onglet absent ferait échouer tout le batchGet : seuls les onglets d'archive existants sont lus
+        archive_spreadsheet_id = KEY_ARCHIVE_SPREADSHEET_ID or spreadsheet_id
+        try:
+            titles = _sheet_titles(archive_spreadsheet_id)
+            missing = [archive_sheet for archive_sheet, _ in archives if archive_sheet not in titles]
+            if missing:
+                log(f"ℹ️ Onglet(s) d'archive absent(s) (rien d'archivé) : {', '.join(missing)}")
+            fetch([target for archive_sheet, target in archives if archive_sheet in titles], archive_spreadsheet_id)
+        except HttpError as e:
+            log(f"⚠️ Archives de clés non lues ({e.resp.status}) : les doublons archivés ne seront pas détectés")
+    return columns
+
+def _sheet_titles(spreadsheet_id):
+    metadata = get_sheets_service().spreadsheets().get(
+        spreadsheetId=spreadsheet_id, fields="sheets.properties.title").execute()
+    return {sheet.get('properties', {}).get('title') for sheet in metadata.get('sheets', [])}
+
+def _all_keys_gsheet(spreadsheet_id, range_name):
+    # Clés du range et de son onglet d'archive (build_known_keys_index groupe plutôt les ranges par spreadsheet)
+    return [key for keys in _read_key_columns_gsheet(spreadsheet_id, [range_name]).values() for key in keys if key]
+
+def build_known_keys_index():
+    """{clé: description du range/store qui la contient}, sur tous les backends configurés."""
+    index = {}
+    by_spreadsheet = {}
+    for store_id, store in _all_key_stores().items():
+        if store.kind == "sheets":
+            by_spreadsheet.setdefault(store.spreadsheet_id, []).append(store.range_name)
+        else:
+            label = store.describe().get("path", store.kind)
+            for key in store.all_keys():
+                index.setdefault(key, label)
+    for spreadsheet_id, range_names in by_spreadsheet.items():
+        for name, keys in _read_key_columns_gsheet(spreadsheet_id, range_names).items():
+            for key in keys:
+                if key:
+                    index.setdefault(key, name)
+    return index
+
+def _ensure_grid_rows(spreadsheet_id, sheet_name, last_row):
+    # values().update refuse d'écrire au-delà de la grille de l'onglet ("exceeds grid limits") : on l'agrandit d'abord
+    service = get_sheets_service()
+    metadata = service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id, fields="sheets.properties(sheetId,title,gridProperties.rowCount)").execute()
+    for sheet in metadata.get('sheets', []):
+        properties = sheet.get('properties', {})
+        if properties.get('title') != sheet_name:
+            continue
+        missing = last_row - properties.get('gridProperties', {}).get('rowCount', 0)
+        if missing > 0:
+            service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": [{
+                "appendDimension": {"sheetId": properties['sheetId'], "dimension": "ROWS", "length": missing},
+            }]}).execute()
+            log(f"📐 Onglet {sheet_name}: {missing} ligne(s) ajoutée(s) à la grille")
+        return
+    raise RuntimeError(f"Onglet {sheet_name} introuvable dans {spreadsheet_id}")
+
+def append_license_keys_gsheet(spreadsheet_id, range_name, keys):
+    # Écrit après la dernière clé (pas d'append API : les lignes archivées vides fausseraient sa détection de table).
+    # Les dernières lignes vidées par l'archivage sont réutilisées : l'inventaire SQLite reconnaît la nouvelle clé
+    sheet_name, first_col, header_row, last_col = _parse_a1_range(range_name)
+    header = load_key_headers(spreadsheet_id, [range_name])[range_name]
+    service = get_sheets_service()
+    with key_range_lock(spreadsheet_id, range_name):
+        existing = _read_key_columns_gsheet(spreadsheet_id, [range_name], include_archives=False).get(range_name, [])
+        first_row = next_row = header_row + 1 + len(existing)
+        if keys:
+            _ensure_grid_rows(spreadsheet_id, sheet_name, next_row + len(keys) - 1)
+        for start in range(0, len(keys), KEY_IMPORT_CHUNK_ROWS):
+            chunk = keys[start:start + KEY_IMPORT_CHUNK_ROWS]
+            rows = []
+            for key in chunk:
+                row = [''] * len(header)
+                row[header.index('key')] = key
+                row[header.index('used')] = 'false'
+                rows.append(row)
+            target = _a1_block_range(sheet_name, first_col, first_col + len(header) - 1, next_row, next_row + len(rows) - 1)
+            service.spreadsheets().values().update(
+                spreadsheetId=spreadsheet_id, range=target,
+                valueInputOption='RAW', body={'values': rows}).execute()
+            next_row += len(rows)
+    # Hors du verrou : rewind_key_cursor le reprend (lignes réutilisées possiblement avant le curseur)
+    if keys:
+        rewind_key_cursor(spreadsheet_id, range_name, [first_row])
+    return len(keys)
+
+def _keys_from_csv_lines(lines):
+    # CSV au format keys.csv (colonne 'key') ou une clé par ligne
+    reader = csv.reader(lines)
+    key_index = 0
+    for line_number, row in enumerate(reader):
+        if not row:
+            continue
+        if line_number == 0 and 'key' in [c.strip().lower() for c in row]:
+            key_index = [c.strip().lower() for c in row].index('key')
+            continue
+        if key_index < len(row):
+            yield row[key_index].strip()
+
+@contextlib.contextmanager
+def key_import_lock():
+    # Un import à la fois (tous workers confondus) : l'index des doublons reste valable jusqu'à l'écriture
+    with key_range_lock("import", "import de clés"):
+        yield
+
+def import_license_keys(config, keys, dry_run=False):
+    store = get_key_store(config)
+    new_keys = []
+    duplicates = []
+    with key_import_lock():
+        index = build_known_keys_index()
+        seen = set()
+        for key in keys:
+            if not key:
+                continue
+            if key in index or key in seen:
+                duplicates.append({"key": key, "found_in": index.get(key, "fichier importé")})
+                continue
+            seen.add(key)
+            new_keys.append(key)
+        if new_keys and not dry_run:
+            store.add_keys(new_keys)
+    if new_keys and not dry_run:
+        if store.kind == "sheets" and KEY_INVENTORY_DB:
+            get_key_inventory().import_range(store.spreadsheet_id, store.range_name)
+        get_key_levels().record(*store.store_id, len(new_keys), from_state=None, to_state="free")
+    log(f"📥 Import clés {store.describe()}: {len(new_keys)} nouvelle(s), {len(duplicates)} doublon(s){' (simulation)' if dry_run else ''}")
+    return {
+        "store": store.describe(),
+        "imported": 0 if dry_run else len(new_keys),
+        "new_keys": len(new_keys),
+        "duplicate_count": len(duplicates),
+        "duplicates": duplicates[:100],
+        "dry_run": dry_run,
+    }
+
+# 🔑 Fonction de récupération de clé
+def get_and_use_license_key_gsheet(to_email, spreadsheet_id, range_name, order_id=None):
+    keys = get_and_use_license_keys_gsheet(to_email, spreadsheet_id, range_name, 1, order_id=order_id)
+    return keys[0] if keys else None
 
 SPREADSHEET_ID = '1x9vyp_TLr7NJSt6n-2qnXF43-MY1fG67ghu0B425or0'
 RANGE_NAME = 'Feuille 1!A1:E'
 
 # 📩 Webhook Shopify Flow
+# 📬 Jobs webhook : payload persisté avant la réponse 202, exécuté (et réessayé) par les threads de fond
+def _webhook_order_id(data):
+    return str(data.get("order_id") or data.get("id") or "").strip() or None
+
+def _run_order_job(data):
+    return process_order(data.get("email"), data.get("language"), data.get("line_items", []),
+                         order_id=_webhook_order_id(data))
+
+def _run_invoice_job(data):
+    success, err = send_invoice_email(data)
+    if not success:
+        return {"error": err or "Echec envoi facture"}, 500
+    return {"message": f"Facture envoyee a {data['email']}"}, 200
+
+_webhook_queue_lock = threading.Lock()
+_webhook_queue = None
+
+def get_webhook_queue():
+    global _webhook_queue
+    with _webhook_queue_lock:
+        if _webhook_queue is None:
+            _webhook_queue = WebhookJobQueue(
+                WEBHOOK_QUEUE_DB,
+                {"order": _run_order_job, "invoice": _run_invoice_job},
+                max_attempts=WEBHOOK_JOB_MAX_ATTEMPTS,
+                retry_seconds=WEBHOOK_JOB_RETRY_SECONDS,
+                lease_seconds=WEBHOOK_JOB_LEASE_SECONDS,
+                log=log,
+            )
+            _webhook_queue.start(WEBHOOK_QUEUE_WORKERS, WEBHOOK_QUEUE_POLL_SECONDS)
+        return _webhook_queue
+
+# ♻️ Idempotence : un renvoi du même webhook rejoue la réponse d'origine (ni Sheets, ni CR7M)
+_webhook_dedupe_lock = threading.Lock()
+_webhook_dedupe = None
+
+def get_webhook_dedupe():
+    global _webhook_dedupe
+    with _webhook_dedupe_lock:
+        if _webhook_dedupe is None:
+            _webhook_dedupe = WebhookDedupe(WEBHOOK_DEDUPE_DB, pending_seconds=WEBHOOK_JOB_LEASE_SECONDS)
+        return _webhook_dedupe
+
+def _webhook_dedupe_order_id(data):
+    order = data.get("order") if isinstance(data.get("order"), dict) else {}
+    return str(data.get("order_id") or data.get("id") or order.get("id") or "").strip()
+
+def _webhook_fingerprint(kind, data):
+    # -> (empreinte, durée de rétention)
+    order_id = _webhook_dedupe_order_id(data)
+    if order_id:
+        return f"{kind}:order:{order_id}", WEBHOOK_DEDUPE_TTL_SECONDS
+    webhook_id = (request.headers.get("X-Shopify-Webhook-Id") or request.headers.get("X-Shopify-Event-Id") or "").strip()
+    if webhook_id:
+        return f"{kind}:webhook:{webhook_id}", WEBHOOK_DEDUPE_TTL_SECONDS
+    body = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return f"{kind}:body:{hashlib.sha256(body.encode('utf-8')).hexdigest()}", WEBHOOK_DEDUPE_BODY_TTL_SECONDS
+
+def _deduplicated(kind, data, handle):
+    # handle() -> (réponse, status), exécuté une seule fois par empreinte ; seules les réponses 2xx sont rejouées.
+    # Renvoi volontaire (facture à renvoyer, job abandonné à relancer) : en-têtes X-Dedupe-Bypass: 1 et
+    # X-Admin-Token -> l'empreinte est ignorée et remplacée par la nouvelle réponse. Une commande déjà
+    # livrée reste protégée par son journal (réponse d'origine, pas de nouvelles clés).
+    # Le doublon reçoit un résumé (order_id, job_id, total_keys) : clés et emails ne sont pas conservés.
+    fingerprint, ttl_seconds = _webhook_fingerprint(kind, data)
+    order_id = _webhook_dedupe_order_id(data) or None
+    dedupe = get_webhook_dedupe()
+    if request.headers.get("X-Dedupe-Bypass", "").strip().lower() in {"1", "true", "yes"}:
+        error = _admin_token_error()
+        if error:
+            return error[0], error[1], {}
+        log(f"♻️ Webhook {fingerprint}: déduplication contournée (admin)")
+        payload, status = handle()
+        if 200 <= status < 300:
+            dedupe.complete(fingerprint, payload, status, ttl_seconds, order_id=order_id)
+        return payload, status, {}
+    fresh, record = dedupe.begin(fingerprint)
+    if not fresh:
+        if record["status"] == "pending":
+            log(f"♻️ Doublon webhook {fingerprint}: traitement d'origine en cours")
+            return {"message": "Webhook déjà en cours de traitement"}, 202, {"Idempotent-Replayed": "true"}
+        log(f"♻️ Doublon webhook {fingerprint}: réponse d'origine rejouée")
+        replayed = {"message": "Webhook déjà traité", **(record["response"] or {})}
+        return replayed, record["status_code"], {"Idempotent-Replayed": "true"}
+    try:
+        payload, status = handle()
+    except Exception:
+        dedupe.release(fingerprint)
+        raise
+    if 200 <= status < 300:
+        dedupe.complete(fingerprint, payload, status, ttl_seconds, order_id=order_id)
+    else:
+        dedupe.release(fingerprint)
+    return payload, status, {}
+
+def _enqueue_webhook_job(kind, data, message):
+    job_id = get_webhook_queue().enqueue(kind, data)
+    log(f"📬 {message} (job {job_id})")
+    return {"message": message, "job_id": job_id}, 202
+
 @app.route("/webhook", methods=["POST"])
 def webhook():
     try:
@@ -1362,8 +2972,19 @@ def webhook():
         language_email = data.get("language")
         line_items = data.get("line_items", [])
 
-        payload, status = process_order(customer_email, language_email, line_items)
-        return jsonify(payload), status
+        if WEBHOOK_ASYNC:
+            # Validation immédiate, puis réservation des clés et emails hors de la requête Shopify
+            if not customer_email:
+                return jsonify({"error": "Email manquant"}), 400
+            if not line_items:
+                return jsonify({"error": "Aucun produit trouvé"}), 400
+            payload, status, headers = _deduplicated(
+                "order", data, lambda: _enqueue_webhook_job("order", data, "Commande mise en file"))
+        else:
+            payload, status, headers = _deduplicated(
+                "order", data,
+                lambda: process_order(customer_email, language_email, line_items, order_id=_webhook_order_id(data)))
+        return jsonify(payload), status, headers
 
     except json.JSONDecodeError as e:
         log(f"❌ Erreur JSON: {e}")
@@ -1373,6 +2994,39 @@ def webhook():
         log(f"❌ Erreur webhook: {e}")
         return jsonify({"error": str(e)}), 500
 
+def _two_phase_order_payload():
+    data = json.loads(request.data.decode("utf-8"))
+    order_id = str(data.get("order_id") or data.get("id") or "").strip()
+    return data.get("email"), data.get("language"), data.get("line_items", []), order_id
+
+@app.route("/webhook/reserve", methods=["POST"])
+def webhook_reserve():
+    # Création de commande : retient les clés (TTL KEY_HOLD_TTL_SECONDS)
+    try:
+        customer_email, language_email, line_items, order_id = _two_phase_order_payload()
+        payload, status = reserve_order_keys(customer_email, language_email, line_items, order_id)
+        return jsonify(payload), status
+    except json.JSONDecodeError as e:
+        log(f"❌ Erreur JSON reserve: {e}")
+        return jsonify({"error": "Format JSON invalide"}), 400
+    except Exception as e:
+        log(f"❌ Erreur webhook reserve: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/webhook/commit", methods=["POST"])
+def webhook_commit():
+    # Paiement : finalise les clés retenues et envoie les emails
+    try:
+        customer_email, language_email, line_items, order_id = _two_phase_order_payload()
+        payload, status = commit_order_keys(customer_email, language_email, line_items, order_id)
+        return jsonify(payload), status
+    except json.JSONDecodeError as e:
+        log(f"❌ Erreur JSON commit: {e}")
+        return jsonify({"error": "Format JSON invalide"}), 400
+    except Exception as e:
+        log(f"❌ Erreur webhook commit: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/webhook/invoice", methods=["POST"])
 def webhook_invoice():
     try:
@@ -1393,10 +3047,29 @@ def webhook_invoice():
         return jsonify({"error": "Email client manquant dans order.customer.email"}), 400
     data["email"] = customer_email
 
-    success, err = send_invoice_email(data)
-    if not success:
-        return jsonify({"error": err or "Echec envoi facture"}), 500
-    return jsonify({"message": f"Facture envoyee a {customer_email}"}), 200
+    if WEBHOOK_ASYNC:
+        payload, status, headers = _deduplicated(
+            "invoice", data, lambda: _enqueue_webhook_job("invoice", data, f"Facture mise en file pour {customer_email}"))
+    else:
+        payload, status, headers = _deduplicated("invoice", data, lambda: _run_invoice_job(data))
+    return jsonify(payload), status, headers
+
+@app.route("/webhook/jobs", methods=["GET"])
+def webhook_jobs_stats():
+    denied = _keys_admin_denied()
+    if denied:
+        return denied
+    return jsonify(get_webhook_queue().stats()), 200
+
+@app.route("/webhook/jobs/<int:job_id>", methods=["GET"])
+def webhook_job_status(job_id):
+    denied = _keys_admin_denied()
+    if denied:
+        return denied
+    job = get_webhook_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Job introuvable"}), 404
+    return jsonify(job), 200
 
 @app.route("/mirakl/poll", methods=["POST"])
 def mirakl_poll():
@@ -1408,6 +3081,90 @@ def amazon_poll():
     payload, status_code = poll_amazon_and_notify()
     return jsonify(payload), status_code
 
+def _admin_token_error():
+    # Admin fermé tant que KEYS_ADMIN_TOKEN n'est pas configuré ; jeton lu dans l'en-tête seulement
+    # (jamais en query string : il finirait dans les logs d'accès) -> None ou (réponse, status)
+    if not KEYS_ADMIN_TOKEN:
+        return {"error": "KEYS_ADMIN_TOKEN non configure"}, 403
+    supplied = request.headers.get("X-Admin-Token") or ""
+    if not hmac.compare_digest(supplied.encode("utf-8"), KEYS_ADMIN_TOKEN.encode("utf-8")):
+        return {"error": "Non autorise"}, 401
+    return None
+
+def _keys_admin_denied():
+    error = _admin_token_error()
+    return (jsonify(error[0]), error[1]) if error else None
+
+@app.route("/google/credentials", methods=["GET"])
+def google_credentials_metrics():
+    # Âge des jetons et latence des rafraîchissements (sans jamais exposer les jetons)
+    denied = _keys_admin_denied()
+    if denied:
+        return denied
+    return jsonify(get_google_credentials_manager().metrics()), 200
+
+@app.route("/keys/levels", methods=["GET"])
+def keys_levels():
+    denied = _keys_admin_denied()
+    if denied:
+        return denied
+    snapshot = get_key_levels().snapshot()
+    stores = _all_key_stores()
+    ranges = []
+    for store_id, counts in snapshot["ranges"].items():
+        if store_id not in stores:
+            continue
+        ranges.append({
+            **stores[store_id].describe(),
+            "skus": _skus_for_store(store_id),
+            **counts,
+            "low": bool(snapshot["alert_threshold"]) and counts["free"] < snapshot["alert_threshold"],
+        })
+    return jsonify({
+        "refreshed_at": snapshot["refreshed_at"],
+        "alert_threshold": snapshot["alert_threshold"],
+        "ranges": ranges,
+    }), 200
+
+@app.route("/keys/archive", methods=["POST"])
+def keys_archive():
+    denied = _keys_admin_denied()
+    if denied:
+        return denied
+    if KEY_INVENTORY_DB:
+        get_key_inventory().sync_pending()
+    only_range = request.args.get("range_name")
+    results = []
+    for spreadsheet_id, range_name in _all_key_ranges():
+        if only_range and range_name != only_range:
+            continue
+        try:
+            results.append({"range_name": range_name, "archived": archive_used_keys(spreadsheet_id, range_name)})
+        except Exception as e:
+            log(f"❌ Archivage {range_name} échoué: {e}")
+            results.append({"range_name": range_name, "error": str(e)})
+    status = 500 if any("error" in r for r in results) else 200
+    return jsonify({"ranges": results}), status
+
+@app.route("/keys/import", methods=["POST"])
+def keys_import():
+    # Corps = CSV (format keys.csv ou une clé par ligne) ; ?sku=<SKU> choisit le range/store cible
+    denied = _keys_admin_denied()
+    if denied:
+        return denied
+    sku = (request.args.get("sku") or "").strip().upper()
+    config = find_product_config_for_sku(sku) if sku else None
+    if not config:
+        return jsonify({"error": f"SKU inconnu: {sku or '(vide)'}"}), 400
+    dry_run = request.args.get("dry_run") in {"1", "true", "yes"}
+    try:
+        lines = io.TextIOWrapper(request.stream, encoding="utf-8-sig", newline="")
+        result = import_license_keys(config, _keys_from_csv_lines(lines), dry_run=dry_run)
+    except Exception as e:
+        log(f"❌ Import clés {sku} échoué: {e}")
+        return jsonify({"error": str(e)}), 500
+    return jsonify(result), 200
+
 INVEST_SPREADSHEET_ID = "10FhSKicoGo2327o2Vx4B2NBv-zzyh4UFF4B2gSu2slY"  # ex: '1x9vyp_TLr7NJ...'
 INVEST_RANGE = "InvestIntents!A1"      
 
@@ -1423,8 +3180,6 @@ def append_row(spreadsheet_id, range_a1, row_values):
     ).execute()
 
 # --- CORS simple (autoriser footbar.com) ---
-from flask import make_response
-
 ALLOWED_ORIGIN = "https://footbar.com"  # ou ton domaine précis de boutique
 
 @app.after_request
@@ -1499,6 +3254,75 @@ def invest_intent():
 
     return jsonify({"message":"Intent enregistrée"}), 200
 
+# 🔥 Préchauffage du worker : le travail unique payé sinon par la première requête malchanceuse
+def _warmup_chrome():
+    chrome_path = find_chrome_binary()
+    if chrome_path is None:
+        raise SkipStep("aucun binaire Chrome/Chromium")
+    # Charge le binaire et ses bibliothèques en cache disque avant le premier rendu PDF
+    result = subprocess.run([str(chrome_path), "--version"], capture_output=True, text=True, timeout=30)
+    return (result.stdout or result.stderr).strip() or str(chrome_path)
+
+def _warmup_invoice_logo():
+    logo_path = Path("logo-footbar.png")
+    if not logo_path.exists():
+        raise SkipStep("logo-footbar.png absent")
+    return f"{len(image_data_uri(logo_path))} caractères"
+
+def _warmup_google_clients():
+    if not (os.environ.get("GOOGLE_CREDENTIALS") or os.environ.get("CREDENTIALS_FILE") or os.path.exists("credentials.json")):
+        raise SkipStep("credentials Google non configurés")
+    if get_google_credentials_manager().info().get("type") != "service_account":
+        # Jamais de flow OAuth interactif depuis le thread de préchauffage
+        raise SkipStep("credentials OAuth (dev local)")
+    # Cache du process (_google_services) : les threads de requête et de la file réutilisent ces clients
+    get_sheets_service()
+    get_drive_service()
+    return f"{len(_google_services)} client(s) Google partagé(s) construit(s), jeton obtenu"
+
+def _warmup_amazon_token():
+    if not AMAZON_LWA_CLIENT_ID or not AMAZON_LWA_CLIENT_SECRET or not AMAZON_LWA_REFRESH_TOKEN:
+        raise SkipStep("Amazon LWA non configuré")
+    get_amazon_access_token()
+
+def _warmup_app_store_token():
+    try:
+        warm_app_store_token()
+    except StoreReviewsConfigError as e:
+        raise SkipStep(str(e))
+
+_warmup_lock = threading.Lock()
+_warmup = None
+
+def start_warmup():
+    # Une fois par process : au démarrage (app.run) ou dans le post_fork gunicorn (gunicorn.conf.py)
+    global _warmup
+    with _warmup_lock:
+        if _warmup is None:
+            _warmup = Warmup([
+                ("chrome", _warmup_chrome),
+                ("invoice_logo", _warmup_invoice_logo),
+                ("google_clients", _warmup_google_clients),
+                ("amazon_lwa_token", _warmup_amazon_token),
+                ("app_store_token", _warmup_app_store_token),
+            ], log=log)
+            _warmup.start()
+        return _warmup
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    # Sonde de disponibilité : 503 tant que le préchauffage du worker n'est pas terminé
+    if _warmup is None:
+        return jsonify({"ready": True, "warmup": None}), 200
+    report = _warmup.report()
+    return jsonify(report), 200 if report["ready"] else 503
+
 if __name__ == "__main__":
+    if WARMUP_ON_BOOT:
+        start_warmup()
+    if WEBHOOK_ASYNC:
+        get_webhook_queue()
+    if KEY_PREFETCH_LOW_WATERMARK > 0:
+        get_key_prefetch_buffer()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
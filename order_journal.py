@@ -0,0 +1,133 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS order_journal (
+    order_key TEXT PRIMARY KEY,
+    to_email TEXT NOT NULL DEFAULT '',
+    language TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'open',
+    response TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS order_journal_keys (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_key TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    key TEXT NOT NULL,
+    claimed_at REAL NOT NULL,
+    emailed_at REAL,
+    UNIQUE (order_key, key)
+);
+CREATE INDEX IF NOT EXISTS order_journal_keys_order_idx ON order_journal_keys (order_key);
+CREATE INDEX IF NOT EXISTS order_journal_status_idx ON order_journal (status, updated_at);
+"""
+
+
+class OrderJournal:
+    """
+    Journal de traitement par commande (SQLite, partagé par les workers) : clés réservées par SKU,
+    puis chaque email envoyé. Une nouvelle tentative après un échec partiel reprend à la dernière étape
+    faite : elle réutilise les clés déjà réservées et n'envoie que les emails manquants.
+
+    Statuts : open (en cours ou interrompue) -> completed (tous les emails envoyés, réponse mémorisée).
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, order_key):
+        """None si la commande n'a pas de journal, sinon l'entrée et ses clés dans l'ordre de réservation."""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT to_email, language, status, response FROM order_journal WHERE order_key = ?", (order_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        to_email, language, status, response = row
+        keys = [
+            {"sku": sku, "key": key, "emailed": emailed_at is not None}
+            for sku, key, emailed_at in conn.execute(
+                "SELECT sku, key, emailed_at FROM order_journal_keys WHERE order_key = ? ORDER BY id", (order_key,))
+        ]
+        return {
+            "order_key": order_key,
+            "to_email": to_email,
+            "language": language,
+            "status": status,
+            "response": json.loads(response) if response else None,
+            "keys": keys,
+        }
+
+    def open(self, order_key, to_email, language):
+        now = time.time()
+        self._conn().execute(
+            """
+            INSERT INTO order_journal (order_key, to_email, language, created_at, updated_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (order_key) DO UPDATE SET updated_at = excluded.updated_at
+            """,
+            (order_key, to_email or "", language or "", now, now),
+        )
+
+    def record_claims(self, order_key, sku, keys):
+        now = time.time()
+        self._conn().executemany(
+            "INSERT OR IGNORE INTO order_journal_keys (order_key, sku, key, claimed_at) VALUES (?, ?, ?, ?)",
+            [(order_key, sku, key, now) for key in keys],
+        )
+
+    def mark_emailed(self, order_key, key):
+        self._conn().execute(
+            "UPDATE order_journal_keys SET emailed_at = ? WHERE order_key = ? AND key = ?", (time.time(), order_key, key))
+
+    def complete(self, order_key, response):
+        self._conn().execute(
+            "UPDATE order_journal SET status = 'completed', response = ?, updated_at = ? WHERE order_key = ?",
+            (json.dumps(response, ensure_ascii=False), time.time(), order_key),
+        )
+
+    def reset(self, order_key):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM order_journal_keys WHERE order_key = ?", (order_key,))
+            conn.execute("DELETE FROM order_journal WHERE order_key = ?", (order_key,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def purge_completed(self, older_than_seconds):
+        """Oublie les commandes terminées depuis plus de older_than_seconds ; retourne leur nombre."""
+        cutoff = time.time() - older_than_seconds
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                """
+                DELETE FROM order_journal_keys WHERE order_key IN (
+                    SELECT order_key FROM order_journal WHERE status = 'completed' AND updated_at < ?)
+                """,
+                (cutoff,),
+            )
+            purged = conn.execute(
+                "DELETE FROM order_journal WHERE status = 'completed' AND updated_at < ?", (cutoff,)).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return purged
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+MEMO_MAX_SIZE = 4096
+
+
+class SkuRouterConfigError(RuntimeError):
+    pass
+
+
+class SkuRouter:
+    """
+    Table de routage SKU -> config produit : correspondance exacte d'abord, puis motifs regex
+    (dans l'ordre) compilés en une seule alternative nommée. Les résultats sont mémoïsés.
+    Immuable une fois construit : un rechargement remplace l'instance entière.
+    """
+
+    def __init__(self, exact, patterns):
+        self.exact = dict(exact)
+        self.patterns = [(re.compile(p) if isinstance(p, str) else p, cfg) for p, cfg in patterns]
+        self._configs = [cfg for _, cfg in self.patterns]
+        self._combined = None
+        if self.patterns:
+            self._combined = re.compile("|".join(
+                f"(?P<p{i}>{pattern.pattern})" for i, (pattern, _) in enumerate(self.patterns)
+            ))
+        self._memo = {}
+
+    def lookup(self, sku):
+        try:
+            return self._memo[sku]
+        except KeyError:
+            pass
+        config = self.exact.get(sku)
+        if config is None and self._combined is not None:
+            match = self._combined.match(sku)
+            if match:
+                config = self._configs[int(match.lastgroup[1:])]
+        if len(self._memo) >= MEMO_MAX_SIZE:
+            self._memo.clear()
+        self._memo[sku] = config
+        return config
+
+    def configs(self):
+        return list(self.exact.values()) + list(self._configs)
+
+
+def router_from_json(payload):
+    """
+    {"products": {"SKU": {...}}, "patterns": [{"pattern": "^B2B(015|020)_1_AN$", ...config}]}
+    """
+    if not isinstance(payload, dict):
+        raise SkuRouterConfigError("La config produits doit etre un objet JSON.")
+    products = payload.get("products") or {}
+    patterns = payload.get("patterns") or []
+    if not isinstance(products, dict) or not isinstance(patterns, list):
+        raise SkuRouterConfigError("'products' doit etre un objet et 'patterns' une liste.")
+    exact = {str(sku).strip().upper(): dict(cfg) for sku, cfg in products.items()}
+    compiled = []
+    for entry in patterns:
+        cfg = dict(entry)
+        pattern = cfg.pop("pattern", None)
+        if not pattern:
+            raise SkuRouterConfigError(f"Motif manquant dans {entry!r}")
+        try:
+            compiled.append((re.compile(pattern), cfg))
+        except re.error as e:
+            raise SkuRouterConfigError(f"Motif invalide {pattern!r}: {e}") from e
+    return SkuRouter(exact, compiled)
+
+
+class ReloadingSkuRouter:
+    """
+    Charge la table depuis `path` (ou le JSON `inline_json`), à défaut `default_router`,
+    et la recharge quand le fichier change (vérifié au plus toutes les `check_seconds`).
+    Une config invalide est ignorée : la table précédente reste active.
+    """
+
+    def __init__(self, default_router, path=None, inline_json=None, check_seconds=5, log=None):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.log = log or logger.info
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._router = default_router
+        if inline_json:
+            self._router = router_from_json(json.loads(inline_json))
+        elif path:
+            self._reload_if_changed(force=True)
+
+    def _reload_if_changed(self, force=False):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            if force:
+                self.log(f"⚠️ Config produits {self.path} illisible ({e}), table intégrée utilisée")
+            return
+        if not force and mtime == self._mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                router = router_from_json(json.load(f))
+        except Exception as e:
+            self.log(f"⚠️ Config produits {self.path} invalide, table précédente conservée: {e}")
+            self._mtime = mtime
+            return
+        self._router = router
+        self._mtime = mtime
+        self.log(f"🔁 Config produits chargée depuis {self.path}: {len(router.exact)} SKU(s), {len(router.patterns)} motif(s)")
+
+    def current(self):
+        if self.path:
+            now = time.monotonic()
+            if now - self._checked_at >= self.check_seconds:
+                with self._lock:
+                    if now - self._checked_at >= self.check_seconds:
+                        self._checked_at = now
+                        self._reload_if_changed()
+        return self._router
+
+    def lookup(self, sku):
+        return self.current().lookup(sku)
@@ -0,0 +1,71 @@
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class SkipStep(Exception):
+    """Étape non applicable à ce déploiement (service non configuré, binaire absent...)."""
+
+
+class Warmup:
+    """
+    Étape de préchauffage exécutée une fois par process (au démarrage, ou dans post_fork gunicorn) :
+    calcule à l'avance ce que la première requête paierait sinon (sonde Chrome, logo encodé, client et
+    jeton Google, jetons LWA / App Store) et chronomètre chaque étape.
+
+    steps = [(nom, fn)] ; fn() retourne un détail optionnel, lève SkipStep si l'étape ne s'applique pas.
+    Une étape en échec est journalisée sans bloquer les suivantes : le process devient prêt (ready)
+    une fois toutes les étapes passées, la première requête refera simplement le travail manquant.
+    """
+
+    def __init__(self, steps, log=None):
+        self.steps = list(steps)
+        self.log = log or logger.info
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started_at = None
+        self._finished_at = None
+        self._results = []
+
+    def run(self):
+        self._started_at = time.time()
+        started = time.perf_counter()
+        for name, fn in self.steps:
+            step_started = time.perf_counter()
+            try:
+                detail = fn()
+                status = "ok"
+            except SkipStep as e:
+                detail, status = str(e) or None, "skipped"
+            except Exception as e:
+                detail, status = str(e), "error"
+            elapsed_ms = round((time.perf_counter() - step_started) * 1000, 1)
+            with self._lock:
+                self._results.append({"step": name, "status": status, "ms": elapsed_ms, "detail": detail})
+            self.log(f"🔥 Warmup {name}: {status} en {elapsed_ms} ms" + (f" ({detail})" if detail else ""))
+        self._finished_at = time.time()
+        self.ready.set()
+        self.log(f"✅ Warmup terminé en {round((time.perf_counter() - started) * 1000, 1)} ms")
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self._thread
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def report(self):
+        with self._lock:
+            steps = [dict(result) for result in self._results]
+        return {
+            "ready": self.ready.is_set(),
+            "started_at": self._started_at,
+            "finished_at": self._finished_at,
+            "total_ms": round(sum(step["ms"] for step in steps), 1),
+            "steps": steps,
+        }
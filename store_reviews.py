@@ -1,15 +1,12 @@
 import datetime
 import json
 import os
+import threading
 from pathlib import Path
 from urllib.parse import quote
 
-import jwt
-import pycountry
 import requests
 from flask import Blueprint, Response, jsonify, request
-from google.auth.transport.requests import Request as GoogleAuthRequest
-from google.oauth2 import service_account
 
 
 ANDROID_PUBLISHER_SCOPE = "https://www.googleapis.com/auth/androidpublisher"
@@ -24,6 +21,10 @@ APP_STORE_DEFAULT_LOOKUP_COUNTRIES = [
 
 bp = Blueprint("store_reviews", __name__, url_prefix="/store-reviews")
 
+# JWT App Store Connect (valable 20 min) réutilisé tant qu'il lui reste plus d'une minute
+_app_store_token_lock = threading.Lock()
+_app_store_token_cache = {"token": None, "expires_at": 0}
+
 
 class StoreReviewsConfigError(RuntimeError):
     pass
@@ -210,6 +211,9 @@ def _google_play_service_account_info():
 
 
 def _google_play_access_token():
+    from google.auth.transport.requests import Request as GoogleAuthRequest
+    from google.oauth2 import service_account
+
     credentials = service_account.Credentials.from_service_account_info(
         _google_play_service_account_info(),
         scopes=[ANDROID_PUBLISHER_SCOPE],
@@ -311,6 +315,21 @@ def _app_store_private_key():
 
 
 def _app_store_token():
+    with _app_store_token_lock:
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        if _app_store_token_cache["token"] and now < _app_store_token_cache["expires_at"] - 60:
+            return _app_store_token_cache["token"]
+        token = _mint_app_store_token(now)
+        _app_store_token_cache.update(token=token, expires_at=now + 20 * 60)
+        return token
+
+
+def warm_app_store_token():
+    # Préchauffage du worker : JWT signé avant la première requête (StoreReviewsConfigError si non configuré)
+    return _app_store_token()
+
+
+def _mint_app_store_token(now):
     issuer_id = _env("APP_STORE_CONNECT_ISSUER_ID")
     key_id = _env("APP_STORE_CONNECT_KEY_ID")
     if not issuer_id or not key_id:
@@ -318,7 +337,8 @@ def _app_store_token():
             "App Store non configure: definissez APP_STORE_CONNECT_ISSUER_ID et APP_STORE_CONNECT_KEY_ID."
         )
 
-    now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+    import jwt
+
     return jwt.encode(
         {"iss": issuer_id, "iat": now, "exp": now + 20 * 60, "aud": "appstoreconnect-v1"},
         _app_store_private_key(),
@@ -424,6 +444,8 @@ def _territory_code_to_lookup_country(territory_code):
     if code.upper() in aliases:
         return aliases[code.upper()]
 
+    import pycountry
+
     country = pycountry.countries.get(alpha_3=code.upper())
     return country.alpha_2.lower() if country else None
 
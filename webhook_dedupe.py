@@ -0,0 +1,119 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Seuls ces champs de la réponse sont gardés pour le rejeu : ni clés de licence, ni emails, ni messages
+REPLAY_FIELDS = ("order_id", "job_id", "total_keys")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_dedupe (
+    fingerprint TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    response TEXT,
+    status_code INTEGER,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS webhook_dedupe_expiry_idx ON webhook_dedupe (expires_at);
+"""
+
+
+class WebhookDedupe:
+    """
+    Empreintes des webhooks déjà reçus (SQLite, partagé par les workers) : un renvoi de Shopify Flow
+    (timeout, retry) rejoue la réponse d'origine sans retoucher Sheets ni CR7M.
+
+    begin(empreinte) réserve l'empreinte ('pending', bail de pending_seconds) ou retourne
+    l'enregistrement existant ; complete() mémorise un résumé de la réponse (REPLAY_FIELDS + order_id,
+    status) pour ttl_seconds ; release() oublie l'empreinte (échec : le renvoi suivant retraitera).
+    Un 'pending' dont le bail a expiré (worker tué en plein traitement) est repris par le renvoi suivant.
+    """
+
+    def __init__(self, db_path, pending_seconds=900, purge_every_seconds=60):
+        self.db_path = db_path
+        self.pending_seconds = pending_seconds
+        self.purge_every_seconds = purge_every_seconds
+        self._local = threading.local()
+        self._last_purge = 0.0
+        self._conn().executescript(SCHEMA)
+        self._scrub_responses()
+
+    @staticmethod
+    def _summary(response, order_id=None):
+        response = response if isinstance(response, dict) else {}
+        summary = {name: response[name] for name in REPLAY_FIELDS if response.get(name) is not None}
+        if order_id:
+            summary["order_id"] = order_id
+        return summary
+
+    def _scrub_responses(self):
+        # Réponses complètes enregistrées avant REPLAY_FIELDS : réduites à leur résumé
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT fingerprint, response FROM webhook_dedupe WHERE response IS NOT NULL").fetchall()
+        scrubbed = []
+        for fingerprint, response in rows:
+            summary = json.dumps(self._summary(json.loads(response)), ensure_ascii=False)
+            if summary != response:
+                scrubbed.append((summary, fingerprint))
+        if scrubbed:
+            conn.executemany("UPDATE webhook_dedupe SET response = ? WHERE fingerprint = ?", scrubbed)
+            logger.info("Déduplication webhooks: %s réponse(s) réduite(s) à leur résumé", len(scrubbed))
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def begin(self, fingerprint):
+        """(True, None) si l'empreinte est nouvelle (réservée), sinon (False, {"status", "response", "status_code"})."""
+        now = time.time()
+        conn = self._conn()
+        if now - self._last_purge >= self.purge_every_seconds:
+            self._last_purge = now
+            conn.execute("DELETE FROM webhook_dedupe WHERE expires_at <= ?", (now,))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT status, response, status_code FROM webhook_dedupe WHERE fingerprint = ? AND expires_at > ?",
+                (fingerprint, now),
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO webhook_dedupe (fingerprint, status, created_at, expires_at)
+                    VALUES (?, 'pending', ?, ?)
+                    """,
+                    (fingerprint, now, now + self.pending_seconds),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return True, None
+        status, response, status_code = row
+        return False, {
+            "status": status,
+            "response": json.loads(response) if response else None,
+            "status_code": status_code,
+        }
+
+    def complete(self, fingerprint, response, status_code, ttl_seconds, order_id=None):
+        now = time.time()
+        self._conn().execute(
+            "UPDATE webhook_dedupe SET status = 'done', response = ?, status_code = ?, expires_at = ? WHERE fingerprint = ?",
+            (json.dumps(self._summary(response, order_id), ensure_ascii=False), status_code, now + ttl_seconds, fingerprint),
+        )
+
+    def release(self, fingerprint):
+        self._conn().execute("DELETE FROM webhook_dedupe WHERE fingerprint = ? AND status = 'pending'", (fingerprint,))
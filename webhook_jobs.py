@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_token TEXT,
+    lease_until REAL,
+    result TEXT,
+    status_code INTEGER,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS webhook_jobs_ready_idx ON webhook_jobs (status, available_at);
+"""
+
+# Seuls ces champs de la réponse du handler sont conservés : ni clés de licence, ni emails, ni lignes
+RESULT_FIELDS = ("error", "total_keys")
+
+COLUMNS = (
+    "id", "kind", "payload", "status", "attempts", "available_at", "lease_token", "lease_until",
+    "result", "status_code", "last_error", "created_at", "updated_at",
+)
+
+
+class WebhookJobQueue:
+    """
+    File durable des webhooks (SQLite, partagée par les workers gunicorn de la machine) : le handler HTTP
+    enregistre le payload et répond 202 ; des threads de fond exécutent les jobs et réessaient.
+
+    handlers = {kind: fn(payload) -> (réponse, status)}. Un status >= 500 ou une exception replanifie
+    le job (backoff exponentiel depuis retry_seconds) jusqu'à max_attempts, puis le job passe 'failed' ;
+    un status < 500 le termine ('done'). Un job 'running' dont le bail expire (worker tué en plein
+    traitement) est repris par un autre worker.
+
+    Statuts : queued -> running -> done | failed (ou retour à queued pour une nouvelle tentative).
+
+    Données personnelles : la réponse du handler n'est conservée que sous forme de résumé opaque
+    (RESULT_FIELDS + status) et le payload (email, adresse, lignes) est effacé dès que le job est 'done' ;
+    un job 'failed' garde son payload pour analyse, jamais exposé par get().
+    """
+
+    def __init__(self, db_path, handlers, max_attempts=5, retry_seconds=30, lease_seconds=900, log=None):
+        self.db_path = db_path
+        self.handlers = handlers
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.lease_seconds = lease_seconds
+        self.log = log or logger.info
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL : un job enregistré survit à l'arrêt du process (pas à une coupure machine) ;
+            # pas de fsync par enqueue, verrou d'écriture tenu moins longtemps
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _rows(self, sql, params=()):
+        return [
+            dict(zip(COLUMNS, row))
+            for row in self._conn().execute(f"SELECT {', '.join(COLUMNS)} FROM webhook_jobs {sql}", params)
+        ]
+
+    def enqueue(self, kind, payload):
+        """Enregistre le job (durable au retour) et réveille les workers du process ; retourne son id."""
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO webhook_jobs (kind, payload, available_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload, ensure_ascii=False), now, now, now),
+        )
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def get(self, job_id):
+        rows = self._rows("WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = rows[0]
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        del job["payload"], job["lease_token"]
+        return job
+
+    def stats(self):
+        counts = dict(self._conn().execute("SELECT status, COUNT(*) FROM webhook_jobs GROUP BY status").fetchall())
+        oldest = self._conn().execute(
+            "SELECT MIN(created_at) FROM webhook_jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+        return {
+            "jobs": counts,
+            "oldest_pending_age_seconds": round(time.time() - oldest, 1) if oldest else None,
+            "workers": len([t for t in self._workers if t.is_alive()]),
+        }
+
+    def claim(self):
+        """Prend le prochain job prêt (ou dont le bail a expiré) ; None si la file est vide."""
+        now = time.time()
+        conn = self._conn()
+        # Lecture seule d'abord : les workers au repos ne prennent pas le verrou d'écriture (enqueue non bloqué)
+        ready = conn.execute(
+            """
+            SELECT 1 FROM webhook_jobs
+            WHERE (status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_until <= ?) LIMIT 1
+            """,
+            (now, now),
+        ).fetchone()
+        if not ready:
+            return None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._rows(
+                """
+                WHERE (status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_until <= ?)
+                ORDER BY id LIMIT 1
+                """,
+                (now, now),
+            )
+            if not rows:
+                conn.execute("COMMIT")
+                return None
+            job = rows[0]
+            job["lease_token"] = uuid.uuid4().hex
+            job["attempts"] += 1
+            conn.execute(
+                """
+                UPDATE webhook_jobs SET status = 'running', attempts = ?, lease_token = ?, lease_until = ?,
+                                        updated_at = ?
+                WHERE id = ?
+                """,
+                (job["attempts"], job["lease_token"], now + self.lease_seconds, now, job["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def _finish(self, job, status, result=None, status_code=None, error=None, available_at=None):
+        # Ignoré si le bail a été repris entre-temps par un autre worker
+        summary = {k: result[k] for k in RESULT_FIELDS if k in result} if isinstance(result, dict) else None
+        self._conn().execute(
+            """
+            UPDATE webhook_jobs SET status = ?, result = ?, status_code = ?, last_error = ?,
+                                    payload = CASE WHEN ? = 'done' THEN '{}' ELSE payload END,
+                                    available_at = COALESCE(?, available_at), lease_token = NULL,
+                                    lease_until = NULL, updated_at = ?
+            WHERE id = ? AND lease_token = ?
+            """,
+            (status, json.dumps(summary, ensure_ascii=False) if summary is not None else None, status_code, error,
+             status, available_at, time.time(), job["id"], job["lease_token"]),
+        )
+
+    def run_one(self):
+        """Exécute un job prêt ; retourne False si la file est vide."""
+        job = self.claim()
+        if job is None:
+            return False
+        try:
+            result, status_code = self.handlers[job["kind"]](job["payload"])
+            error = result.get("error") if status_code >= 500 and isinstance(result, dict) else None
+        except Exception as e:
+            result, status_code, error = None, None, f"{type(e).__name__}: {e}"
+
+        if status_code is not None and status_code < 500:
+            self._finish(job, "done", result, status_code)
+            self.log(f"✅ Job webhook {job['id']} ({job['kind']}) terminé: {status_code}")
+        elif job["attempts"] >= self.max_attempts:
+            self._finish(job, "failed", result, status_code, error)
+            self.log(f"❌ Job webhook {job['id']} ({job['kind']}) abandonné après {job['attempts']} tentative(s): {error}")
+        else:
+            delay = self.retry_seconds * (2 ** (job["attempts"] - 1))
+            self._finish(job, "queued", result, status_code, error, available_at=time.time() + delay)
+            self.log(f"🔁 Job webhook {job['id']} ({job['kind']}) replanifié dans {delay:.0f}s: {error}")
+        return True
+
+    def start(self, workers, poll_seconds=1.0):
+        if any(t.is_alive() for t in self._workers):
+            return self._workers
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    if self.run_one():
+                        continue
+                except Exception as e:
+                    logger.warning("Worker de jobs webhook: %s", e)
+                # Réveillé aussitôt par un enqueue du process, sinon poll (jobs des autres workers, retries)
+                self._wakeup.wait(poll_seconds)
+                self._wakeup.clear()
+
+        self._workers = [
+            threading.Thread(target=run, name=f"webhook-jobs-{os.getpid()}-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._workers:
+            thread.start()
+        return self._workers
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()